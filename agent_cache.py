@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from db_connection import database_connection
+from config import AGENT_CACHE_TTL, TEAM_CACHE_MAX_TEAMS, TEAM_CACHE_MAX_IDLE_PER_TEAM
+
+
+''' In process cache of agentdata rows used to configure team agents, keyed by agentid.
+    Cleared when agents are created or deleted, and entries expire after ttl seconds in case
+    another worker changed the table.
+'''
+class AgentConfigCache:
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        # agentid -> ((agentspecialisation, agentconfig, temperature), time cached)
+        self._configs = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, agent_ids):
+        # Returns the (agentspecialisation, agentconfig, temperature) rows in the order the ids were given,
+        # fetching any that are not cached in one query
+        # Ids arrive from the client as strings - cache under the string form
+        agent_ids = [str(agent_id) for agent_id in agent_ids]
+        now = time.monotonic()
+        with self._lock:
+            missing = [agent_id for agent_id in set(agent_ids)
+                       if agent_id not in self._configs or self._configs[agent_id][1] + self.ttl < now]
+            self.hits += len(agent_ids) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            with database_connection() as conn:
+                cursor = conn.cursor()
+                placeholders = ", ".join(["%s"] * len(missing))
+                query = f"SELECT agentid, agentspecialisation, agentconfig, temperature FROM agentdata WHERE agentid IN ({placeholders})"
+                cursor.execute(query, tuple(missing))
+                result = cursor.fetchall()
+                cursor.close()
+            with self._lock:
+                for agentid, specialisation, config, temperature in result:
+                    self._configs[str(agentid)] = ((specialisation, config, temperature), now)
+
+        with self._lock:
+            return [self._configs[agent_id][0] for agent_id in agent_ids if agent_id in self._configs]
+
+    def invalidate(self, agent_id=None):
+        with self._lock:
+            if agent_id is None:
+                self._configs.clear()
+            else:
+                self._configs.pop(str(agent_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {"agents": len(self._configs), "hits": self.hits, "misses": self.misses}
+
+
+''' Prebuilt team chats (user proxy, the three team agents, group chat and manager) keyed by the agent ids,
+    so repeat team messages skip building the agents and group chat. A team is checked out by one
+    conversation at a time, then reset and kept for the next message to the same team.
+'''
+class TeamCache:
+
+    def __init__(self, max_teams=100, max_idle_per_team=2):
+        # Number of different teams kept - least recently used are dropped first
+        self.max_teams = max_teams
+        # Prebuilt copies kept per team for concurrent conversations
+        self.max_idle_per_team = max_idle_per_team
+        self._teams = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on invalidate so teams checked out before then are not put back
+        self._generation = 0
+        self.built = 0
+        self.reused = 0
+
+    @contextmanager
+    def checkout(self, key, build):
+        with self._lock:
+            idle = self._teams.get(key)
+            team = idle.pop() if idle else None
+            if team is not None:
+                self.reused += 1
+                self._teams.move_to_end(key)
+        if team is None:
+            team = build()
+            with self._lock:
+                self.built += 1
+                team["generation"] = self._generation
+        try:
+            yield team
+        finally:
+            self._release(key, team)
+
+    def invalidate(self):
+        with self._lock:
+            self._teams.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "teams": len(self._teams),
+                "idle": sum(len(idle) for idle in self._teams.values()),
+                "built": self.built,
+                "reused": self.reused,
+            }
+
+    def _release(self, key, team):
+        try:
+            # Clear every agent's history and the group chat messages before the team is reused
+            for agent in [team["user_proxy"], team["manager"]] + list(team["agents"]):
+                agent.reset()
+            team["groupchat"].reset()
+        except Exception as e:
+            print(f"Error resetting team: {str(e)}")
+            return
+        with self._lock:
+            if team.get("generation") != self._generation:
+                return
+            idle = self._teams.setdefault(key, [])
+            self._teams.move_to_end(key)
+            if len(idle) < self.max_idle_per_team:
+                idle.append(team)
+            while len(self._teams) > self.max_teams:
+                self._teams.popitem(last=False)
+
+
+# Process wide caches used by the chat routes and socket handlers
+agent_configs = AgentConfigCache(ttl=AGENT_CACHE_TTL)
+team_cache = TeamCache(max_teams=TEAM_CACHE_MAX_TEAMS, max_idle_per_team=TEAM_CACHE_MAX_IDLE_PER_TEAM)
+
+def invalidate_agent_caches():
+    # Called when agentdata changes - teams are built from the cached configs so are dropped too
+    agent_configs.invalidate()
+    team_cache.invalidate()
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
-from db_connection import connect_to_database
+from db_connection import database_connection
+from agent_cache import invalidate_agent_caches
 
 agent_blueprint = Blueprint('agent', __name__)
 
@@ -15,22 +16,22 @@ def create_agent():
         #Extract prompt from payload
         prompt = data.get('prompt')
 
-        #call connect_to_database - get database connection
-        conn = connect_to_database()
-        # create curor obrct for sending query
-        cursor = conn.cursor()
-        #execute the query
-        cursor.execute(
-            "INSERT INTO agentdata (useremail, agentspecialisation, agentconfig, temperature, userintervention) VALUES (%s, %s, %s, %s, %s)",
-            (email, specialisation, prompt, 0.0, False)
-        )
-        
-        #commit transaction
-        conn.commit()
-        #close the curson
-        cursor.close()
-        #close the database connection
-        conn.close()
+        #checkout a database connection from the pool - returned to the pool when the block ends
+        with database_connection() as conn:
+            # create curor obrct for sending query
+            cursor = conn.cursor()
+            #execute the query
+            cursor.execute(
+                "INSERT INTO agentdata (useremail, agentspecialisation, agentconfig, temperature, userintervention) VALUES (%s, %s, %s, %s, %s)",
+                (email, specialisation, prompt, 0.0, False)
+            )
+
+            #commit transaction
+            conn.commit()
+            #close the curson
+            cursor.close()
+        #Clear the cached agent configs and teams so the next team chat reads the current agentdata
+        invalidate_agent_caches()
         
         result = "Agent Created"
         #Return the message
@@ -47,15 +48,16 @@ def retrieve_agents():
         #Extract email from payload
         email = data['email']
         
-        conn = connect_to_database()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT agentspecialisation, agentconfig, agentid FROM agentdata WHERE useremail = %s OR useremail = 'system@example.com'", 
-            (email,)
-        )
-        #fetch all used for gathering all agents associated with the passed email
-        result = cursor.fetchall()
+        with database_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                "SELECT agentspecialisation, agentconfig, agentid FROM agentdata WHERE useremail = %s OR useremail = 'system@example.com'", 
+                (email,)
+            )
+            #fetch all used for gathering all agents associated with the passed email
+            result = cursor.fetchall()
+            cursor.close()
         #format the result for extraction on the client side
         #https://www.geeksforgeeks.org/nested-list-comprehensions-in-python/
         formatted_result = [[[agentspecialisation], [agentconfig], [agentid]] for agentspecialisation, agentconfig, agentid in result]
@@ -65,9 +67,6 @@ def retrieve_agents():
         if not result:
             chat_content = "<div id='previous_chat_error'><h1 id='returned_data'>Could not fetch agent</h1><br /><h3 id='previous_chat_error_sub'>Please try again later</h3></div>"  
             return jsonify({"message": chat_content}), 200
-            
-        cursor.close()
-        conn.close()
         
         return jsonify({"message": formatted_result}), 200
     except Exception as e:
@@ -1,35 +1,114 @@
+import threading
+from contextlib import contextmanager
 import autogen
 from flask_socketio import SocketIO
 from dotenv import load_dotenv
-from config import LLM_CONFIG
+from config import LLM_CONFIG, AGENT_POOL_MAX_IDLE
+from jobs import register_cancellation
+from llm_usage import track_agent
+from code_executor import code_execution_config
+# Imported for its side effect - every agent built from LLM_CONFIG shares the gateway's pooled HTTP client
+import llm_gateway
+from tracing import tracer
+
+# Every agent reply and speaker selection is traced - patched before any agent is built
+tracer.instrument_autogen(autogen)
 
 load_dotenv()
 
 
-user_proxy = autogen.UserProxyAgent(
-    # Give user proxy a name
-    name="User_Proxy",
-    # description="You are an advanced User Proxy Agent that serves as the bridge between the user request and the agent team. You facilitate communication, provide user context, and execute code and scripts when needed. You have the ability to run Python code, save files to disk, and verify output.",
-    # Execution parameter to be passed to proxy
-    code_execution_config={
-        # Directory to execute scripts and save files to.
-        "work_dir": "groupchat",
-        # Setting if docker is in use to false
-        "use_docker": False
-        
-        
-    },
-    # Currently never taking user input after first input
-    human_input_mode="NEVER",
-    # Max number of auto replies before terminating conversation.
-    max_consecutive_auto_reply=3,
-)
-
-# Autogen assistant agent
-agent_one = autogen.AssistantAgent(
-    name="MultiTalentAgent",
-    llm_config=LLM_CONFIG,
-)
+#Builds a user proxy with the configuration used by the REST chat routes
+def create_user_proxy():
+    user_proxy = autogen.UserProxyAgent(
+        # Give user proxy a name
+        name="User_Proxy",
+        # description="You are an advanced User Proxy Agent that serves as the bridge between the user request and the agent team. You facilitate communication, provide user context, and execute code and scripts when needed. You have the ability to run Python code, save files to disk, and verify output.",
+        # Execution parameter to be passed to proxy
+        # Code blocks run in the warm executor pool, in the groupchat directory - see code_executor.py
+        code_execution_config=code_execution_config("groupchat"),
+        # Currently never taking user input after first input
+        human_input_mode="NEVER",
+        # Max number of auto replies before terminating conversation.
+        max_consecutive_auto_reply=3,
+    )
+    # Let a cancelled chat job end the conversation at the next turn
+    register_cancellation(user_proxy)
+    return user_proxy
+
+#Builds the user proxy and assistant pair used by /chat
+def create_chat_agents():
+    # Autogen assistant agent
+    agent_one = autogen.AssistantAgent(
+        name="MultiTalentAgent",
+        llm_config=LLM_CONFIG,
+    )
+    register_cancellation(agent_one)
+    # Built in agents are accounted under their name rather than an agentdata id
+    track_agent(agent_one, agent_one.name)
+    return create_user_proxy(), agent_one
+
+#Builds the agent that combines the team's answers in the parallel team mode
+def create_synthesis_agent():
+    return track_agent(autogen.AssistantAgent(
+        name="Synthesiser",
+        system_message="You combine the answers of several specialists to the same question into one answer. "
+                       "Keep the points they agree on, settle or flag where they disagree, and credit a specialist "
+                       "when only they raised a point. Do not add a preamble.",
+        llm_config=LLM_CONFIG,
+    ), "Synthesiser")
+
+
+''' Hands out agents to one request at a time so concurrent conversations never share chat history.
+    Agents are reset and kept for the next request rather than rebuilt from scratch each time.
+'''
+class AgentPool:
+
+    def __init__(self, factory, max_idle=8):
+        # Function building a new agent or tuple of agents
+        self._factory = factory
+        # Number of reset agents kept ready for the next request
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                self._reused += 1
+                return self._idle.pop()
+            self._created += 1
+        return self._factory()
+
+    def release(self, agents):
+        try:
+            # Clear chat history, auto reply counters and usage so the next request starts fresh
+            for agent in (agents if isinstance(agents, tuple) else (agents,)):
+                agent.reset()
+        except Exception as e:
+            # Agents that fail to reset are not reused
+            print(f"Error resetting pooled agents: {str(e)}")
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(agents)
+
+    @contextmanager
+    def checkout(self):
+        agents = self.acquire()
+        try:
+            yield agents
+        finally:
+            self.release(agents)
+
+    def stats(self):
+        with self._lock:
+            return {"idle": len(self._idle), "created": self._created, "reused": self._reused}
+
+
+# (user_proxy, assistant) pairs for single agent chats - team chats are kept in agent_cache.team_cache
+chat_agent_pool = AgentPool(create_chat_agents, max_idle=AGENT_POOL_MAX_IDLE)
 
 ''' In order to implement websockets - I inherit from the autogen user proxy and added the socket io emmitting
     functionality to have realtime communication of agents display to the user
@@ -37,12 +116,16 @@ agent_one = autogen.AssistantAgent(
 class WebSocketUserProxy(autogen.UserProxyAgent):
 
     #*args and *kwars are used to ensure all positional and keyword arguments required for the user proxy initilisation
-    def __init__(self, session_id: str ,  socketio_instance: SocketIO, *args, **kwargs):
+    def __init__(self, session_id: str ,  socketio_instance: SocketIO, *args, message_log=None, **kwargs):
         super().__init__(*args, **kwargs)
         #session id used for emmiting data to the client
         self.session_id = session_id
         #THe websocket used for transfering daata
         self.socket_io = socketio_instance
+        #Optional message_log.MessageLog the received messages are written to as they arrive
+        self.message_log = message_log
+        #Id the messages are logged under - stays the same when a reconnected client resumes the conversation
+        self.conversation_id = session_id
 
 
     #https://microsoft.github.io/autogen/0.2/docs/reference/agentchat/conversable_agent
@@ -54,8 +137,13 @@ class WebSocketUserProxy(autogen.UserProxyAgent):
             #print for self testing and fixing of bugs 
             print(f"WebSocketUserProxy emitting to room {self.session_id}: {message}")
 
+            # Log the message - its index lets the client resume from it after reconnecting
+            payload = {'content': message}
+            if self.message_log is not None:
+                payload['index'] = self.message_log.append(self.conversation_id, getattr(sender, 'name', None), message)
+
             # emit the message
-            self.socket_io.emit('agent_message', {'content': message}, room=self.session_id)
+            self.socket_io.emit('agent_message', payload, room=self.session_id)
 
                 
         else:
@@ -68,3 +156,35 @@ class WebSocketUserProxy(autogen.UserProxyAgent):
         return super().receive(message=message, sender=sender, request_reply=request_reply, silent=silent)
 
 
+''' Output stream swapped in while the assistant generates a reply. With "stream": True in the llm config the OpenAI
+    client prints each chunk as it arrives - those chunks are emitted to the client as agent_message_delta events so
+    the reply appears while it is being written. The full reply is still emitted as agent_message by WebSocketUserProxy.
+'''
+class SocketIOStream:
+
+    def __init__(self, session_id: str, socketio_instance: SocketIO, sender_name: str):
+        self.session_id = session_id
+        self.socket_io = socketio_instance
+        #Name of the agent writing the reply - lets the client group the chunks
+        self.sender_name = sender_name
+        #Number of chunks emitted - sent with each chunk so the client can keep them in order
+        self.chunk_count = 0
+
+    def print(self, *objects, sep=" ", end="\n", flush=False):
+        text = sep.join(str(obj) for obj in objects)
+        #The client prints reply chunks with end="" and flush=True, everything else (colour codes, status lines)
+        #is left on the console as before
+        if end == "" and flush and text:
+            self.socket_io.emit('agent_message_delta', {
+                'content': text,
+                'sender': self.sender_name,
+                'index': self.chunk_count,
+            }, room=self.session_id)
+            self.chunk_count += 1
+        else:
+            print(text, end=end, flush=flush)
+
+    def input(self, prompt="", *, password=False):
+        #Agents run with human_input_mode="NEVER" so input is never requested over the socket
+        return ""
+
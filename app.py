@@ -1,5 +1,5 @@
 import dotenv
-from flask import Flask
+from flask import Flask, jsonify, Response
 from flask_cors import CORS
 from flask_socketio import SocketIO
 
@@ -8,9 +8,25 @@ from chat_routes import chat_blueprint
 from agent_routes import agent_blueprint
 from user_routes import user_blueprint
 from team_routes import team_blueprint
+from usage_routes import usage_blueprint
+from workspace_routes import workspace_blueprint
 
 # Import socket handlers to register them
 from socket_handlers import register_socket_handlers
+from db_connection import get_pool_stats
+from llm_cache import get_response_cache_stats
+from agent_cache import agent_configs, team_cache
+from message_log import message_log
+from speaker_selection import selection_stats
+from llm_gateway import llm_gateway
+from llm_usage import usage_recorder
+from code_executor import executor_pool, get_code_executor_stats
+from workspaces import workspace_manager
+from tracing import tracer
+from config import ACTIVE_SESSIONS, SOCKETIO_MESSAGE_QUEUE, SOCKETIO_CHANNEL, SOCKETIO_TRANSPORTS
+from async_runtime import active_mode, conversation_limiter
+from socketio_queue import create_client_manager, message_queue_name
+from session_tokens import check_shared_secret
 
 # Load environment variables
 dotenv.load_dotenv()
@@ -19,20 +35,124 @@ dotenv.load_dotenv()
 app = Flask(__name__)
 CORS(app, origins="http://localhost:5173")
 
+# Nodes sharing a message queue have to accept each other's session tokens
+check_shared_secret(SOCKETIO_MESSAGE_QUEUE)
+
 # Setup SocketIO
 socket_io = SocketIO(
     app, 
     cors_allowed_origins=["http://localhost:5173"],
+    # eventlet or gevent when started by serve.py with SERVER_ASYNC_MODE set, otherwise threading
+    async_mode=active_mode(),
+    # Emits go through the message queue to every node when more than one runs behind a load balancer
+    client_manager=create_client_manager(SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL),
+    transports=SOCKETIO_TRANSPORTS,
 )
 
+# Trace every HTTP request and Socket.IO emit - see tracing.py
+tracer.instrument_flask(app)
+tracer.instrument_socketio(socket_io)
+
 # Register blueprints
 app.register_blueprint(chat_blueprint)
 app.register_blueprint(agent_blueprint)
 app.register_blueprint(user_blueprint)
 app.register_blueprint(team_blueprint)
+app.register_blueprint(usage_blueprint)
+app.register_blueprint(workspace_blueprint)
 
 # Register socket handlers
 register_socket_handlers(socket_io)
 
+# Connection pool metrics (in use, idle, wait time) - used to size the database pool
+@app.route('/db_pool_stats', methods=['GET'])
+def db_pool_stats():
+    return jsonify({"message": get_pool_stats()}), 200
+
+# LLM response cache hit and miss counters
+@app.route('/llm_cache_stats', methods=['GET'])
+def llm_cache_stats():
+    return jsonify({"message": get_response_cache_stats()}), 200
+
+# Websocket session store size, memory use and evictions
+@app.route('/session_stats', methods=['GET'])
+def session_stats():
+    return jsonify({"message": ACTIVE_SESSIONS.stats()}), 200
+
+# Agent config and team cache hit counts
+@app.route('/agent_cache_stats', methods=['GET'])
+def agent_cache_stats():
+    return jsonify({"message": {"agents": agent_configs.stats(), "teams": team_cache.stats()}}), 200
+
+# Websocket message log - messages waiting to be written, written and failed writes
+@app.route('/message_log_stats', methods=['GET'])
+def message_log_stats():
+    return jsonify({"message": message_log.stats() if message_log is not None else {"enabled": False}}), 200
+
+# Team chat speakers chosen by rules (manager LLM calls saved) and by the manager's LLM
+@app.route('/speaker_selection_stats', methods=['GET'])
+def speaker_selection_stats():
+    return jsonify({"message": selection_stats.stats()}), 200
+
+# Requests made through the shared OpenAI HTTP client and how often they reused an open connection
+@app.route('/llm_gateway_stats', methods=['GET'])
+def llm_gateway_stats():
+    return jsonify({"message": llm_gateway.stats()}), 200
+
+
+@app.route('/llm_scheduler_stats', methods=['GET'])
+def llm_scheduler_stats():
+    scheduler = llm_gateway.scheduler
+    return jsonify({"message": scheduler.stats() if scheduler is not None else {"enabled": False}}), 200
+
+
+# Prometheus scrape endpoint - span latency histograms plus the pool, scheduler and usage gauges
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    pool = get_pool_stats()
+    gauges = {
+        "db_pool_in_use": ("Database connections checked out", pool["in_use"]),
+        "db_pool_idle": ("Idle database connections", pool["idle"]),
+        "active_sessions": ("Websocket sessions with agents", ACTIVE_SESSIONS.stats()["sessions"]),
+        "llm_requests": ("OpenAI requests sent by the gateway", llm_gateway.stats()["requests"]),
+    }
+    if llm_gateway.scheduler is not None:
+        gauges["llm_scheduler_queue_depth"] = ("LLM requests waiting for the rate limit", llm_gateway.scheduler.stats()["queue_depth"])
+    if usage_recorder is not None:
+        usage = usage_recorder.stats()
+        gauges["llm_prompt_tokens"] = ("Prompt tokens used since the server started", usage["prompt_tokens"])
+        gauges["llm_completion_tokens"] = ("Completion tokens used since the server started", usage["completion_tokens"])
+        gauges["llm_cost_usd"] = ("USD spent on LLM calls since the server started", usage["cost_usd"])
+    runtime = conversation_limiter.stats()
+    gauges["active_conversations"] = ("Conversations running", runtime["active_conversations"])
+    gauges["waiting_conversations"] = ("Conversations waiting for a slot", runtime["waiting_conversations"])
+    return Response(tracer.metrics_text(gauges), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/usage_stats', methods=['GET'])
+def usage_stats():
+    return jsonify({"message": usage_recorder.stats() if usage_recorder is not None else {"enabled": False}}), 200
+
+
+# Code blocks run by the user proxies' warm executor pool - executions, timeouts and replaced workers
+@app.route('/code_executor_stats', methods=['GET'])
+def code_executor_stats():
+    return jsonify({"message": get_code_executor_stats()}), 200
+
+# Code execution workspaces - how many, disk used and how many were removed at session end or when idle
+@app.route('/workspace_stats', methods=['GET'])
+def workspace_stats():
+    return jsonify({"message": workspace_manager.stats()}), 200
+
+# Worker model in use and the conversations running, waiting for a slot and turned away busy
+@app.route('/runtime_stats', methods=['GET'])
+def runtime_stats():
+    stats = conversation_limiter.stats()
+    stats["message_queue"] = message_queue_name(socket_io)
+    return jsonify({"message": stats}), 200
+
 if __name__ == '__main__':
+    # Workers import their modules while the server starts rather than on the first code block
+    if executor_pool is not None:
+        executor_pool.start()
     socket_io.run(app, debug=True, host='0.0.0.0', port=5000, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,114 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from config import SERVER_ASYNC_MODE, MAX_ACTIVE_CONVERSATIONS, CONVERSATION_WAIT_TIMEOUT, OFFLOAD_THREADS
+
+''' Runtime helpers for the async worker model - see serve.py. Under eventlet or gevent the standard library is
+    monkey patched, so OpenAI requests (httpx), locks, sleeps and subprocesses yield to other green threads instead
+    of blocking. What cannot be patched is made cooperative or offloaded:
+        - psycopg2 waits for the database through a wait callback on the patched select
+        - CPU bound work (chat compression) runs on a small pool of real OS threads
+    Every mode bounds how many conversations run at once so a burst queues instead of exhausting the process.
+'''
+
+
+#eventlet or gevent if the standard library has been patched by it, otherwise threading
+def active_mode():
+    if "gevent.monkey" in sys.modules and sys.modules["gevent.monkey"].is_module_patched("socket"):
+        return "gevent"
+    if "eventlet.patcher" in sys.modules and sys.modules["eventlet.patcher"].is_monkey_patched("socket"):
+        return "eventlet"
+    return "threading"
+
+
+#Lets other green threads run while psycopg2 waits on the database - call once after monkey patching
+def cooperative_database():
+    from psycopg2 import extensions, extras
+    extensions.set_wait_callback(extras.wait_select)
+
+
+#Runs a CPU bound call on a real OS thread so it does not hold up the green threads - called directly in
+#threading mode, where the caller already has a thread of its own
+def offload(fn, *args, **kwargs):
+    mode = active_mode()
+    if mode == "gevent":
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    if mode == "eventlet":
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+#Size of the OS thread pool offload() uses - call after monkey patching, before the first offload
+def configure_offload(threads):
+    mode = active_mode()
+    if mode == "gevent":
+        import gevent
+        gevent.get_hub().threadpool.maxsize = threads
+    elif mode == "eventlet":
+        from eventlet import tpool
+        tpool.set_num_threads(threads)
+
+
+class ServerBusyError(Exception):
+    pass
+
+
+''' Bounds the conversations running at once across the REST routes and websocket events. A conversation waits up
+    to wait_timeout seconds for a slot before ServerBusyError is raised.
+'''
+class ConversationLimiter:
+
+    def __init__(self, max_active=200, wait_timeout=30):
+        self.max_active = max_active
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_active)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_time = 0.0
+
+    @contextmanager
+    def slot(self):
+        started = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.wait_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.rejected += 1
+            else:
+                self.active += 1
+                self._wait_time += time.monotonic() - started
+        if not acquired:
+            raise ServerBusyError(f"Server busy - {self.max_active} conversations are already running")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            started = self.completed + self.active
+            return {
+                "mode": active_mode(),
+                "configured_mode": SERVER_ASYNC_MODE,
+                "max_active_conversations": self.max_active,
+                "active_conversations": self.active,
+                "waiting_conversations": self.waiting,
+                "completed_conversations": self.completed,
+                "rejected_conversations": self.rejected,
+                "avg_wait_ms": round(self._wait_time / started * 1000, 2) if started else 0.0,
+                "offload_threads": OFFLOAD_THREADS,
+            }
+
+
+conversation_limiter = ConversationLimiter(max_active=MAX_ACTIVE_CONVERSATIONS, wait_timeout=CONVERSATION_WAIT_TIMEOUT)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+''' Runs app.py for the benchmarks - started by run_benchmarks.py with the stub LLM server's url in
+    OPENAI_BASE_URL. The database is the in memory stub unless BENCH_DATABASE=postgres, which uses the
+    DATABASE_* settings as the app normally does.
+'''
+
+# The app's modules are imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if __name__ == "__main__":
+    if os.getenv("BENCH_DATABASE", "stub") == "stub":
+        import stub_database
+        stub_database.install(float(os.getenv("BENCH_DB_LATENCY_MS", 1)))
+
+    from app import app, socket_io
+    from code_executor import executor_pool
+
+    if executor_pool is not None:
+        executor_pool.start()
+
+    port = int(os.getenv("BENCH_APP_PORT", 5100))
+    print(f"Benchmark app on http://127.0.0.1:{port}", flush=True)
+    socket_io.run(app, host="127.0.0.1", port=port, use_reloader=False, log_output=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,368 @@
+import argparse
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import socketio
+
+''' Load test and benchmark suite. Starts the stub LLM server and app.py (see bench_server.py) in their own
+    processes, then drives each scenario with many concurrent clients and reports p50/p95/p99 latency,
+    throughput, errors and the app's memory. Results can be saved and compared with a saved baseline - the
+    run fails when a scenario is slower than the baseline by more than --max-regression.
+
+        python benchmarks/run_benchmarks.py --concurrency 20 --requests 200 --output results.json
+        python benchmarks/run_benchmarks.py --baseline results.json
+'''
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# Seconds a request or socket event may take before it counts as an error - set by --timeout
+REQUEST_TIMEOUT = 300
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before listening on port {port}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout} seconds")
+
+
+#Resident memory of a process in MB - from /proc, or psutil where there is no /proc
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 1024 / 1024
+    except Exception:
+        return None
+
+
+def percentile(values, percent):
+    # Nearest rank percentile of a list of numbers
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class MemorySampler:
+    # Samples the app's memory while a scenario runs to find its peak
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            current = rss_mb(self.pid)
+            if current is not None:
+                self.peak = current if self.peak is None else max(self.peak, current)
+            self._stop.wait(self.interval)
+
+
+# Scenarios - each makes one request with the client's state and raises if it failed
+
+class RestClient:
+
+    def __init__(self, base_url, client_id, agent_ids):
+        self.base_url = base_url
+        self.email = f"bench{client_id}@example.com"
+        self.agent_ids = agent_ids
+        self.session = requests.Session()
+
+    def post(self, path, payload, timeout=None):
+        response = self.session.post(self.base_url + path, json=payload, timeout=timeout or REQUEST_TIMEOUT)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class SocketClient:
+
+    def __init__(self, base_url, client_id, agent_ids):
+        self.agent_ids = agent_ids
+        self.client = socketio.Client(reconnection=False)
+        self._done = threading.Event()
+        self._error = None
+        self._finished_statuses = ()
+
+        @self.client.on('processing_status')
+        def on_status(data):
+            if data.get('status') in self._finished_statuses:
+                self._done.set()
+            elif data.get('status') == 'error':
+                self._error = "processing_status error"
+                self._done.set()
+
+        @self.client.on('error')
+        def on_error(data):
+            self._error = data.get('error') if isinstance(data, dict) else str(data)
+            self._done.set()
+
+        @self.client.on('disconnect')
+        def on_disconnect(*args):
+            self._error = "disconnected by the server"
+            self._done.set()
+
+        self.client.connect(base_url, wait_timeout=30)
+
+    def send(self, event, payload, finished_statuses, timeout=None):
+        self._done.clear()
+        self._error = None
+        self._finished_statuses = finished_statuses
+        self.client.emit(event, payload)
+        timeout = timeout or REQUEST_TIMEOUT
+        if not self._done.wait(timeout):
+            raise RuntimeError(f"No reply to {event} after {timeout} seconds")
+        if self._error:
+            raise RuntimeError(self._error)
+
+    def close(self):
+        if self.client.connected:
+            self.client.disconnect()
+
+
+def team_payload(client, i, **extra):
+    one, two, three = client.agent_ids
+    return {"message": f"Benchmark task {i}: write a function that adds two numbers.", "email": getattr(client, "email", None),
+            "agentOne": one, "agentTwo": two, "agentThree": three, **extra}
+
+
+SCENARIOS = {
+    "rest_chat": (RestClient, lambda client, i: client.post('/chat', {"message": f"Benchmark question {i}", "email": client.email})),
+    "rest_chat_team": (RestClient, lambda client, i: client.post('/chat_team', team_payload(client, i))),
+    "rest_chat_team_parallel": (RestClient, lambda client, i: client.post('/chat_team', team_payload(client, i, mode="parallel"))),
+    "rest_store_chat": (RestClient, lambda client, i: client.post('/store_chat', {
+        "message": [f"User\nBenchmark question {i}", "MultiTalentAgent\n" + "word " * 200],
+        "email": client.email, "chat_name": f"Benchmark chat {i}"})),
+    "rest_list_chats": (RestClient, lambda client, i: client.post('/gather_previous_chat_names', {"email": client.email})),
+    "socket_user_message": (SocketClient, lambda client, i: client.send(
+        'user_message', {"message": f"Benchmark question {i}"}, ('completed_terminated', 'completed_waiting_next'))),
+    "socket_user_message_team": (SocketClient, lambda client, i: client.send(
+        'user_message_team', team_payload(client, i), ('completed',))),
+}
+
+
+def run_scenario(name, base_url, app_pid, concurrency, total_requests, agent_ids):
+    client_class, operation = SCENARIOS[name]
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker(client_id):
+        try:
+            client = client_class(base_url, client_id, agent_ids)
+        except Exception as e:
+            with lock:
+                errors.append(f"connect: {e}")
+            return
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    operation(client, i)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            client.close()
+
+    memory_before = rss_mb(app_pid)
+    with MemorySampler(app_pid) as memory:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "memory_mb_before": round(memory_before, 1) if memory_before is not None else None,
+        "memory_mb_peak": round(memory.peak, 1) if memory.peak is not None else None,
+    }
+
+
+#Scenarios slower than the baseline by more than max_regression - p95 latency up or throughput down
+def find_regressions(results, baseline, max_regression):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if before["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if before["throughput_per_second"] and result["throughput_per_second"] < before["throughput_per_second"] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {before['throughput_per_second']}/s -> {result['throughput_per_second']}/s")
+        if result["errors"] > before.get("errors", 0):
+            regressions.append(f"{name}: errors {before.get('errors', 0)} -> {result['errors']}")
+    return regressions
+
+
+def print_report(results):
+    header = f"{'scenario':<26}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        print(f"{name:<26}{result['requests']:>9}{result['errors']:>8}{result['throughput_per_second']:>9}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}{str(result['memory_mb_peak']):>10}")
+        if result["first_error"]:
+            print(f"    first error: {result['first_error'][:160]}")
+
+
+def start_processes(args):
+    llm_port, app_port = free_port(), free_port()
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "stub_llm_server.py"), "--port", str(llm_port),
+        "--latency-ms", str(args.llm_latency_ms), "--tokens-per-second", str(args.llm_tokens_per_second),
+        "--reply-tokens", str(args.llm_reply_tokens), "--terminate-after", str(args.terminate_after),
+    ], stdout=subprocess.DEVNULL)
+    env = {
+        **os.environ,
+        "OPEN_AI_KEY": os.getenv("OPEN_AI_KEY", "sk-benchmark"),
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "BENCH_APP_PORT": str(app_port),
+        "BENCH_DATABASE": args.database,
+        "BENCH_DB_LATENCY_MS": str(args.db_latency_ms),
+        # Cached replies would measure the cache rather than the app - switch on with --llm-cache
+        "LLM_CACHE_BACKEND": os.getenv("LLM_CACHE_BACKEND", "memory" if args.llm_cache else "none"),
+        # The stub has no rate limit - keep the scheduler in the path without it holding requests back
+        "LLM_RPM_LIMIT": os.getenv("LLM_RPM_LIMIT", "1000000"),
+        "LLM_TPM_LIMIT": os.getenv("LLM_TPM_LIMIT", "1000000000"),
+        "LLM_HTTP2": "false",
+        # Streamed replies are sent as many small events - only sensible over the websocket transport
+        "SOCKET_STREAMING": "true" if args.socket_streaming else "false",
+    }
+    app = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "bench_server.py")], env=env,
+                           stdout=None if args.verbose else subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        wait_for_port(llm_port, stub)
+        wait_for_port(app_port, app)
+    except Exception:
+        stop_processes(stub, app)
+        raise
+    return stub, app, f"http://127.0.0.1:{app_port}"
+
+
+def stop_processes(*processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app against a stub LLM server")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=100)
+    parser.add_argument("--llm-reply-tokens", type=int, default=60)
+    parser.add_argument("--terminate-after", type=int, default=6, help="messages in a request before the stub replies TERMINATE")
+    parser.add_argument("--llm-cache", action="store_true", help="keep the LLM response cache on")
+    parser.add_argument("--socket-streaming", action="store_true",
+                        help="stream websocket replies as agent_message_delta events - needs pip install websocket-client")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a request counts as an error")
+    parser.add_argument("--database", choices=("stub", "postgres"), default="stub")
+    parser.add_argument("--db-latency-ms", type=float, default=1)
+    parser.add_argument("--agent-ids", default="1,2,3", help="agentdata ids for the team scenarios - must exist with --database postgres")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by an earlier --output")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed slowdown against the baseline, 0.2 = 20%%")
+    parser.add_argument("--verbose", action="store_true", help="show the app's output")
+    args = parser.parse_args(argv)
+    global REQUEST_TIMEOUT
+    REQUEST_TIMEOUT = args.timeout
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    agent_ids = args.agent_ids.split(",")
+    if len(agent_ids) != 3:
+        parser.error("--agent-ids needs three ids")
+
+    stub, app, base_url = start_processes(args)
+    results = {}
+    try:
+        for name in names:
+            print(f"Running {name} - {args.requests} requests from {args.concurrency} clients", flush=True)
+            results[name] = run_scenario(name, base_url, app.pid, args.concurrency, args.requests, agent_ids)
+    finally:
+        stop_processes(stub, app)
+
+    print()
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+                       "results": results}, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = find_regressions(results, baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"    {regression}")
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
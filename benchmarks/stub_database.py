@@ -0,0 +1,90 @@
+import threading
+import time
+from psycopg2 import extensions
+
+''' In memory stand-in for PostgreSQL used when the benchmarks run without a database (BENCH_DATABASE=stub).
+    It only answers the queries the benchmark scenarios make - agent lookups return made up agents for any id,
+    writes are accepted and other reads return nothing. Every statement sleeps for latency_ms so the pool,
+    checkout and query paths of the app still cost something like a local database round trip.
+'''
+
+# Specialisations handed out to the agent ids a team chat asks for
+SPECIALISATIONS = ["Programmer", "Tester", "Reviewer", "Architect", "Analyst"]
+
+
+class StubCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self.description = None
+        self._rows = []
+
+    def execute(self, query, vars=None):
+        statement = (query.decode("utf-8", "replace") if isinstance(query, bytes) else str(query)).lower()
+        self.connection.wait()
+        self._rows = []
+        self.rowcount = 1
+        if "from agentdata where agentid in" in statement:
+            self._rows = [
+                (agent_id, SPECIALISATIONS[i % len(SPECIALISATIONS)], f"You are a {SPECIALISATIONS[i % len(SPECIALISATIONS)].lower()}.", 0.0)
+                for i, agent_id in enumerate(vars or ())
+            ]
+            self.rowcount = len(self._rows)
+        with self.connection.lock:
+            self.connection.statements += 1
+
+    def executemany(self, query, vars_list):
+        for vars in vars_list:
+            self.execute(query, vars)
+
+    def mogrify(self, query, vars=None):
+        # Used by psycopg2.extras.execute_values to build its VALUES list
+        return repr(vars).encode()
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+
+    def __init__(self, latency_ms=1.0):
+        self.latency_ms = latency_ms
+        self.closed = 0
+        self.autocommit = False
+        # Read by psycopg2.extras.execute_values
+        self.encoding = "UTF8"
+        self.statements = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def cursor(self, *args, **kwargs):
+        return StubCursor(self)
+
+    def commit(self):
+        self.wait()
+
+    def rollback(self):
+        pass
+
+    def get_transaction_status(self):
+        return extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+#Points the app's connection pool at stub connections - call before the pool is first used
+def install(latency_ms=1.0):
+    import db_connection
+    db_connection.connect_to_database = lambda: StubConnection(latency_ms)
@@ -0,0 +1,141 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+''' OpenAI compatible chat completions server for the benchmarks. Replies after a fixed latency plus the time
+    the completion would take at tokens_per_second, reports usage like the real API and streams when asked.
+    Replies are made so the app's conversations end the way they do with a real model:
+        - autogen's speaker selection prompt is answered with one of the roles it offers
+        - once a request carries terminate_after messages the reply is TERMINATE, ending the chat
+'''
+
+# autogen's group chat speaker selection prompt - "... select the next role from ['a', 'b'] to play ..."
+_ROLES = re.compile(r"select the next role from \[(.*?)\]", re.IGNORECASE | re.DOTALL)
+
+
+class StubLLM:
+
+    def __init__(self, latency_ms=200, tokens_per_second=100, reply_tokens=60, terminate_after=6):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.terminate_after = terminate_after
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def reply(self, body):
+        messages = body.get("messages", [])
+        with self._lock:
+            self.requests += 1
+        text = "\n".join(str(message.get("content") or "") for message in messages)
+        roles = _ROLES.findall(text)
+        if roles:
+            names = [name.strip(" '\"") for name in roles[-1].split(",") if name.strip(" '\"")]
+            return random.choice(names) if names else "TERMINATE"
+        if len(messages) >= self.terminate_after:
+            return "TERMINATE"
+        return " ".join(f"word{i}" for i in range(self.reply_tokens))
+
+    def completion_seconds(self, content):
+        tokens = len(content.split())
+        return self.latency_ms / 1000 + (tokens / self.tokens_per_second if self.tokens_per_second else 0)
+
+    def usage(self, body, content):
+        prompt = sum(len(str(message.get("content") or "")) // 4 + 4 for message in body.get("messages", []))
+        completion = len(content.split())
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def make_handler(stub):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            content = stub.reply(body)
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            model = body.get("model", "stub")
+            if body.get("stream"):
+                self._stream(completion_id, model, content)
+                return
+            time.sleep(stub.completion_seconds(content))
+            self._send(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": stub.usage(body, content),
+            })
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, completion_id, model, content):
+            # Server sent events - the latency before the first chunk then one chunk per word at the token rate
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(stub.latency_ms / 1000)
+            words = content.split(" ")
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else " " + word}
+                self._chunk({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                             "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                if stub.tokens_per_second:
+                    time.sleep(1 / stub.tokens_per_second)
+            self._chunk({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _chunk(self, payload):
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+#Starts the stub on a background thread - returns the server, its base url is http://host:port/v1
+def start_stub_server(stub, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub_llm", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI compatible stub server for the benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8400)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=100)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--terminate-after", type=int, default=6)
+    args = parser.parse_args()
+    stub = StubLLM(args.latency_ms, args.tokens_per_second, args.reply_tokens, args.terminate_after)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(stub))
+    server.daemon_threads = True
+    print(f"Stub LLM server on http://{args.host}:{server.server_port}/v1", flush=True)
+    server.serve_forever()
@@ -1,23 +1,32 @@
 from flask import Blueprint, request, jsonify
-from db_connection import connect_to_database
-from agents import user_proxy, agent_one
-from utils import refactor_agent_name
+import psycopg2
+from db_connection import database_connection
+from chat_storage import encode_chat, read_header, decode_messages
+from chat_search import chat_search_text, headline_text, query_terms, make_snippet
+from agents import chat_agent_pool, create_user_proxy, create_synthesis_agent
+from parallel_team import answer_in_parallel, synthesise
+from speaker_selection import team_speaker_selector
+from agent_cache import agent_configs, team_cache
+from utils import refactor_agent_name, agent_llm_config, read_page_params, query_limit, split_page
+from llm_cache import response_cache
 import autogen
 from config import LLM_CONFIG
+from jobs import chat_jobs, register_cancellation, JobQueueFullError
+from llm_scheduler import bind_requester, BATCH
+from llm_usage import track_agent, usage_scope
+from workspaces import workspace_manager
+from async_runtime import conversation_limiter, offload, ServerBusyError
 
 
 chat_blueprint = Blueprint('chat', __name__)
 
-@chat_blueprint.route('/chat', methods=['POST'])
-def chat():
-    try:
-        # Debugging log for incoming request
-        print("Received POST request")
-        data = request.json
-        message = data['message']
-
-        #call initialte chat pass the message and agent_one.
-        user_proxy.initiate_chat(agent_one, message=message)
+#Runs a single agent conversation and returns the message contents - called inline or on a chat job worker
+def run_chat(message):
+    #checkout an isolated user proxy and assistant - reset and returned to the pool when the block ends
+    #code the agents run is written to a workspace of its own, removed when the conversation ends
+    with chat_agent_pool.checkout() as (user_proxy, agent_one), workspace_manager.scope():
+        #call initialte chat pass the message and agent_one - repeated deterministic requests are served from the cache
+        user_proxy.initiate_chat(agent_one, message=message, cache=response_cache)
         
         
         # Extract and print only the content of the messages
@@ -32,11 +41,160 @@ def chat():
                     message_contents.append(f"{message['name']}\n{message['content']}")
                     print("-" * 50)
             # To separate messages for appearance in the console
-            
-        user_proxy.chat_messages.clear()
+
+    return message_contents
+
+#Builds the user proxy, team agents, group chat and manager for a team chat - kept in the team cache between messages
+def build_team(agentOne, agentTwo, agentThree):
+    # The agents data is extracted from the agent config cache (the database on a miss) to configure the agents.
+    result = agent_configs.get_many([agentOne, agentTwo, agentThree])
+    print(result)
+
+    stopping_termination_message = "You must NOT respond with 'TERMINATE' in any part of your rseonse.  ."
+    # Unpack the results
+    (specialisationOne, configurationOne, temperatureOne), (specialisationTwo, configurationTwo, temperatureTwo), (specialisationThree, configurationThree, temperatureThree) = result
+    
+    # Refactor agent names for configuration
+    specialisationOne = refactor_agent_name(specialisationOne)
+    specialisationTwo = refactor_agent_name(specialisationTwo)
+    specialisationThree = refactor_agent_name(specialisationThree)
+
+    # Agents and configurations, extracted from the database
+    agent_one = autogen.AssistantAgent(
+        name=specialisationOne,
+        description=specialisationOne,
+        system_message= configurationOne + " " + stopping_termination_message,
+        llm_config=agent_llm_config(temperatureOne),
+    )
+    
+    agent_two = autogen.AssistantAgent(
+        name=specialisationTwo,
+        description=specialisationTwo,
+        system_message= configurationTwo + " " + stopping_termination_message,
+        llm_config=agent_llm_config(temperatureTwo),
+    )
+
+    agent_three = autogen.AssistantAgent(
+        name=specialisationThree,
+        description= specialisationThree,
+        system_message= configurationThree + " " + stopping_termination_message,
+        llm_config=agent_llm_config(temperatureThree),   
+    )
+    
+    #Each cached team has its own user proxy so two conversations never share one
+    user_proxy = create_user_proxy()
+
+    # Implement the group chat
+    groupchat = autogen.GroupChat(
+        #pass the agents and user proxy
+        agents=[user_proxy, agent_one, agent_two, agent_three], 
+        #empty array to add messages
+        messages=[], 
+        #give a max number of interactions ensure the communication does not run possible 
+        #infinitely or costing too much money for a single question when testing. 
+        max_round=20,
+        #rule based speaker selection - the manager's LLM only picks the next speaker when the rules can not
+        **team_speaker_selector(agentOne, agentTwo, agentThree).group_chat_kwargs()
+    )
+    
+    # Group chat manager - used to control the conversation, manages agents and decides what agent is next to speak.
+    manager = autogen.GroupChatManager(
+        #pass the groupchat object
+        groupchat=groupchat,
+        #A prompt to ensure the chat manager passes inititial message to hardcoded chat coordinatior agent.
+        system_message= '''You control the flow of the chat. When the user_proxy executes code and receives an error:
+        1. Always forward the error to the programming agent
+        2. Explicitly ask the programming agent to fix the code
+        3. After the programming agent provides a fix, direct the user_proxy to execute the updated code
+        4. Repeat this cycle until the code executes successfully
+        5. Only TERMINATE the conversation when all requirements are met and all code executes without errors
+        Do NOT allow conversation to end while there are unresolved errors.''',
+        #pass configurations, tempt, openai key and model used
+        llm_config=LLM_CONFIG
+    )
+
+    #Allow a cancelled chat job to stop the conversation at the next turn
+    for agent in (agent_one, agent_two, agent_three, manager):
+        register_cancellation(agent)
+
+    #Token use is accounted per agentdata id - the manager's speaker selection calls count against the manager
+    for agent, agent_id in ((agent_one, agentOne), (agent_two, agentTwo), (agent_three, agentThree), (manager, "manager")):
+        track_agent(agent, agent_id)
+    
+    return {
+        "user_proxy": user_proxy,
+        "agents": [agent_one, agent_two, agent_three],
+        "groupchat": groupchat,
+        "manager": manager,
+    }
+
+#Team a team chat's token use is accounted under - its three agent ids
+def team_usage_key(agentOne, agentTwo, agentThree):
+    return f"{agentOne},{agentTwo},{agentThree}"
+
+#Runs a team conversation for the three agent ids and returns the message contents
+def run_team_chat(message, agentOne, agentTwo, agentThree):
+    #checkout a prebuilt team - built on the first message to this team, then reset and reused
+    team_key = ("rest", str(agentOne), str(agentTwo), str(agentThree))
+    with team_cache.checkout(team_key, lambda: build_team(agentOne, agentTwo, agentThree)) as team, usage_scope(team=team_usage_key(agentOne, agentTwo, agentThree)), workspace_manager.scope():
+        user_proxy = team["user_proxy"]
+
+        # Initiate the chat - the manager shares the response cache with every agent in the group chat
+        user_proxy.initiate_chat(team["manager"], message=message, cache=response_cache)
+        
+        #Extract message contents and append them to the message_contents array
+        message_contents = []
+        for role, messages in user_proxy.chat_messages.items():
+            for message in messages:
+                if(message['content'] != ""):
+                        message_contents.append(f"{message['name']}\n{message['content']}")
+                        print("-" * 50)
+    return message_contents
+
+#Parallel team mode - the three agents answer the message at the same time and their answers are combined
+#Returns the answers then the combined answer in the same format as run_team_chat
+def run_parallel_team_chat(message, agentOne, agentTwo, agentThree):
+    #Shares the prebuilt team agents with the group chat mode - their histories are not used here
+    team_key = ("rest", str(agentOne), str(agentTwo), str(agentThree))
+    with team_cache.checkout(team_key, lambda: build_team(agentOne, agentTwo, agentThree)) as team, usage_scope(team=team_usage_key(agentOne, agentTwo, agentThree)):
+        # Built the first time the team is used in this mode and kept with the team
+        if "synthesiser" not in team:
+            team["synthesiser"] = create_synthesis_agent()
+        synthesiser = team["synthesiser"]
+        answers = answer_in_parallel(team["agents"], message, team["user_proxy"], cache=response_cache)
+        combined = synthesise(synthesiser, message, answers, team["user_proxy"], cache=response_cache)
+
+    message_contents = [f"{name}\n{answer}" for name, answer in answers if answer != ""]
+    message_contents.append(f"{synthesiser.name}\n{combined}")
+    return message_contents
+
+@chat_blueprint.route('/chat', methods=['POST'])
+def chat():
+    try:
+        # Debugging log for incoming request
+        print("Received POST request")
+        data = request.json
+        message = data['message']
+        #LLM requests are rate limited per user - REST chats queue behind the interactive websocket chats
+        run = bind_requester(run_chat, data.get('email') or request.remote_addr, BATCH)
+
+        #async mode - run the conversation on a chat job worker and return the job id straight away
+        if data.get('async'):
+            job = chat_jobs.submit('chat', run, message)
+            return jsonify({"job_id": job.job_id, "status": job.status}), 202
+
+        #wait for a conversation slot - the server answers 503 if none frees up in time
+        with conversation_limiter.slot():
+            message_contents = run(message)
 
         # Return the response and 200 success
         return jsonify({"response": message_contents}), 200
+    except JobQueueFullError as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 429
+    except ServerBusyError as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         # Print the exception for details
         print("Error:", str(e))
@@ -53,121 +211,101 @@ def chat_team():
         agentOne = data['agentOne']
         agentTwo = data['agentTwo']
         agentThree = data['agentThree']
-        
-        # Database connection
-        conn = connect_to_database()
-        cursor = conn.cursor()
-
-        # The agents data is extracted from the database to configure the agents.
-        query = "SELECT agentspecialisation, agentconfig FROM agentdata WHERE agentid IN (%s, %s, %s)"
-        cursor.execute(query, (agentOne, agentTwo, agentThree))
-
-        # Fetch all results
-        result = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        print(result)
-
-        stopping_termination_message = "You must NOT respond with 'TERMINATE' in any part of your rseonse.  ."
-        # Unpack the results
-        (specialisationOne, configurationOne), (specialisationTwo, configurationTwo), (specialisationThree, configurationThree) = result
-        
-        # Refactor agent names for configuration
-        specialisationOne = refactor_agent_name(specialisationOne)
-        specialisationTwo = refactor_agent_name(specialisationTwo)
-        specialisationThree = refactor_agent_name(specialisationThree)
-
-        # Agents and configurations, extracted from the database
-        agent_one = autogen.AssistantAgent(
-            name=specialisationOne,
-            description=specialisationOne,
-            system_message= configurationOne + " " + stopping_termination_message,
-            llm_config=LLM_CONFIG,
-        )
-        
-        agent_two = autogen.AssistantAgent(
-            name=specialisationTwo,
-            description=specialisationTwo,
-            system_message= configurationTwo + " " + stopping_termination_message,
-            llm_config=LLM_CONFIG,
-        )
-
-        agent_three = autogen.AssistantAgent(
-            name=specialisationThree,
-            description= specialisationThree,
-            system_message= configurationThree + " " + stopping_termination_message,
-            llm_config=LLM_CONFIG,   
-        )
-        
-        # Implement the group chat
-        groupchat = autogen.GroupChat(
-            #pass the agents and user proxy
-            agents=[user_proxy, agent_one, agent_two, agent_three], 
-            #empty array to add messages
-            messages=[], 
-            #give a max number of interactions ensure the communication does not run possible 
-            #infinitely or costing too much money for a single question when testing. 
-            max_round=20
-        )
-        
-        # Group chat manager - used to control the conversation, manages agents and decides what agent is next to speak.
-        manager = autogen.GroupChatManager(
-            #pass the groupchat object
-            groupchat=groupchat,
-            #A prompt to ensure the chat manager passes inititial message to hardcoded chat coordinatior agent.
-            system_message= '''You control the flow of the chat. When the user_proxy executes code and receives an error:
-            1. Always forward the error to the programming agent
-            2. Explicitly ask the programming agent to fix the code
-            3. After the programming agent provides a fix, direct the user_proxy to execute the updated code
-            4. Repeat this cycle until the code executes successfully
-            5. Only TERMINATE the conversation when all requirements are met and all code executes without errors
-            Do NOT allow conversation to end while there are unresolved errors.''',
-            #pass configurations, tempt, openai key and model used
-            llm_config=LLM_CONFIG
-        )
-        
-        # Initiate the chat
-        user_proxy.initiate_chat(manager, message=message)
-        
-        #Extract message contents and append them to the message_contents array
-        message_contents = []
-        for role, messages in user_proxy.chat_messages.items():
-            for message in messages:
-                if(message['content'] != ""):
-                        message_contents.append(f"{message['name']}\n{message['content']}")
-                        print("-" * 50)
-        #clear the chat
-        user_proxy.chat_messages.clear()
+
+        #"mode": "parallel" - the agents answer at the same time and a synthesis step combines the answers
+        run = run_parallel_team_chat if data.get('mode') == 'parallel' else run_team_chat
+        run = bind_requester(run, data.get('email') or request.remote_addr, BATCH)
+
+        #async mode - team chats can run for minutes so are best run as a chat job
+        if data.get('async'):
+            job = chat_jobs.submit('chat_team', run, message, agentOne, agentTwo, agentThree)
+            return jsonify({"job_id": job.job_id, "status": job.status}), 202
+
+        with conversation_limiter.slot():
+            message_contents = run(message, agentOne, agentTwo, agentThree)
         #return the entire chat content
         return jsonify({"response": message_contents}), 200
+    except JobQueueFullError as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 429
+    except ServerBusyError as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         #if an error occurs return the error
         print("Error:", str(e))
         return jsonify({"error": str(e)}), 500
 
+#Poll the status of a chat job - the response is included once the job has completed
+@chat_blueprint.route('/chat_job_status', methods=['POST'])
+def chat_job_status():
+    try:
+        data = request.json
+        job = chat_jobs.get(data['jobId'])
+        if job is None:
+            return jsonify({"error": "Chat job not found"}), 404
+        return jsonify({"message": job.to_dict()}), 200
+    except Exception as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 500
+
+#Cancel a queued or running chat job
+@chat_blueprint.route('/cancel_chat_job', methods=['POST'])
+def cancel_chat_job():
+    try:
+        data = request.json
+        if chat_jobs.cancel(data['jobId']):
+            return jsonify({"response": "Chat job cancelled"}), 200
+        return jsonify({"response": "Chat job not running"}), 200
+    except Exception as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 500
+
 @chat_blueprint.route('/get_previous_chat', methods=['POST'])
 def get_previous_chat():
     try:
         data = request.json
         #extract he payload chatname
         chat_name = data.get('chatName')
+        #Optional range of messages to return - "start" index and "limit" number of messages
+        try:
+            start = max(int(data.get('start') or 0), 0)
+            limit = int(data['limit']) if data.get('limit') is not None else None
+        except ValueError:
+            return jsonify({"error": "start and limit must be numbers"}), 400
 
         print(chat_name)
-        conn = connect_to_database()
-        cursor = conn.cursor()
-        query = "SELECT chatcontent FROM chattable WHERE chatid = %s"
-        cursor.execute(query, (chat_name,))
-        result = cursor.fetchone()            
-        print(result)
+        total = None
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            query = "SELECT chatcontent FROM chattable WHERE chatid = %s"
+            cursor.execute(query, (chat_name,))
+            result = cursor.fetchone()
+            header = read_header(result[0]) if result else None
+            if header is not None:
+                #Chunked chat - only the requested messages are read and decompressed
+                total = header["count"]
+                if header["kind"] == "text":
+                    start, limit = 0, None
+                end = total if limit is None else min(start + limit, total)
+                cursor.execute(
+                    "SELECT chunkcontent FROM chatchunks WHERE chatid = %s AND chunkindex >= %s AND chunkindex < %s ORDER BY chunkindex",
+                    (chat_name, start, end)
+                )
+                #Decompression is CPU bound - run on an OS thread under eventlet or gevent
+                messages = offload(decode_messages, header, [row[0] for row in cursor.fetchall()])
+            cursor.close()
             
-        if result:
+        if header is not None:
+            chat_content = messages[0] if header["kind"] == "text" else messages
+        elif result:
+            #Chat saved before content was compressed - stored as it is
             chat_content = result[0]
         else:
             chat_content = "<div id='previous_chat_error'><h1 id='returned_data'>Error fetching chat data</h1><br /><h3 id='previous_chat_error_sub'>Please try again later</h3></div>"
-            
-        cursor.close()
-        conn.close()
         
+        if total is not None and header["kind"] != "text":
+            return jsonify({"message": chat_content, "start": start, "total": total}), 200
         return jsonify({"message": chat_content}), 200
     except Exception as e:
         print("Error:", str(e))
@@ -178,17 +316,102 @@ def gather_previous_chat_names():
     try:
         data = request.json
         email = data["email"]
-        conn = connect_to_database()
-        cursor = conn.cursor()
-        query = "SELECT chatname, chatid FROM chattable WHERE useremail = %s"
-        cursor.execute(query, (email,))
-        result = cursor.fetchall()
-        print(result)
+        try:
+            #Optional "cursor" (chatid of the last chat of the previous page) and "limit" - all chats without either
+            cursor_id, limit = read_page_params(data, paged_by_default=False)
+        except ValueError:
+            return jsonify({"error": "cursor and limit must be numbers"}), 400
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            #Keyset pagination on the (useremail, chatid) index - one row more than the page shows if there is another page
+            if cursor_id is None:
+                query = "SELECT chatname, chatid FROM chattable WHERE useremail = %s ORDER BY chatid LIMIT %s"
+                cursor.execute(query, (email, query_limit(limit)))
+            else:
+                query = "SELECT chatname, chatid FROM chattable WHERE useremail = %s AND chatid > %s ORDER BY chatid LIMIT %s"
+                cursor.execute(query, (email, cursor_id, query_limit(limit)))
+            result = cursor.fetchall()
+            cursor.close()
+        result, next_cursor = split_page(result, limit)
         formatted_result = [[[chatname], [chatid]] 
                                for chatname, chatid in result]
-        cursor.close()
-        conn.close()
-        return jsonify({"message": formatted_result}), 200
+        return jsonify({"message": formatted_result, "next_cursor": next_cursor}), 200
+    except Exception as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 500
+
+#Number of chats a user has saved - counted from the (useremail, chatid) index without fetching the rows
+@chat_blueprint.route('/count_previous_chats', methods=['POST'])
+def count_previous_chats():
+    try:
+        data = request.json
+        email = data["email"]
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM chattable WHERE useremail = %s", (email,))
+            count = cursor.fetchone()[0]
+            cursor.close()
+        return jsonify({"message": count}), 200
+    except Exception as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 500
+
+#Full text search over a users saved chats - best matches first, with a snippet of each
+@chat_blueprint.route('/search_chats', methods=['POST'])
+def search_chats():
+    try:
+        data = request.json
+        email = data["email"]
+        query = (data.get("query") or "").strip()
+        if not query:
+            return jsonify({"error": "A search query is required"}), 400
+        try:
+            #"cursor" is the number of results already returned
+            offset, limit = read_page_params(data)
+        except ValueError:
+            return jsonify({"error": "cursor and limit must be numbers"}), 400
+        offset = max(offset or 0, 0)
+
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            #Matches come from the GIN index on searchvector - the text of chats saved before compression
+            #is cut down by ts_headline, which only runs for the rows of the page
+            cursor.execute(
+                "SELECT chatid, chatname, ts_rank_cd(searchvector, query) AS rank, "
+                "CASE WHEN chatcontent LIKE 'chatchunks:v1:%%' THEN NULL "
+                "ELSE ts_headline('english', regexp_replace(chatcontent, '<[^>]*>', ' ', 'g'), query, 'MaxFragments=2, MinWords=5, MaxWords=20') END, "
+                "CASE WHEN chatcontent LIKE 'chatchunks:v1:%%' THEN chatcontent END "
+                "FROM chattable, websearch_to_tsquery('english', %s) AS query "
+                "WHERE useremail = %s AND searchvector @@ query "
+                "ORDER BY rank DESC, chatid DESC LIMIT %s OFFSET %s",
+                (query, email, limit + 1, offset)
+            )
+            result = cursor.fetchall()
+            result, more = result[:limit], len(result) > limit
+
+            #Snippets of compressed chats are cut from their messages - one query for the page
+            chunked_ids = [row[0] for row in result if row[3] is None]
+            chunks = {}
+            if chunked_ids:
+                cursor.execute(
+                    "SELECT chatid, chunkcontent FROM chatchunks WHERE chatid = ANY(%s) ORDER BY chatid, chunkindex",
+                    (chunked_ids,)
+                )
+                for chatid, chunk in cursor.fetchall():
+                    chunks.setdefault(chatid, []).append(chunk)
+            cursor.close()
+
+        terms = query_terms(query)
+        formatted_result = []
+        for chatid, chatname, rank, snippet, header in result:
+            #Every snippet is escaped and marked by make_snippet, whichever kind of row it comes from
+            if snippet is None:
+                messages = decode_messages(read_header(header), chunks.get(chatid, []))
+                snippet = make_snippet(chat_search_text(messages), terms)
+            else:
+                snippet = make_snippet(headline_text(snippet), terms)
+            formatted_result.append({"chatid": chatid, "chatname": chatname, "rank": round(float(rank), 4), "snippet": snippet})
+        return jsonify({"message": formatted_result, "next_cursor": offset + limit if more else None}), 200
     except Exception as e:
         print("Error:", str(e))
         return jsonify({"error": str(e)}), 500
@@ -201,15 +424,20 @@ def store_chat():
         message = data['message']
         email = data["email"]
         chat_name = data["chat_name"]
-        conn = connect_to_database()        
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO chattable (useremail, chatname, chatcontent) VALUES (%s, %s, %s)",
-            (email, chat_name, message)
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
+        #Compress the chat - "message" may be the chat as one string or a list of messages
+        header, chunks = offload(encode_chat, message)
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            #The chat row, its search vector and its chunks are written with one statement
+            cursor.execute(
+                "WITH chat AS (INSERT INTO chattable (useremail, chatname, chatcontent, searchvector) VALUES (%s, %s, %s, "
+                "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('english', %s), 'B')) RETURNING chatid) "
+                "INSERT INTO chatchunks (chatid, chunkindex, chunkcontent) "
+                "SELECT chat.chatid, chunk.chunkindex - 1, chunk.chunkcontent FROM chat, unnest(%s::bytea[]) WITH ORDINALITY AS chunk(chunkcontent, chunkindex)",
+                (email, chat_name, header, chat_name, chat_search_text(message), [psycopg2.Binary(chunk) for chunk in chunks])
+            )
+            conn.commit()
+            cursor.close()
         #return 200 and Message stored
         return jsonify({"response": "Message stored"}), 200
     except Exception as e:
@@ -225,13 +453,12 @@ def delete_chat():
         email = data['email']
         chat_name = data['chatName']
         
-        conn = connect_to_database()        
-        cursor = conn.cursor() 
-        query = "DELETE FROM chattable WHERE useremail = %s AND chatname = %s"
-        cursor.execute(query, (email, chat_name))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            query = "DELETE FROM chattable WHERE useremail = %s AND chatname = %s"
+            cursor.execute(query, (email, chat_name))
+            conn.commit()
+            cursor.close()
         #return 200 and Chat Delete message
         return jsonify({"response": "Chat Deleted"}), 200
     except Exception as e:
@@ -0,0 +1,53 @@
+import html
+import json
+import re
+from config import CHAT_SEARCH_MAX_CHARS, CHAT_SEARCH_SNIPPET_CHARS
+
+''' Helpers for /search_chats. Saved chats are stored compressed (see chat_storage.py) so PostgreSQL can not
+    index chatcontent itself - the text is extracted when the chat is saved and only its tsvector is stored,
+    in chattable.searchvector. Snippets for a page of results are cut from the decompressed messages.
+'''
+
+_TAGS = re.compile(r"<[^>]+>")
+_WORDS = re.compile(r"\w+", re.UNICODE)
+
+
+#Plain text of a chat for indexing - HTML tags are removed and message dicts reduced to their content
+def chat_search_text(content):
+    if isinstance(content, list):
+        parts = []
+        for message in content:
+            if isinstance(message, dict):
+                message = message.get("content") or ""
+            parts.append(message if isinstance(message, str) else json.dumps(message))
+        text = "\n".join(parts)
+    else:
+        text = str(content)
+    text = html.unescape(_TAGS.sub(" ", text))
+    text = " ".join(text.split())
+    # PostgreSQL limits a tsvector to 1MB - very long chats are indexed on their start
+    return text[:CHAT_SEARCH_MAX_CHARS]
+
+
+#Words of a search query - used to find the snippet, PostgreSQL does the matching itself
+def query_terms(query):
+    return [word.lower() for word in _WORDS.findall(query) if word.lower() not in ("or", "and")]
+
+
+#Plain text of a ts_headline - its own markers are dropped so the snippet is escaped and marked by make_snippet
+def headline_text(headline):
+    return chat_search_text(headline.replace("<b>", "").replace("</b>", ""))
+
+
+#Short piece of text around the first query term found, with the terms marked in <b> like ts_headline does
+def make_snippet(text, terms, max_chars=CHAT_SEARCH_SNIPPET_CHARS):
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in terms if term and lowered.find(term) >= 0]
+    start = max(min(positions) - max_chars // 3, 0) if positions else 0
+    snippet = text[start:start + max_chars]
+    snippet = html.escape(snippet)
+    if terms:
+        # One pass over all the terms so a term inside another is not marked twice
+        alternatives = "|".join(re.escape(html.escape(term)) for term in sorted(set(terms), key=len, reverse=True))
+        snippet = re.sub(rf"(?i)\b((?:{alternatives})\w*)", r"<b>\1</b>", snippet)
+    return ("..." if start > 0 else "") + snippet + ("..." if start + max_chars < len(text) else "")
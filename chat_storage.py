@@ -0,0 +1,75 @@
+import json
+import zlib
+from config import CHAT_COMPRESSION, CHAT_COMPRESSION_LEVEL
+
+# Optional dependency - only needed when CHAT_COMPRESSION is zstd
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+''' Storage format for saved chats. Each message of a chat is compressed and stored as its own row in
+    chatchunks so a range of messages can be read without loading the whole chat. chattable.chatcontent
+    holds CHUNKED_MARKER followed by a small JSON header instead of the content. Rows saved before this
+    format hold the content itself and are returned as they are.
+'''
+CHUNKED_MARKER = "chatchunks:v1:"
+
+# First byte of every stored chunk - says how the rest of it is compressed
+RAW = b"r"
+ZLIB = b"z"
+ZSTD = b"s"
+
+
+def compress_chunk(text, method=CHAT_COMPRESSION, level=CHAT_COMPRESSION_LEVEL):
+    data = text.encode("utf-8")
+    if method == "zstd":
+        if zstandard is None:
+            raise ImportError("Please install `zstandard` to compress chats with zstd.")
+        return ZSTD + zstandard.ZstdCompressor(level=level).compress(data)
+    if method == "zlib":
+        return ZLIB + zlib.compress(data, level)
+    return RAW + data
+
+
+def decompress_chunk(chunk):
+    chunk = bytes(chunk)
+    marker, data = chunk[:1], chunk[1:]
+    if marker == ZLIB:
+        data = zlib.decompress(data)
+    elif marker == ZSTD:
+        if zstandard is None:
+            raise ImportError("Please install `zstandard` to read chats compressed with zstd.")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif marker != RAW:
+        raise ValueError(f"Unknown chat chunk format: {marker!r}")
+    return data.decode("utf-8")
+
+
+#Splits chat content into the header stored in chatcontent and the compressed chunks
+#A list is stored one message per chunk, anything else as a single chunk
+def encode_chat(content):
+    if isinstance(content, list):
+        # Lists holding anything other than strings (e.g. autogen message dicts) are stored as JSON
+        kind = "list" if all(isinstance(message, str) for message in content) else "json"
+        messages = content if kind == "list" else [json.dumps(message) for message in content]
+    else:
+        messages = [str(content)]
+        kind = "text"
+    header = CHUNKED_MARKER + json.dumps({"kind": kind, "count": len(messages)})
+    return header, [compress_chunk(message) for message in messages]
+
+
+#Reads the header stored in chatcontent - None for chats saved before the chunked format
+def read_header(chatcontent):
+    if not isinstance(chatcontent, str) or not chatcontent.startswith(CHUNKED_MARKER):
+        return None
+    return json.loads(chatcontent[len(CHUNKED_MARKER):])
+
+
+#Rebuilds the stored messages from the chunk rows of a chat
+def decode_messages(header, chunks):
+    messages = [decompress_chunk(chunk) for chunk in chunks]
+    if header["kind"] == "json":
+        messages = [json.loads(message) for message in messages]
+    return messages
@@ -0,0 +1,345 @@
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from hashlib import md5
+from pathlib import Path
+from autogen.code_utils import PYTHON_VARIANTS, TIMEOUT_MSG
+from autogen.coding.base import CommandLineCodeResult
+from autogen.coding.local_commandline_code_executor import LocalCommandLineCodeExecutor
+from autogen.coding.markdown_code_extractor import MarkdownCodeExtractor
+from autogen.coding.utils import _get_file_name_from_content, silence_pip
+from config import (
+    CODE_EXECUTOR, CODE_EXECUTOR_WORKERS, CODE_EXECUTOR_TIMEOUT, CODE_EXECUTOR_CPU_SECONDS, CODE_EXECUTOR_MEMORY_MB,
+    CODE_EXECUTOR_PRELOAD,
+)
+import sandbox_worker
+from sandbox_worker import SHELLS, send_message, recv_message
+from workspaces import workspace_manager, current_workspace
+from execution_cache import execution_cache, code_file_name
+
+# Seconds on top of the timeout a worker has to answer before it is treated as stuck and replaced
+WORKER_GRACE_SECONDS = 5
+# Output of a run the worker did not answer - never cached
+WORKER_FAILED = "Code executor worker failed"
+
+
+class _Worker:
+
+    def __init__(self, preload):
+        parent_sock, child_sock = socket.socketpair()
+        self.process = subprocess.Popen(
+            [sys.executable, sandbox_worker.__file__, str(child_sock.fileno()), *preload],
+            pass_fds=(child_sock.fileno(),), stdin=subprocess.DEVNULL, close_fds=True,
+        )
+        child_sock.close()
+        self.sock = parent_sock
+        self.ready = None
+
+    def run(self, task, wait):
+        self.sock.settimeout(None)
+        send_message(self.sock, task)
+        deadline = time.monotonic() + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("code executor worker did not answer")
+            # socket.timeout is a TimeoutError - the worker is replaced either way
+            self.sock.settimeout(remaining)
+            reply = recv_message(self.sock)
+            # Sent once when the worker has finished its imports
+            if "ready" in reply:
+                self.ready = reply["ready"]
+                continue
+            return reply
+
+    def stop(self):
+        try:
+            self.sock.settimeout(1)
+            send_message(self.sock, None)
+        except (OSError, ValueError):
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.sock.close()
+
+
+''' Pool of warm worker processes that run the code blocks user proxies execute - see sandbox_worker.py.
+    Workers are started on the first call (or by start()) and a worker that dies or stops answering is replaced.
+    A worker that can not be started leaves the pool a worker short until a later run starts it.
+'''
+class ExecutorPool:
+
+    def __init__(self, size=4, timeout=60, cpu_seconds=60, memory_mb=1024, preload=()):
+        self.size = size
+        # Wall clock seconds a code block can run for
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.preload = tuple(preload)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._executions = 0
+        self._timeouts = 0
+        self._replaced = 0
+        # Workers lost that could not be started again - retried on the next run
+        self._missing = 0
+        self._start_failures = 0
+        self._run_time = 0.0
+        self._wait_time = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._missing = self.size
+        self._restart_missing()
+
+    #New worker process - None if it can not be started (Popen failed, no file descriptors left)
+    def _start_worker(self):
+        try:
+            return _Worker(self.preload)
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            with self._lock:
+                self._start_failures += 1
+            print(f"Could not start a code executor worker: {str(e)}")
+            return None
+
+    #Starts the workers that were lost - the pool runs smaller until they can be started
+    def _restart_missing(self):
+        with self._lock:
+            missing, self._missing = self._missing, 0
+        for _ in range(missing):
+            self._put_back(self._start_worker())
+
+    #Only a live worker goes back to the idle queue - a dead one is counted as missing
+    def _put_back(self, worker):
+        if worker is not None and worker.process.poll() is None:
+            self._idle.put(worker)
+            return
+        if worker is not None:
+            worker.sock.close()
+        with self._lock:
+            self._missing += 1
+
+    #Runs a code file already written to work_dir - returns exit_code, output and timed_out
+    #max_file_bytes caps the size of any file the code writes
+    def run(self, path, language, work_dir, timeout=None, max_file_bytes=None):
+        self.start()
+        self._restart_missing()
+        with self._lock:
+            no_workers = self._missing >= self.size
+        if no_workers:
+            # Waiting on the idle queue would block forever
+            return {"exit_code": 1, "output": f"{WORKER_FAILED}: no worker could be started", "timed_out": False}
+        timeout = timeout or self.timeout
+        started = time.monotonic()
+        worker = self._idle.get()
+        waited = time.monotonic() - started
+        task = {"path": str(path), "language": language, "work_dir": str(work_dir), "timeout": timeout,
+                "cpu_seconds": self.cpu_seconds, "memory_mb": self.memory_mb, "max_file_bytes": max_file_bytes}
+        try:
+            # The first task also waits for the worker's imports
+            result = worker.run(task, timeout + WORKER_GRACE_SECONDS + (0 if worker.ready is not None else 60))
+        except (TimeoutError, EOFError, OSError, ValueError) as e:
+            worker.process.kill()
+            worker.process.wait()
+            worker.sock.close()
+            with self._lock:
+                self._replaced += 1
+            worker = self._start_worker()
+            result = {"exit_code": 1, "output": f"{WORKER_FAILED}: {e}", "timed_out": False}
+        finally:
+            self._put_back(worker)
+        with self._lock:
+            self._executions += 1
+            self._timeouts += 1 if result["timed_out"] else 0
+            self._run_time += time.monotonic() - started - waited
+            self._wait_time += waited
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": True,
+                "workers": self.size - self._missing if self._started else 0,
+                "idle": self._idle.qsize(),
+                "executions": self._executions,
+                "timeouts": self._timeouts,
+                "workers_replaced": self._replaced,
+                "worker_start_failures": self._start_failures,
+                "avg_run_ms": round(self._run_time / self._executions * 1000, 2) if self._executions else 0.0,
+                "avg_wait_ms": round(self._wait_time / self._executions * 1000, 2) if self._executions else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._started = False
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+''' Base of the user proxies' code executors. Code runs in the current workspace when a workspace scope is active
+    (see workspaces.py), otherwise in the fixed work_dir. A workspace over its size or file limit runs no more code.
+    With a cache, blocks already run against the same files return the earlier result - see execution_cache.py.
+'''
+class WorkspaceCodeExecutor:
+
+    def __init__(self, work_dir="groupchat", workspaces=None, cache=None):
+        self.work_dir = Path(work_dir).resolve()
+        # workspaces.WorkspaceManager - None to always use work_dir
+        self.workspaces = workspaces
+        # execution_cache.ExecutionCache - None to run every block
+        self.cache = cache
+        self._code_extractor = MarkdownCodeExtractor()
+
+    @property
+    def code_extractor(self):
+        return self._code_extractor
+
+    def execute_code_blocks(self, code_blocks):
+        key = current_workspace() if self.workspaces is not None else None
+        if key is None:
+            self.work_dir.mkdir(parents=True, exist_ok=True)
+            return self._execute_cached(code_blocks, self.work_dir, None)
+        work_dir = Path(self.workspaces.path(key)).resolve()
+        error = self.workspaces.check_quota(key)
+        if error is not None:
+            return CommandLineCodeResult(exit_code=1, output=error)
+        result = self._execute_cached(code_blocks, work_dir, self.workspaces.bytes_left(key))
+        # Reported now so the agents know the next code block will not run
+        error = self.workspaces.check_quota(key)
+        if error is not None:
+            return CommandLineCodeResult(exit_code=result.exit_code, output=f"{result.output}\n{error}", code_file=result.code_file)
+        return result
+
+    def _execute_cached(self, code_blocks, work_dir, max_file_bytes):
+        cache_key = self.cache.key(code_blocks, work_dir, type(self).__name__) if self.cache is not None else None
+        if cache_key is None:
+            return self._execute(code_blocks, work_dir, max_file_bytes)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self._write_code_files(code_blocks, work_dir)
+            exit_code, output, code_file = cached
+            return CommandLineCodeResult(exit_code=exit_code, output=output, code_file=code_file)
+        result = self._execute(code_blocks, work_dir, max_file_bytes)
+        # Timeouts, limits hit (killed by a signal) and lost workers may not happen again
+        if 0 <= result.exit_code != 124 and not result.output.startswith(WORKER_FAILED):
+            self.cache.set(cache_key, result.exit_code, result.output, result.code_file)
+        return result
+
+    #The blocks' code files are left out of the cache key - a hit writes them as a run would, so files the agents
+    #were told about hold the code they sent even if another version was written since
+    def _write_code_files(self, code_blocks, work_dir):
+        for code_block in code_blocks:
+            lang = code_block.language.lower()
+            lang = "python" if lang in PYTHON_VARIANTS else lang
+            written_file = (work_dir / code_file_name(code_block.code, lang, work_dir)).resolve()
+            written_file.parent.mkdir(parents=True, exist_ok=True)
+            with written_file.open("w", encoding="utf-8") as f:
+                f.write(silence_pip(code_block.code, lang))
+
+    def _execute(self, code_blocks, work_dir, max_file_bytes):
+        raise NotImplementedError
+
+    def restart(self):
+        pass
+
+
+''' Sends code blocks to an ExecutorPool. Code blocks are handled the same way as autogen's
+    LocalCommandLineCodeExecutor - files are written to the work dir (named by a "# filename:" first line or by the
+    hash of the code) and blocks run in order until one fails.
+'''
+class PooledCodeExecutor(WorkspaceCodeExecutor):
+
+    SUPPORTED_LANGUAGES = ["python", *SHELLS]
+
+    def __init__(self, pool, work_dir="groupchat", workspaces=None, cache=None):
+        super().__init__(work_dir, workspaces, cache)
+        self.pool = pool
+
+    def _execute(self, code_blocks, work_dir, max_file_bytes):
+        logs_all = ""
+        file_names = []
+        exit_code = 0
+        for code_block in code_blocks:
+            lang, code = code_block.language.lower(), code_block.code
+            if lang in PYTHON_VARIANTS:
+                lang = "python"
+            if lang not in self.SUPPORTED_LANGUAGES:
+                exit_code = 1
+                logs_all += "\n" + f"unknown language {lang}"
+                break
+            code = silence_pip(code, lang)
+            try:
+                filename = _get_file_name_from_content(code, work_dir)
+            except ValueError:
+                return CommandLineCodeResult(exit_code=1, output="Filename is not in the workspace")
+            if filename is None:
+                filename = f"tmp_code_{md5(code.encode()).hexdigest()}.{'py' if lang == 'python' else lang}"
+            written_file = (work_dir / filename).resolve()
+            written_file.parent.mkdir(parents=True, exist_ok=True)
+            with written_file.open("w", encoding="utf-8") as f:
+                f.write(code)
+            file_names.append(written_file)
+
+            result = self.pool.run(written_file, lang, work_dir, max_file_bytes=max_file_bytes)
+            logs_all += result["output"]
+            if result.get("truncated"):
+                logs_all += "\n(output truncated)"
+            if result["timed_out"]:
+                logs_all += "\n" + TIMEOUT_MSG
+                # Same exit code as the timeout command on linux
+                exit_code = 124
+                break
+            exit_code = result["exit_code"]
+            if exit_code != 0:
+                break
+        code_file = str(file_names[0]) if file_names else None
+        return CommandLineCodeResult(exit_code=exit_code, output=logs_all, code_file=code_file)
+
+
+#Runs every block in a new interpreter with autogen's LocalCommandLineCodeExecutor - CODE_EXECUTOR=local
+class LocalCodeExecutor(WorkspaceCodeExecutor):
+
+    def __init__(self, work_dir="groupchat", workspaces=None, cache=None, timeout=60):
+        super().__init__(work_dir, workspaces, cache)
+        self.timeout = timeout
+
+    def _execute(self, code_blocks, work_dir, max_file_bytes):
+        return LocalCommandLineCodeExecutor(work_dir=work_dir, timeout=int(self.timeout)).execute_code_blocks(code_blocks)
+
+
+# Shared by every user proxy - None when code runs with autogen's own executor
+executor_pool = ExecutorPool(
+    size=CODE_EXECUTOR_WORKERS,
+    timeout=CODE_EXECUTOR_TIMEOUT,
+    cpu_seconds=CODE_EXECUTOR_CPU_SECONDS,
+    memory_mb=CODE_EXECUTOR_MEMORY_MB,
+    preload=CODE_EXECUTOR_PRELOAD,
+) if CODE_EXECUTOR == "pool" and hasattr(os, "fork") else None
+
+
+#code_execution_config for a user proxy - blocks go to the executor pool when it is enabled, otherwise autogen
+#runs each block in a new interpreter. Code runs in the session's workspace, or work_dir outside a workspace scope
+def code_execution_config(work_dir="groupchat"):
+    if executor_pool is None:
+        return {"executor": LocalCodeExecutor(work_dir, workspace_manager, execution_cache, timeout=CODE_EXECUTOR_TIMEOUT)}
+    return {"executor": PooledCodeExecutor(executor_pool, work_dir, workspace_manager, execution_cache)}
+
+
+def get_code_executor_stats():
+    stats = executor_pool.stats() if executor_pool is not None else {"enabled": False}
+    stats["cache"] = execution_cache.stats() if execution_cache is not None else {"enabled": False}
+    return stats
@@ -1,5 +1,7 @@
 import os
+import json
 import dotenv
+from session_store import SessionStore, create_session_backend
 
 # Load environment variables
 dotenv.load_dotenv()
@@ -11,6 +13,8 @@ DATABASE_NAME = os.getenv('DATABASE_NAME')
 DATABASE_HOST = os.getenv('DATABASE_HOST')
 DATABASE_USERNAME = os.getenv('DATABASE_USERNAME')
 DATABASE_PORT = os.getenv('DATABASE_PORT')
+# OpenAI compatible endpoint to send requests to instead of api.openai.com - e.g. the benchmark stub server
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
 
 
 # Agent configuration
@@ -18,10 +22,197 @@ LLM_CONFIG = {
     # Temperature determines the creativity of response
     "temperature": 0.5,
     # Config list to pass agent model and api key
-    "config_list": [{"model": 'gpt-4o', 'api_key': OPENAIKEY}],
+    "config_list": [{"model": 'gpt-4o', 'api_key': OPENAIKEY, **({'base_url': OPENAI_BASE_URL} if OPENAI_BASE_URL else {})}],
     # timeout in second
     "timeout": 120,
+    # Turn off autogen's legacy disk cache - responses are cached by llm_cache.response_cache instead
+    "cache_seed": None,
 }
 
+# Shared HTTP connection pool used for every OpenAI request - see llm_gateway.py
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', 100))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', 20))
+# Seconds an idle connection is kept open for reuse
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('LLM_HTTP_KEEPALIVE_EXPIRY', 60))
+# HTTP/2 multiplexes requests over one connection - needs pip install h2
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+
+# Client side rate limits for OpenAI requests - set to the organisation's limits for the model
+LLM_SCHEDULER_ENABLED = os.getenv('LLM_SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LLM_RPM_LIMIT = int(os.getenv('LLM_RPM_LIMIT', 500))
+LLM_TPM_LIMIT = int(os.getenv('LLM_TPM_LIMIT', 30000))
+# Seconds a request waits for the rate limit before it is sent anyway - 0 to wait as long as it takes
+LLM_SCHEDULER_MAX_WAIT = float(os.getenv('LLM_SCHEDULER_MAX_WAIT', 120))
+# Completion tokens assumed for a request until its response reports the real usage
+LLM_COMPLETION_TOKEN_ESTIMATE = int(os.getenv('LLM_COMPLETION_TOKEN_ESTIMATE', 500))
+
+# LLM response cache - memory (LRU with TTL), sqlite or none
+LLM_CACHE_BACKEND = os.getenv('LLM_CACHE_BACKEND', 'memory').lower()
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 1000))
+# Seconds a cached response is served for
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 3600))
+LLM_CACHE_SQLITE_PATH = os.getenv('LLM_CACHE_SQLITE_PATH', 'llm_cache.db')
+# Only temperature 0 requests are cached unless this is switched on
+LLM_CACHE_NON_DETERMINISTIC = os.getenv('LLM_CACHE_NON_DETERMINISTIC', 'false').lower() in ('1', 'true', 'yes')
+
+# Stream reply chunks to websocket clients as agent_message_delta events while the reply is generated
+SOCKET_STREAMING = os.getenv('SOCKET_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+# Same configuration with streaming turned on - used by the websocket single agent chat. The last chunk
+# reports the reply's token usage for llm_usage.py
+STREAMING_LLM_CONFIG = {**LLM_CONFIG, "stream": True, "stream_options": {"include_usage": True}}
+
+# Prompt token budget for websocket single agent chats - older turns are left out of the prompt
+CONTEXT_WINDOW_MAX_TOKENS = int(os.getenv('CONTEXT_WINDOW_MAX_TOKENS', 4000))
+# Fold turns that leave the window into a rolling summary instead of dropping them
+CONTEXT_SUMMARISE = os.getenv('CONTEXT_SUMMARISE', 'true').lower() in ('1', 'true', 'yes')
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv('CONTEXT_SUMMARY_MAX_TOKENS', 300))
+
+# Seconds agentdata rows are cached for team chats - cleared whenever agents are created or deleted
+AGENT_CACHE_TTL = int(os.getenv('AGENT_CACHE_TTL', 300))
+# Prebuilt team chats kept for repeat messages to the same team
+TEAM_CACHE_MAX_TEAMS = int(os.getenv('TEAM_CACHE_MAX_TEAMS', 100))
+TEAM_CACHE_MAX_IDLE_PER_TEAM = int(os.getenv('TEAM_CACHE_MAX_IDLE_PER_TEAM', 2))
+
+# Websocket session store limits
+SESSION_MAX_SESSIONS = int(os.getenv('SESSION_MAX_SESSIONS', 500))
+# Seconds a session can sit idle before the reaper removes it
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', 1800))
+# Total chat history held by all sessions before the least recently used are evicted - 0 for no limit
+SESSION_MAX_MEMORY_MB = int(os.getenv('SESSION_MAX_MEMORY_MB', 0))
+SESSION_REAPER_INTERVAL = int(os.getenv('SESSION_REAPER_INTERVAL', 60))
+# Optional out of process store for session state, e.g. redis://localhost:6379/0
+SESSION_BACKEND_URL = os.getenv('SESSION_BACKEND_URL')
+# Key websocket session tokens are signed with - the same on every node. A random key per process when not set
+SESSION_TOKEN_SECRET = os.getenv('SESSION_TOKEN_SECRET')
+
 # Track active chat sessions - used for websockets
-ACTIVE_SESSIONS = {}
+ACTIVE_SESSIONS = SessionStore(
+    max_sessions=SESSION_MAX_SESSIONS,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_memory=SESSION_MAX_MEMORY_MB * 1024 * 1024 if SESSION_MAX_MEMORY_MB else None,
+    reaper_interval=SESSION_REAPER_INTERVAL,
+    backend=create_session_backend(SESSION_BACKEND_URL, ttl=SESSION_IDLE_TTL),
+)
+
+# Page size for /gather_previous_chat_names and /gather_teams - clients can ask for up to LIST_MAX_PAGE_SIZE
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', 50))
+LIST_MAX_PAGE_SIZE = int(os.getenv('LIST_MAX_PAGE_SIZE', 200))
+
+# Compression of saved chats - zlib, zstd (pip install zstandard) or none
+CHAT_COMPRESSION = os.getenv('CHAT_COMPRESSION', 'zlib').lower()
+CHAT_COMPRESSION_LEVEL = int(os.getenv('CHAT_COMPRESSION_LEVEL', 6))
+
+# Characters of a chat indexed for /search_chats, and length of the snippets returned
+CHAT_SEARCH_MAX_CHARS = int(os.getenv('CHAT_SEARCH_MAX_CHARS', 200000))
+CHAT_SEARCH_SNIPPET_CHARS = int(os.getenv('CHAT_SEARCH_SNIPPET_CHARS', 200))
+
+# Websocket messages are written to the database as they are produced - buffered and written in batches
+MESSAGE_LOG_ENABLED = os.getenv('MESSAGE_LOG_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv('MESSAGE_LOG_BATCH_SIZE', 20))
+# Seconds between writes of the buffered messages
+MESSAGE_LOG_FLUSH_INTERVAL = float(os.getenv('MESSAGE_LOG_FLUSH_INTERVAL', 2))
+MESSAGE_LOG_MAX_PENDING = int(os.getenv('MESSAGE_LOG_MAX_PENDING', 10000))
+# Days logged messages are kept for resuming - older ones are deleted, 0 to keep them
+MESSAGE_LOG_RETENTION_DAYS = int(os.getenv('MESSAGE_LOG_RETENTION_DAYS', 7))
+
+# Token use and cost of every LLM call - totalled in memory and written to llmusage in batches
+LLM_USAGE_ENABLED = os.getenv('LLM_USAGE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Seconds between writes of the totals
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv('LLM_USAGE_FLUSH_INTERVAL', 30))
+# Totals waiting to be written before a write is forced
+LLM_USAGE_BATCH_SIZE = int(os.getenv('LLM_USAGE_BATCH_SIZE', 200))
+# USD per million [prompt, completion] tokens by model name prefix, e.g. {"gpt-4o": [2.5, 10]}
+LLM_PRICES = json.loads(os.getenv('LLM_PRICES', json.dumps({
+    "gpt-4o-mini": [0.15, 0.60],
+    "gpt-4o": [2.50, 10.00],
+    "gpt-4.1-mini": [0.40, 1.60],
+    "gpt-4.1": [2.00, 8.00],
+})))
+
+# Tracing - span latencies are always served at /metrics, spans are exported as JSON lines when an exporter is set
+# none, stdout or file
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none').lower()
+TRACING_FILE_PATH = os.getenv('TRACING_FILE_PATH', 'traces.jsonl')
+# Share of traces exported - 1 exports every trace
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', 1.0))
+TRACING_SERVICE_NAME = os.getenv('TRACING_SERVICE_NAME', 'genaicolab-backend')
+
+# Code blocks run by the user proxies - pool (warm worker processes, see code_executor.py) or local (a new
+# interpreter per block, autogen's own executor)
+CODE_EXECUTOR = os.getenv('CODE_EXECUTOR', 'pool').lower()
+CODE_EXECUTOR_WORKERS = int(os.getenv('CODE_EXECUTOR_WORKERS', 4))
+# Wall clock and CPU seconds a code block can use before it is killed
+CODE_EXECUTOR_TIMEOUT = float(os.getenv('CODE_EXECUTOR_TIMEOUT', 60))
+CODE_EXECUTOR_CPU_SECONDS = int(os.getenv('CODE_EXECUTOR_CPU_SECONDS', 60))
+# Memory a code block can allocate - 0 for no limit
+CODE_EXECUTOR_MEMORY_MB = int(os.getenv('CODE_EXECUTOR_MEMORY_MB', 1024))
+# Modules imported once by each worker - ones that are not installed are skipped
+CODE_EXECUTOR_PRELOAD = [name.strip() for name in os.getenv(
+    'CODE_EXECUTOR_PRELOAD', 'json,re,math,random,datetime,collections,itertools,csv,sqlite3,numpy,pandas,matplotlib.pyplot,requests,flask'
+).split(',') if name.strip()]
+# Results of code blocks already run with the same files in the workspace are reused - see execution_cache.py
+CODE_EXECUTION_CACHE_ENABLED = os.getenv('CODE_EXECUTION_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CODE_EXECUTION_CACHE_MAX_ENTRIES = int(os.getenv('CODE_EXECUTION_CACHE_MAX_ENTRIES', 500))
+# Output held by the cache before the least recently used results are evicted
+CODE_EXECUTION_CACHE_MAX_MB = int(os.getenv('CODE_EXECUTION_CACHE_MAX_MB', 20))
+# Scratch directory per websocket session or REST request that code blocks run in - see workspaces.py
+# Created under /dev/shm (tmpfs) when the machine has it unless WORKSPACE_ROOT is set
+WORKSPACE_ROOT = os.getenv('WORKSPACE_ROOT')
+# Seconds a workspace can sit idle before it is removed
+WORKSPACE_TTL = int(os.getenv('WORKSPACE_TTL', 3600))
+# Size and number of files a workspace can hold - 0 for no limit
+WORKSPACE_MAX_MB = int(os.getenv('WORKSPACE_MAX_MB', 50))
+WORKSPACE_MAX_FILES = int(os.getenv('WORKSPACE_MAX_FILES', 1000))
+WORKSPACE_REAPER_INTERVAL = int(os.getenv('WORKSPACE_REAPER_INTERVAL', 300))
+
+# Database connection pool settings
+DATABASE_POOL_MIN_SIZE = int(os.getenv('DATABASE_POOL_MIN_SIZE', 1))
+DATABASE_POOL_MAX_SIZE = int(os.getenv('DATABASE_POOL_MAX_SIZE', 10))
+# Seconds to wait for a free connection
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', 10))
+# Connections are replaced after this many checkouts
+DATABASE_POOL_MAX_USES = int(os.getenv('DATABASE_POOL_MAX_USES', 500))
+# Idle seconds before a connection is pinged on checkout
+DATABASE_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DATABASE_POOL_HEALTH_CHECK_INTERVAL', 30))
+
+# Background chat jobs - /chat and /chat_team with "async": true
+# Number of conversations run at the same time
+CHAT_JOB_MAX_WORKERS = int(os.getenv('CHAT_JOB_MAX_WORKERS', 4))
+# Jobs waiting or running before new jobs are rejected
+CHAT_JOB_MAX_QUEUED = int(os.getenv('CHAT_JOB_MAX_QUEUED', 100))
+# Seconds a finished job result is kept for the client to collect
+CHAT_JOB_RESULT_TTL = int(os.getenv('CHAT_JOB_RESULT_TTL', 600))
+
+# Reset agents kept ready per agent pool for the REST chat routes
+AGENT_POOL_MAX_IDLE = int(os.getenv('AGENT_POOL_MAX_IDLE', 8))
+# Team chat speaker selection when the team has none of its own - auto (manager LLM), round_robin, rules or state_machine
+TEAM_SPEAKER_SELECTION = os.getenv('TEAM_SPEAKER_SELECTION', 'rules').lower()
+# Routes used in rules mode - the first pattern found in the last message picks the agent whose name contains "agent"
+TEAM_SPEAKER_ROUTES = json.loads(os.getenv('TEAM_SPEAKER_ROUTES', 'null')) or [
+    # Failed code goes back to the programmer
+    {"pattern": r"Traceback \(most recent call last\)|exitcode: [1-9]", "agent": "program"},
+    # Code to run goes to the user proxy, which executes it
+    {"pattern": r"```(python|py|sh|bash)\b", "agent": "proxy"},
+]
+# Threads answering team questions in the parallel team mode - three per team chat running at once
+TEAM_PARALLEL_MAX_WORKERS = int(os.getenv('TEAM_PARALLEL_MAX_WORKERS', 12))
+
+# Server run by serve.py - threading (one OS thread per request), eventlet or gevent (green threads, pip install
+# eventlet or gevent). app.py always runs the threading development server, serve.py only with
+# SERVER_ALLOW_DEV_SERVER=true (read by serve.py before the app is imported)
+SERVER_ASYNC_MODE = os.getenv('SERVER_ASYNC_MODE', 'threading').lower()
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', 5000))
+# Conversations (REST chats and websocket messages) running at once - others wait for a slot
+MAX_ACTIVE_CONVERSATIONS = int(os.getenv('MAX_ACTIVE_CONVERSATIONS', 200))
+# Seconds a conversation waits for a slot before the server answers busy
+CONVERSATION_WAIT_TIMEOUT = float(os.getenv('CONVERSATION_WAIT_TIMEOUT', 30))
+# OS threads for CPU bound work under eventlet or gevent
+OFFLOAD_THREADS = int(os.getenv('OFFLOAD_THREADS', 8))
+# Message queue shared by the nodes behind a load balancer, so an emit reaches the client whichever node it is
+# connected to - redis://, kafka://, zmq+tcp://, a kombu url such as amqp:// or memory:// (one process, for tests).
+# Set SESSION_BACKEND_URL too so any node can carry on a conversation
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'genaicolab')
+# Transports the server accepts - long polling needs sticky sessions at the load balancer, websocket alone does not
+SOCKETIO_TRANSPORTS = [t.strip() for t in os.getenv('SOCKETIO_TRANSPORTS', 'polling,websocket').split(',') if t.strip()]
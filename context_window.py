@@ -0,0 +1,111 @@
+import threading
+from autogen.token_count_utils import count_token
+
+# Set once tiktoken could not load its encoding (e.g. no network access) so the estimate is used from then on
+_tiktoken_unavailable = False
+
+
+#Number of prompt tokens for a list of messages - falls back to roughly four characters per token
+def count_message_tokens(messages, model="gpt-4o"):
+    global _tiktoken_unavailable
+    if not _tiktoken_unavailable:
+        try:
+            return count_token(messages, model)
+        except Exception as e:
+            print(f"Token counting unavailable, estimating instead: {str(e)}")
+            _tiktoken_unavailable = True
+    characters = sum(len(str(message.get("content") or "")) for message in messages)
+    # Each message carries a few tokens of role and formatting overhead
+    return characters // 4 + 4 * len(messages)
+
+
+#Summariser that asks the model to fold older turns into the running summary
+def make_llm_summariser(client, max_tokens=300):
+    def summarise(previous_summary, messages):
+        conversation = "\n".join(f"{message.get('role')}: {message.get('content')}" for message in messages)
+        prompt = (
+            "Update the summary of an ongoing conversation with the new turns below. Keep facts, decisions, "
+            "names and open questions. Reply with the summary only.\n\n"
+            f"Current summary:\n{previous_summary or 'None'}\n\nNew turns:\n{conversation}"
+        )
+        # Streaming is turned off so the summary is not sent to the client as reply chunks
+        response = client.create(messages=[{"role": "user", "content": prompt}], max_tokens=max_tokens, stream=False)
+        return client.extract_text_or_completion_object(response)[0]
+    return summarise
+
+
+''' Keeps the prompt sent to the model under a token budget however long a websocket session runs.
+    Registered on the session assistant as a process_all_messages_before_reply hook, so it is applied on every
+    generate_reply. The newest messages that fit the budget are sent as they are. Older messages are either dropped
+    or, when a summariser is given, folded into a rolling summary sent ahead of the window.
+'''
+class ConversationWindow:
+
+    def __init__(self, max_tokens=4000, summariser=None, model="gpt-4o", summary_tokens=300):
+        self.max_tokens = max_tokens
+        self.summariser = summariser
+        # Budget kept free for the summary before the first one has been written
+        self.summary_tokens = summary_tokens
+        self.model = model
+        self.summary = None
+        # Number of messages from the start of the history already folded into the summary
+        self.summarised_count = 0
+        self._lock = threading.Lock()
+        # Token counts of the last prompt - used to check the prompt size stays flat
+        self.last_history_tokens = 0
+        self.last_prompt_tokens = 0
+
+    def __call__(self, messages):
+        return self.apply(messages)
+
+    def apply(self, messages):
+        with self._lock:
+            self.last_history_tokens = count_message_tokens(messages, self.model)
+            if self.last_history_tokens <= self.max_tokens and self.summary is None:
+                self.last_prompt_tokens = self.last_history_tokens
+                return messages
+
+            start = self._window_start(messages)
+            # Fold the messages that have just left the window into the summary
+            if self.summariser is not None and start > self.summarised_count:
+                try:
+                    self.summary = self.summariser(self.summary, messages[self.summarised_count:start])
+                    self.summarised_count = start
+                except Exception as e:
+                    # The reply still goes ahead with the window alone
+                    print(f"Error summarising conversation: {str(e)}")
+
+            prompt = list(messages[start:])
+            if self.summary:
+                prompt.insert(0, {"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+            self.last_prompt_tokens = count_message_tokens(prompt, self.model)
+            return prompt
+
+    def reset(self):
+        with self._lock:
+            self.summary = None
+            self.summarised_count = 0
+
+    def stats(self):
+        return {
+            "history_tokens": self.last_history_tokens,
+            "prompt_tokens": self.last_prompt_tokens,
+            "summarised_messages": self.summarised_count,
+        }
+
+    def _window_start(self, messages):
+        # Index of the oldest message that still fits the budget - the newest message is always kept
+        budget = self.max_tokens
+        if self.summary:
+            budget -= count_message_tokens([{"role": "system", "content": self.summary}], self.model)
+        elif self.summariser is not None:
+            budget -= self.summary_tokens
+        start = len(messages)
+        while start > 0:
+            tokens = count_message_tokens([messages[start - 1]], self.model)
+            if budget - tokens < 0 and start < len(messages):
+                break
+            budget -= tokens
+            start -= 1
+        # Never go back before messages that are already in the summary
+        return max(start, self.summarised_count) if self.summary else start
@@ -1,15 +1,268 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
-from config import DATABASE_NAME, DATABASE_HOST, DATABASE_USERNAME, DATABASE_PASSWORD, DATABASE_PORT
+from psycopg2 import extensions
+from tracing import tracer
+from config import (
+    DATABASE_NAME, DATABASE_HOST, DATABASE_USERNAME, DATABASE_PASSWORD, DATABASE_PORT,
+    DATABASE_POOL_MIN_SIZE, DATABASE_POOL_MAX_SIZE, DATABASE_POOL_TIMEOUT,
+    DATABASE_POOL_MAX_USES, DATABASE_POOL_HEALTH_CHECK_INTERVAL,
+)
+
+# Quoted literals and everything from VALUES on are left out of traced statements
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_VALUES = re.compile(r"\bVALUES\b", re.IGNORECASE)
+
+
+#The statement recorded on a query's span - without the values, which hold chat content and emails. psycopg2's
+#helpers (execute_values, mogrify) pass queries as bytes with the values already in them, so only the part
+#before VALUES is kept of those, and nothing if there is no VALUES to cut at
+def traced_statement(query):
+    if isinstance(query, bytes):
+        match = _VALUES.search(query.decode("utf-8", "replace"))
+        return query.decode("utf-8", "replace")[:match.end()] if match else None
+    statement = str(query)
+    match = _VALUES.search(statement)
+    if match:
+        statement = statement[:match.end()]
+    return _LITERAL.sub("?", statement)
+
+
+# Cursor putting every query in a db.execute span - used for every connection the pool opens
+class TracingCursor(extensions.cursor):
+
+    def execute(self, query, vars=None):
+        statement = traced_statement(query)
+        # The statement without its values - enough to tell the queries apart
+        with tracer.span("db.execute", **({"db.statement": statement[:200]} if statement else {})):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        statement = traced_statement(query)
+        with tracer.span("db.executemany", **({"db.statement": statement[:200]} if statement else {})):
+            return super().executemany(query, vars_list)
+
 
 def connect_to_database():
     # Connect to database using the environment variables
-    conn = psycopg2.connect(
-        database=DATABASE_NAME,
-        host=DATABASE_HOST,
-        user=DATABASE_USERNAME,
-        password=DATABASE_PASSWORD,
-        port=DATABASE_PORT
-    )
-    
+    with tracer.span("db.connect"):
+        conn = psycopg2.connect(
+            database=DATABASE_NAME,
+            host=DATABASE_HOST,
+            user=DATABASE_USERNAME,
+            password=DATABASE_PASSWORD,
+            port=DATABASE_PORT,
+            cursor_factory=TracingCursor,
+        )
+
     # Return the connection
     return conn
+
+
+# Raised when no connection could be checked out before the timeout ran out
+class PoolTimeoutError(Exception):
+    pass
+
+
+''' Connection pool shared by every blueprint and socket handler. Opening a new psycopg2 connection per request
+    costs a TCP + auth handshake, so connections are kept open and handed out again once a request is finished.
+'''
+class ConnectionPool:
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10.0, max_uses=500, health_check_interval=30.0):
+        # Function used to open a brand new connection
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        # Seconds a checkout waits for a free connection before giving up
+        self.timeout = timeout
+        # Connections are closed and replaced after this many checkouts
+        self.max_uses = max_uses
+        # Idle connections older than this are pinged before being handed out
+        self.health_check_interval = health_check_interval
+
+        self._condition = threading.Condition()
+        # Idle connections - list of [connection, times used, time returned to the pool]
+        self._idle = []
+        # Times used for connections currently checked out, keyed by id(connection)
+        self._in_use = {}
+        self._closed = False
+
+        # Metrics used to size the pool
+        self._checkouts = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def fill(self):
+        # Open connections until the minimum size is reached
+        with self._condition:
+            while len(self._idle) + len(self._in_use) < self.min_size:
+                self._idle.append([self._connect(), 0, time.monotonic()])
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+
+                if self._idle:
+                    conn, uses, returned_at = self._idle.pop()
+                    # Skip connections that have dropped while sitting in the pool
+                    if not self._is_healthy(conn, returned_at):
+                        self._discard(conn)
+                        continue
+                    break
+
+                # Room to open a new connection
+                if len(self._in_use) < self.max_size:
+                    # Reserve the slot before releasing the lock to connect
+                    placeholder = object()
+                    self._in_use[id(placeholder)] = 0
+                    self._condition.release()
+                    try:
+                        conn = self._connect()
+                    finally:
+                        self._condition.acquire()
+                        del self._in_use[id(placeholder)]
+                        self._condition.notify()
+                    uses = 0
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(f"No database connection available after {self.timeout} seconds")
+                self._condition.wait(remaining)
+
+            self._in_use[id(conn)] = uses + 1
+            waited = time.monotonic() - started
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            return conn
+
+    def putconn(self, conn, discard=False):
+        with self._condition:
+            uses = self._in_use.pop(id(conn), 0)
+            # Throw away connections that are broken, worn out or returned after the pool was closed
+            if discard or self._closed or conn.closed:
+                self._discard(conn)
+            elif self.max_uses and uses >= self.max_uses:
+                self._recycled += 1
+                self._close_quietly(conn)
+            else:
+                # Never hand out a connection with a transaction left open
+                try:
+                    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    self._idle.append([conn, uses, time.monotonic()])
+                except Exception:
+                    self._discard(conn)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        # Checkout a connection for the length of the with block, rolling back if the block fails
+        with tracer.span("db.checkout"):
+            conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+                "average_wait_ms": round(self._total_wait / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+            }
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            for conn, _, _ in self._idle:
+                self._close_quietly(conn)
+            self._idle = []
+            self._condition.notify_all()
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        # Only ping connections that have been idle for a while, a fresh one is assumed alive
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._discarded += 1
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# Process wide pool - created on first use so importing the app does not require a database
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(
+                    connect_to_database,
+                    min_size=DATABASE_POOL_MIN_SIZE,
+                    max_size=DATABASE_POOL_MAX_SIZE,
+                    timeout=DATABASE_POOL_TIMEOUT,
+                    max_uses=DATABASE_POOL_MAX_USES,
+                    health_check_interval=DATABASE_POOL_HEALTH_CHECK_INTERVAL,
+                )
+                pool.fill()
+                _pool = pool
+    return _pool
+
+def database_connection():
+    # Context manager used by the routes - with database_connection() as conn:
+    return get_pool().connection()
+
+def get_pool_stats():
+    # Report empty stats rather than connecting just to answer a metrics request
+    if _pool is None:
+        return {"in_use": 0, "idle": 0, "min_size": DATABASE_POOL_MIN_SIZE, "max_size": DATABASE_POOL_MAX_SIZE,
+                "checkouts": 0, "timeouts": 0, "recycled": 0, "discarded": 0,
+                "average_wait_ms": 0.0, "max_wait_ms": 0.0}
+    return _pool.stats()
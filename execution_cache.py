@@ -0,0 +1,182 @@
+import ast
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from hashlib import md5
+from autogen.code_utils import PYTHON_VARIANTS
+from autogen.coding.utils import _get_file_name_from_content
+from config import CODE_EXECUTION_CACHE_ENABLED, CODE_EXECUTION_CACHE_MAX_ENTRIES, CODE_EXECUTION_CACHE_MAX_MB
+
+# Code that can give a different result each time it runs is never cached - clocks, randomness, user input,
+# the network, other processes and installs. Any block can opt out with a "# nocache" comment.
+NO_CACHE_COMMENT = re.compile(r"#\s*nocache\b")
+# Python modules whose import marks a block - found in every import statement by parsing the code
+NON_DETERMINISTIC_MODULES = {
+    "random", "secrets", "uuid", "time", "socket", "requests", "urllib", "http", "httpx", "aiohttp", "subprocess",
+    "threading", "multiprocessing", "asyncio",
+}
+# Names imported from a module that mark a block, e.g. from os import urandom
+NON_DETERMINISTIC_NAMES = {"os.urandom", "os.getrandom", "numpy.random"}
+# Clock reads on anything imported from datetime, e.g. from datetime import datetime as dt; dt.now()
+CLOCK_ATTRIBUTES = {"now", "today", "utcnow"}
+PYTHON_NON_DETERMINISTIC = re.compile(
+    r"\b(datetime|date)\.(now|today|utcnow)\b|\bos\.urandom\b|\b(np|numpy)\.random\b|\binput\s*\(|^\s*! ?pip",
+    re.MULTILINE,
+)
+SHELL_NON_DETERMINISTIC = re.compile(r"\$RANDOM|\b(date|curl|wget|sleep|pip3?)\b")
+
+# Directories left out of the workspace hash - python rewrites them whenever a code file changes
+IGNORED_DIRS = {"__pycache__"}
+
+
+def is_non_deterministic(code, language):
+    if NO_CACHE_COMMENT.search(code):
+        return True
+    if language == "python" or language in PYTHON_VARIANTS:
+        return PYTHON_NON_DETERMINISTIC.search(code) is not None or _imports_non_deterministic(code)
+    return SHELL_NON_DETERMINISTIC.search(code) is not None
+
+
+#True if the python code imports a non deterministic module or name - also for code that does not parse,
+#which can not be checked
+def _imports_non_deterministic(code):
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return True
+    imported = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imported += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            imported += [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+        elif isinstance(node, ast.Call) and node.args and isinstance(node.args[0], ast.Constant) \
+                and isinstance(node.args[0].value, str) and _call_name(node.func) in ("__import__", "import_module"):
+            # __import__("random") and importlib.import_module("random")
+            imported.append(node.args[0].value)
+    modules = {name.split(".")[0] for name in imported}
+    if modules & NON_DETERMINISTIC_MODULES or NON_DETERMINISTIC_NAMES.intersection(imported):
+        return True
+    if "datetime" in modules:
+        return any(isinstance(node, ast.Attribute) and node.attr in CLOCK_ATTRIBUTES for node in ast.walk(tree))
+    return False
+
+
+def _call_name(func):
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return None
+
+
+#Name the executor gives a block's code file, relative to work_dir - None if it would be outside work_dir
+def code_file_name(code, language, work_dir):
+    language = "python" if language in PYTHON_VARIANTS else language
+    try:
+        filename = _get_file_name_from_content(code, work_dir)
+    except ValueError:
+        return None
+    return filename or f"tmp_code_{md5(code.encode()).hexdigest()}.{'py' if language == 'python' else language}"
+
+
+#sha256 of every file under work_dir by relative path - excluding the given relative paths
+def workspace_digest(work_dir, exclude=()):
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(work_dir):
+        dirnames[:] = sorted(name for name in dirnames if name not in IGNORED_DIRS)
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            relative = os.path.relpath(path, work_dir)
+            if relative in exclude:
+                continue
+            digest.update(relative.encode("utf-8") + b"\0")
+            try:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(65536), b""):
+                        digest.update(chunk)
+            except OSError:
+                continue
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+''' Results of code blocks the user proxies have already run - team chats often run the same unchanged code again
+    while fixing errors. Keyed by the code blocks, the executor and interpreter, the work dir and a hash of the files
+    in it (the blocks' own code files left out - the executor writes them on a hit), so a hit is the result the
+    blocks would give if run again. Least recently used results are evicted past max_entries or max_bytes of output.
+'''
+class ExecutionCache:
+
+    def __init__(self, max_entries=500, max_bytes=20 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (exit_code, output, code_file)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Runs not cached because their code is non deterministic
+        self.skipped = 0
+
+    #Cache key for running code_blocks in work_dir - None when the result must not be cached
+    def key(self, code_blocks, work_dir, executor):
+        blocks = [(block.language.lower(), block.code) for block in code_blocks]
+        code_files = set()
+        for language, code in blocks:
+            filename = None if is_non_deterministic(code, language) else code_file_name(code, language, work_dir)
+            if filename is None:
+                with self._lock:
+                    self.skipped += 1
+                return None
+            code_files.add(filename)
+        interpreter = [executor, sys.executable, sys.version]
+        identity = json.dumps([interpreter, str(work_dir), blocks])
+        return hashlib.sha256(f"{identity}\0{workspace_digest(work_dir, code_files)}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, exit_code, output, code_file=None):
+        size = len(output.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1].encode("utf-8"))
+            self._entries[key] = (exit_code, output, code_file)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[1].encode("utf-8"))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+execution_cache = ExecutionCache(
+    max_entries=CODE_EXECUTION_CACHE_MAX_ENTRIES,
+    max_bytes=CODE_EXECUTION_CACHE_MAX_MB * 1024 * 1024,
+) if CODE_EXECUTION_CACHE_ENABLED else None
@@ -0,0 +1,177 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import autogen
+from config import CHAT_JOB_MAX_WORKERS, CHAT_JOB_MAX_QUEUED, CHAT_JOB_RESULT_TTL
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# Job running on the current worker thread - used by cancelled_reply to find the job it belongs to
+_local = threading.local()
+
+
+# Raised when the job queue is full
+class JobQueueFullError(Exception):
+    pass
+
+
+class ChatJob:
+
+    def __init__(self, kind):
+        self.job_id = uuid.uuid4().hex
+        # chat or chat_team
+        self.kind = kind
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Set when the job is cancelled - checked by the agents between turns
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def to_dict(self):
+        job = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == COMPLETED:
+            job["response"] = self.result
+        if self.status == FAILED:
+            job["error"] = self.error
+        return job
+
+
+''' Runs chat conversations on a bounded pool of worker threads so the Flask request thread returns straight away.
+    Clients poll /chat_job_status or subscribe over the websocket for the result.
+'''
+class JobManager:
+
+    def __init__(self, max_workers=4, max_queued=100, result_ttl=600):
+        self.max_workers = max_workers
+        # Maximum number of jobs waiting or running before new jobs are rejected
+        self.max_queued = max_queued
+        # Seconds a finished job is kept so the client can collect the result
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat_job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Callbacks called with the job each time its status changes
+        self._listeners = []
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def submit(self, kind, function, *args, **kwargs):
+        with self._lock:
+            self._prune()
+            active = sum(1 for job in self._jobs.values() if job.status not in FINISHED_STATES)
+            if active >= self.max_queued:
+                raise JobQueueFullError(f"Too many chat jobs in progress ({active})")
+            job = ChatJob(kind)
+            self._jobs[job.job_id] = job
+        job.future = self._executor.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            return False
+        job.cancel_event.set()
+        # A queued job is dropped straight away, a running job stops at the next agent turn
+        if job.future is not None and job.future.cancel():
+            self._finish(job, CANCELLED)
+        return True
+
+    def stats(self):
+        with self._lock:
+            counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        counts["max_workers"] = self.max_workers
+        return counts
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job, function, args, kwargs):
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._notify(job)
+        _local.job = job
+        try:
+            result = function(*args, **kwargs)
+            if job.cancel_event.is_set():
+                self._finish(job, CANCELLED)
+            else:
+                job.result = result
+                self._finish(job, COMPLETED)
+        except Exception as e:
+            print(f"Chat job {job.job_id} failed: {str(e)}")
+            job.error = str(e)
+            self._finish(job, FAILED)
+        finally:
+            _local.job = None
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        self._notify(job)
+
+    def _notify(self, job):
+        for callback in self._listeners:
+            try:
+                callback(job)
+            except Exception as e:
+                print(f"Chat job listener failed: {str(e)}")
+
+    def _prune(self):
+        # Drop finished jobs whose results have expired - caller holds the lock
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status in FINISHED_STATES and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def current_job_cancelled():
+    job = getattr(_local, "job", None)
+    return job is not None and job.cancel_event.is_set()
+
+#Reply function registered on chat agents - returning None as the final reply ends the conversation,
+#which is how a running job stops once it has been cancelled.
+def cancelled_reply(recipient, messages=None, sender=None, config=None):
+    if current_job_cancelled():
+        return True, None
+    return False, None
+
+def register_cancellation(agent):
+    agent.register_reply([autogen.Agent, None], cancelled_reply)
+
+
+# Process wide job manager used by the chat routes
+chat_jobs = JobManager(
+    max_workers=CHAT_JOB_MAX_WORKERS,
+    max_queued=CHAT_JOB_MAX_QUEUED,
+    result_ttl=CHAT_JOB_RESULT_TTL,
+)
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    LLM_CACHE_BACKEND, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL, LLM_CACHE_SQLITE_PATH, LLM_CACHE_NON_DETERMINISTIC,
+)
+
+# Request parameters that do not change the completion - left out of the cache key so a streamed
+# and a non streamed request for the same conversation share one entry
+IGNORED_PARAMS = ("stream", "timeout")
+
+
+#Builds the cache key from the request autogen would send - model, temperature and the system message plus
+#message history with line endings and trailing whitespace normalised. Indentation and line breaks are kept, they
+#change the meaning of code in a prompt
+def normalise_key(params):
+    messages = []
+    for message in params.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            content = "\n".join(line.rstrip() for line in content.strip().splitlines())
+        messages.append({"role": message.get("role"), "name": message.get("name"), "content": content})
+    key = {k: v for k, v in params.items() if k not in IGNORED_PARAMS and k != "messages"}
+    key["messages"] = messages
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# In memory least recently used cache - entries expire after ttl seconds
+class MemoryCacheBackend:
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            # Evict the least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# SQLite file cache - survives restarts and can be shared by workers on the same machine
+class SQLiteCacheBackend:
+
+    def __init__(self, path, ttl=3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (cachekey TEXT PRIMARY KEY, cachevalue BLOB, expiresat REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cachevalue, expiresat FROM llm_cache WHERE cachekey = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM llm_cache WHERE cachekey = ?", (key,))
+                self._conn.commit()
+                return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        data = pickle.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (cachekey, cachevalue, expiresat) VALUES (?, ?, ?)",
+                (key, data, time.time() + self.ttl)
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+''' Response cache passed to autogen as the agents' cache (initiate_chat(cache=...) / agent.client_cache).
+    Autogen calls get() with the request as a JSON key before calling OpenAI and set() with the response after.
+    Only deterministic requests (temperature 0) are cached unless non deterministic caching is switched on.
+'''
+class ResponseCache:
+
+    def __init__(self, backend, cache_non_deterministic=False):
+        self.backend = backend
+        self.cache_non_deterministic = cache_non_deterministic
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Requests not cached because their temperature is above 0
+        self.skipped = 0
+
+    def _cache_key(self, key):
+        params = json.loads(key)
+        if not self.cache_non_deterministic and params.get("temperature", 1) != 0:
+            return None
+        return normalise_key(params)
+
+    def get(self, key, default=None):
+        cache_key = self._cache_key(key)
+        if cache_key is None:
+            with self._lock:
+                self.skipped += 1
+            return default
+        value = self.backend.get(cache_key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return default if value is None else value
+
+    def set(self, key, value):
+        cache_key = self._cache_key(key)
+        if cache_key is not None:
+            self.backend.set(cache_key, value)
+
+    def close(self):
+        # Autogen closes the cache after every request - the backend is kept open for the next one
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "entries": len(self.backend),
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def create_response_cache():
+    if LLM_CACHE_BACKEND == "none":
+        return None
+    if LLM_CACHE_BACKEND == "sqlite":
+        backend = SQLiteCacheBackend(LLM_CACHE_SQLITE_PATH, ttl=LLM_CACHE_TTL)
+    else:
+        backend = MemoryCacheBackend(max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL)
+    return ResponseCache(backend, cache_non_deterministic=LLM_CACHE_NON_DETERMINISTIC)
+
+
+# Process wide response cache used by the chat routes and socket handlers - None when caching is turned off
+response_cache = create_response_cache()
+
+def get_response_cache_stats():
+    if response_cache is None:
+        return {"backend": "none"}
+    return response_cache.stats()
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+import openai
+from llm_scheduler import RequestScheduler
+from llm_usage import usage_recorder
+from tracing import tracer
+from config import (
+    LLM_CONFIG, OPENAIKEY, OPENAI_BASE_URL, LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_MAX_KEEPALIVE, LLM_HTTP_KEEPALIVE_EXPIRY, LLM_HTTP2,
+    LLM_SCHEDULER_ENABLED, LLM_RPM_LIMIT, LLM_TPM_LIMIT, LLM_SCHEDULER_MAX_WAIT, LLM_COMPLETION_TOKEN_ESTIMATE,
+)
+
+# The HTTP library the openai package is built on - httpx, or httpx2 in newer openai releases
+try:
+    import httpx
+except ImportError:
+    import httpx2 as httpx
+
+# Optional dependency - HTTP/2 needs the h2 package
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+
+# Autogen deep copies llm_config for every agent - the copies must share the pooled client rather than clone it
+class SharedHttpClient(openai.DefaultHttpxClient):
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class SharedAsyncHttpClient(openai.DefaultAsyncHttpxClient):
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+''' Process wide gateway to the OpenAI API. One pooled HTTP client is shared by every agent built from
+    config.LLM_CONFIG (install() adds it to the config list), so keep-alive connections and their TLS setup are
+    reused across agents, sessions and requests. asyncio callers use async_client(), which shares a second pool.
+    With a scheduler every request first waits for room under the rate limits - see llm_scheduler.py - and a
+    usage recorder is told the tokens, cost and latency of every completion - see llm_usage.py.
+'''
+class LLMGateway:
+
+    def __init__(self, max_connections=100, max_keepalive=20, keepalive_expiry=60.0, http2=False, api_key=None, base_url=None, scheduler=None, usage=None):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and h2 is not None
+        self.api_key = api_key
+        self.base_url = base_url
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.scheduler = scheduler
+        self.usage = usage
+        # The scheduler's wait comes before the usage recorder starts timing the request
+        observers = [observer for observer in (scheduler, usage) if observer is not None]
+        self._request_hooks = [observer.before_request for observer in observers]
+        self._response_hooks = [observer.after_response for observer in observers]
+        self.http_client = SharedHttpClient(limits=self.limits, http2=self.http2, event_hooks={
+            "request": [self._trace_request, *self._request_hooks],
+            "response": [*self._response_hooks, self._trace_response],
+        })
+        self._async_http_client = None
+        self._async_openai = None
+
+    def install(self, llm_config):
+        # Points every entry of an llm_config's config list at the shared client - configs copied from it
+        # with {**LLM_CONFIG, ...} share the same list so use the client too
+        for entry in llm_config.get("config_list", []):
+            entry.setdefault("http_client", self.http_client)
+        return llm_config
+
+    def async_client(self):
+        # openai.AsyncOpenAI on the shared async pool - for callers running in an asyncio event loop
+        with self._lock:
+            if self._async_openai is None:
+                self._async_http_client = SharedAsyncHttpClient(limits=self.limits, http2=self.http2, event_hooks={
+                    "request": [self._trace_async_request, self._async_request_hooks],
+                    "response": [self._async_response_hooks, self._atrace_response],
+                })
+                self._async_openai = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=self._async_http_client)
+            return self._async_openai
+
+    async def acreate(self, **params):
+        # Chat completion for asyncio callers, e.g. await llm_gateway.acreate(model="gpt-4o", messages=[...])
+        return await self.async_client().chat.completions.create(**params)
+
+    async def _async_request_hooks(self, request):
+        # The scheduler blocks while waiting - run it off the event loop
+        for hook in self._request_hooks:
+            await asyncio.to_thread(hook, request)
+
+    async def _async_response_hooks(self, response):
+        # The sync hooks read the usage from the body - read it here without blocking the event loop
+        if self._response_hooks and response.status_code < 400 and "json" in response.headers.get("content-type", ""):
+            await response.aread()
+        for hook in self._response_hooks:
+            hook(response)
+
+    def stats(self):
+        with self._lock:
+            reused = max(self.requests - self.connections_opened, 0)
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "tls_handshakes": self.tls_handshakes,
+                "connection_reuse_rate": round(reused / self.requests, 3) if self.requests else 0.0,
+                "http2": self.http2,
+                "max_connections": self.limits.max_connections,
+            }
+
+    def close(self):
+        self.http_client.close()
+
+    def _trace_request(self, request):
+        with self._lock:
+            self.requests += 1
+        # The trace extension reports each new connection the pool opens
+        request.extensions["trace"] = self._trace
+        request.extensions["llm_span_started"] = time.time_ns()
+
+    async def _trace_async_request(self, request):
+        with self._lock:
+            self.requests += 1
+        # The async pool awaits its trace callback
+        request.extensions["trace"] = self._atrace
+        request.extensions["llm_span_started"] = time.time_ns()
+
+    def _trace_response(self, response):
+        # One llm.request span from sending (including the rate limit wait) to the response being read
+        started = response.request.extensions.get("llm_span_started")
+        if started is not None:
+            tracer.record_span(
+                "llm.request", started, error=f"HTTP {response.status_code}" if response.status_code >= 400 else None,
+                **{"http.status_code": response.status_code, "http.url": str(response.request.url.path)}
+            )
+
+    async def _atrace_response(self, response):
+        self._trace_response(response)
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    async def _atrace(self, event_name, info):
+        self._trace(event_name, info)
+
+
+# Process wide gateway - installed into LLM_CONFIG so every agent shares its connections
+llm_gateway = LLMGateway(
+    max_connections=LLM_HTTP_MAX_CONNECTIONS,
+    max_keepalive=LLM_HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+    http2=LLM_HTTP2,
+    api_key=OPENAIKEY,
+    base_url=OPENAI_BASE_URL,
+    scheduler=RequestScheduler(
+        rpm=LLM_RPM_LIMIT,
+        tpm=LLM_TPM_LIMIT,
+        max_wait=LLM_SCHEDULER_MAX_WAIT or None,
+        completion_estimate=LLM_COMPLETION_TOKEN_ESTIMATE,
+    ) if LLM_SCHEDULER_ENABLED else None,
+    usage=usage_recorder,
+)
+llm_gateway.install(LLM_CONFIG)
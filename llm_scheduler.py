@@ -0,0 +1,231 @@
+import json
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from tracing import tracer
+
+# Request priorities - lower goes first
+INTERACTIVE = 0
+DEFAULT = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", DEFAULT: "default", BATCH: "batch"}
+
+# Durations in OpenAI's rate limit reset headers, e.g. "6m0s" or "120ms"
+_DURATION = re.compile(r"([\d.]+)(ms|s|m|h)")
+
+# (user, priority) of the code making LLM calls - set by the chat routes and socket handlers
+_requester = ContextVar("llm_requester", default=("anonymous", DEFAULT))
+
+
+#Marks the LLM calls made inside the block as coming from this user (email or session id) at this priority
+@contextmanager
+def requester(user, priority=DEFAULT):
+    token = _requester.set((str(user or "anonymous"), priority))
+    try:
+        yield
+    finally:
+        _requester.reset(token)
+
+
+#(user, priority) the LLM calls made here are scheduled for
+def current_requester():
+    return _requester.get()
+
+
+#Wraps a function so the LLM calls it makes are scheduled for this user - used for work run on another thread
+def bind_requester(fn, user, priority=DEFAULT):
+    def run(*args, **kwargs):
+        with requester(user, priority):
+            return fn(*args, **kwargs)
+    return run
+
+
+#Rough number of tokens a chat completion request will use - the prompt at about four characters per token
+#plus the completion, which is corrected from the response's usage once it arrives
+def estimate_request_tokens(body, completion_estimate=500):
+    prompt = sum(len(str(message.get("content") or "")) // 4 + 4 for message in body.get("messages", []))
+    completion = body.get("max_completion_tokens") or body.get("max_tokens") or completion_estimate
+    return prompt + completion
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Seconds until amount is available - the level can be negative after a request used more than estimated
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+''' Client side rate limiting of OpenAI requests. Every request through the LLM gateway's HTTP client waits in
+    acquire() until the requests per minute and tokens per minute buckets have room. Waiting requests are served
+    by priority (interactive socket turns before REST and batch chats), then fair share - the user who has used
+    the fewest tokens recently goes first - then in arrival order. A 429 from OpenAI pauses all requests for the
+    retry-after time rather than letting every caller retry at once.
+'''
+class RequestScheduler:
+
+    def __init__(self, rpm=500, tpm=30000, max_wait=120, completion_estimate=500, fair_share_window=60):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # Seconds a request waits before it is let through anyway - None waits as long as it takes
+        self.max_wait = max_wait
+        self.completion_estimate = completion_estimate
+        self.fair_share_window = fair_share_window
+        self._condition = threading.Condition()
+        # Waiting requests as [priority, sequence, user, tokens]
+        self._waiting = []
+        self._sequence = 0
+        # user -> deque of (time, tokens) granted within the fair share window
+        self._usage = {}
+        # OpenAI asked us to slow down - nothing is sent before this time
+        self._paused_until = 0.0
+        self.granted = 0
+        self.timeouts = 0
+        self.throttled = 0
+        self._wait_times = deque(maxlen=1000)
+
+    def acquire(self, tokens, user="anonymous", priority=DEFAULT):
+        # Blocks until the request can be sent - returns the seconds waited
+        tokens = min(tokens, self.tokens.capacity)
+        started = time.monotonic()
+        with self._condition:
+            self._sequence += 1
+            entry = [priority, self._sequence, user, tokens]
+            self._waiting.append(entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = max(self._paused_until - now, 0.0)
+                    if self._next() is entry:
+                        wait = max(wait, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if wait <= 0:
+                            break
+                    elif wait <= 0:
+                        # Another request is first - woken when it is granted
+                        wait = 1.0
+                    if self.max_wait is not None:
+                        left = self.max_wait - (now - started)
+                        if left <= 0:
+                            # Let the request through rather than hold it forever - OpenAI may still accept it
+                            self.timeouts += 1
+                            print(f"LLM request for {user} waited {self.max_wait}s for the rate limit - sending anyway")
+                            break
+                        # Waits out max_wait even when the bucket or a 429 would hold the request longer
+                        wait = min(wait, left)
+                    self._condition.wait(timeout=wait)
+            finally:
+                self._waiting.remove(entry)
+            self.requests.level -= 1
+            self.tokens.level -= tokens
+            self._usage.setdefault(user, deque()).append((time.monotonic(), tokens))
+            self.granted += 1
+            waited = time.monotonic() - started
+            self._wait_times.append(waited)
+            self._condition.notify_all()
+        return waited
+
+    def adjust(self, estimated, actual):
+        # Corrects the token bucket once the response says how many tokens the request really used
+        with self._condition:
+            self.tokens.level -= actual - estimated
+            if actual < estimated:
+                self._condition.notify_all()
+
+    def pause(self, seconds):
+        # Called on a 429 - holds every request until OpenAI's limit has reset
+        with self._condition:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._condition:
+            waits = sorted(self._wait_times)
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for entry in self._waiting:
+                depth[PRIORITY_NAMES.get(entry[0], str(entry[0]))] += 1
+            return {
+                "queue_depth": len(self._waiting),
+                "queue_depth_by_priority": depth,
+                "granted": self.granted,
+                "throttled_429": self.throttled,
+                "wait_timeouts": self.timeouts,
+                "average_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "p95_wait_ms": round(waits[int(len(waits) * 0.95) - 1] * 1000, 1) if waits else 0.0,
+                "max_wait_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+                "requests_available": round(self.requests.level, 1),
+                "tokens_available": round(self.tokens.level),
+            }
+
+    # httpx event hooks installed on the LLM gateway's client
+
+    def before_request(self, request):
+        tokens = 0
+        try:
+            body = json.loads(request.content or b"{}")
+            if isinstance(body, dict):
+                tokens = estimate_request_tokens(body, self.completion_estimate)
+        except Exception:
+            # Not a JSON request - counted against the requests per minute only
+            pass
+        user, priority = current_requester()
+        with tracer.span("llm.rate_limit_wait", **{"llm.estimated_tokens": tokens, "llm.priority": PRIORITY_NAMES.get(priority, priority)}):
+            self.acquire(tokens, user, priority)
+        # Kept with the request so the response hook can correct the estimate
+        request.extensions["llm_scheduler_tokens"] = tokens
+
+    def after_response(self, response):
+        if response.status_code == 429:
+            self.pause(_retry_after(response.headers))
+            return
+        estimated = response.request.extensions.get("llm_scheduler_tokens")
+        # Streamed responses are not read here - their estimate stands
+        if estimated is None or "json" not in response.headers.get("content-type", ""):
+            return
+        try:
+            response.read()
+            usage = response.json().get("usage") or {}
+        except Exception:
+            return
+        if usage.get("total_tokens"):
+            self.adjust(estimated, usage["total_tokens"])
+
+    def _next(self):
+        # The waiting request to serve next - caller holds the lock
+        cutoff = time.monotonic() - self.fair_share_window
+        for usage in self._usage.values():
+            while usage and usage[0][0] < cutoff:
+                usage.popleft()
+        return min(self._waiting, key=lambda entry: (entry[0], sum(tokens for _, tokens in self._usage.get(entry[2], ())), entry[1]))
+
+
+#Seconds to wait after a 429 - from the retry-after header, or OpenAI's reset headers such as "6m0s" or "1.5s"
+def _retry_after(headers):
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    reset = headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset-tokens")
+    if reset:
+        seconds = 0.0
+        for number, unit in _DURATION.findall(reset):
+            seconds += float(number) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+        if seconds:
+            return seconds
+    return 1.0
+
@@ -0,0 +1,345 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from psycopg2.extras import execute_values
+from db_connection import database_connection
+from llm_scheduler import current_requester, estimate_request_tokens
+from config import LLM_USAGE_ENABLED, LLM_USAGE_FLUSH_INTERVAL, LLM_USAGE_BATCH_SIZE, LLM_PRICES
+
+# The HTTP library the openai package is built on - httpx, or httpx2 in newer openai releases
+try:
+    import httpx
+except ImportError:
+    import httpx2 as httpx
+
+# Session, team and agent the LLM calls made here belong to - the user comes from the scheduler's requester
+_usage_scope = ContextVar("llm_usage_scope", default={})
+
+
+#Attributes the LLM calls made inside the block to a session, team or agent - nested blocks override fields
+@contextmanager
+def usage_scope(**fields):
+    token = _usage_scope.set({**_usage_scope.get(), **{key: str(value) for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _usage_scope.reset(token)
+
+
+#Makes every reply the agent generates count against agent_id (its agentdata id, or a name for built in agents)
+#A group chat manager's speaker selection calls run inside its own reply so are counted against the manager
+def track_agent(agent, agent_id):
+    if getattr(agent, "_usage_agent_id", None) is not None:
+        return agent
+    generate_reply = agent.generate_reply
+
+    @wraps(generate_reply)
+    def tracked_generate_reply(*args, **kwargs):
+        with usage_scope(agent=agent_id):
+            return generate_reply(*args, **kwargs)
+
+    agent.generate_reply = tracked_generate_reply
+    agent._usage_agent_id = agent_id
+    return agent
+
+
+#USD cost of a call - the longest matching model name prefix is used, so dated model versions share a price
+def call_cost(model, prompt_tokens, completion_tokens, prices=LLM_PRICES):
+    matches = [name for name in prices if model.startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = prices[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000000
+
+
+''' Reads a streamed completion as it is passed on to the openai client. The usage chunk sent last when the
+    request has stream_options.include_usage is kept, otherwise the completion tokens are estimated from the
+    streamed text. on_done is called once, when the stream ends or is closed.
+'''
+class _StreamUsage:
+
+    def __init__(self, on_done):
+        self.on_done = on_done
+        self.usage = None
+        self.model = None
+        self.characters = 0
+        self._buffer = b""
+        self._done = False
+
+    def scan(self, data):
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(b"data:") or line == b"data: [DONE]":
+                continue
+            try:
+                chunk = json.loads(line[5:])
+            except ValueError:
+                continue
+            self.model = chunk.get("model") or self.model
+            if chunk.get("usage"):
+                self.usage = chunk["usage"]
+            for choice in chunk.get("choices") or []:
+                self.characters += len((choice.get("delta") or {}).get("content") or "")
+
+    def finish(self):
+        if not self._done:
+            self._done = True
+            self.on_done(self)
+
+
+class _SyncUsageStream(httpx.SyncByteStream):
+
+    def __init__(self, stream, usage):
+        self._stream = stream
+        self._usage = usage
+
+    def __iter__(self):
+        for data in self._stream:
+            self._usage.scan(data)
+            yield data
+        self._usage.finish()
+
+    def close(self):
+        self._stream.close()
+        self._usage.finish()
+
+
+class _AsyncUsageStream(httpx.AsyncByteStream):
+
+    def __init__(self, stream, usage):
+        self._stream = stream
+        self._usage = usage
+
+    async def __aiter__(self):
+        async for data in self._stream:
+            self._usage.scan(data)
+            yield data
+        self._usage.finish()
+
+    async def aclose(self):
+        await self._stream.aclose()
+        self._usage.finish()
+
+
+''' Token and cost accounting for LLM calls. The LLM gateway's HTTP client reports every chat completion it
+    sends (see the hooks below) with the user from the scheduler's requester and the session, team and agent
+    from usage_scope. Calls are totalled in memory per (user, session, team, agent, model) and each total is
+    written to llmusage as one row every flush_interval seconds, or sooner once batch_size totals are waiting.
+    Responses served from the response cache never reach the gateway so cost nothing here.
+'''
+class UsageRecorder:
+
+    def __init__(self, flush_interval=30.0, batch_size=200, prices=LLM_PRICES, max_pending=10000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.prices = prices
+        self.max_pending = max_pending
+        # (user, session, team, agent, model) -> [calls, prompt, completion, cost, latency ms, estimated calls]
+        self._pending = {}
+        self._period_start = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._stop_flusher = threading.Event()
+        # Totals since the process started - reported by /usage_stats without a database query
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.written = 0
+        self.failures = 0
+        self.dropped = 0
+
+    #User, session, team and agent the calls made here are counted against
+    def attribution(self):
+        user, _ = current_requester()
+        scope = _usage_scope.get()
+        return user, scope.get("session"), scope.get("team"), scope.get("agent", "unknown")
+
+    #attribution is taken from the current context unless given - a stream can end outside the call's scope
+    def record(self, model, prompt_tokens, completion_tokens, latency_ms, estimated=False, attribution=None):
+        key = (*(attribution or self.attribution()), model)
+        cost = call_cost(model, prompt_tokens, completion_tokens, self.prices)
+        with self._lock:
+            if self._period_start is None:
+                self._period_start = datetime.now()
+            totals = self._pending.setdefault(key, [0, 0, 0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+            totals[3] += cost
+            totals[4] += int(latency_ms)
+            totals[5] += 1 if estimated else 0
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+            full = len(self._pending) >= self.batch_size
+        self._start_flusher()
+        if full:
+            self.flush()
+
+    def flush(self):
+        # Writes the totals gathered since the last flush - returns the number of rows written
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                period_start, self._period_start = self._period_start, None
+            if not pending:
+                return 0
+            rows = [(period_start, *key, *totals) for key, totals in pending.items()]
+            try:
+                with database_connection() as conn:
+                    cursor = conn.cursor()
+                    execute_values(
+                        cursor,
+                        "INSERT INTO llmusage (periodstart, useremail, sessionid, teamkey, agentid, model, calls, "
+                        "prompttokens, completiontokens, costusd, latencyms, estimatedcalls) VALUES %s",
+                        rows,
+                    )
+                    conn.commit()
+                    cursor.close()
+            except Exception as e:
+                print(f"Error writing LLM usage: {str(e)}")
+                with self._lock:
+                    # Add the totals back for the next flush
+                    self.failures += 1
+                    for key, totals in pending.items():
+                        current = self._pending.setdefault(key, [0, 0, 0, 0.0, 0, 0])
+                        for i, value in enumerate(totals):
+                            current[i] += value
+                    if self._period_start is None or (period_start and period_start < self._period_start):
+                        self._period_start = period_start
+                    while len(self._pending) > self.max_pending:
+                        self._pending.pop(next(iter(self._pending)))
+                        self.dropped += 1
+                return 0
+            with self._lock:
+                self.written += len(rows)
+            return len(rows)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cost_usd": round(self.cost, 6),
+                "pending_rows": len(self._pending),
+                "written_rows": self.written,
+                "failures": self.failures,
+                "dropped": self.dropped,
+            }
+
+    def close(self):
+        self._stop_flusher.set()
+        self.flush()
+
+    # httpx event hooks installed on the LLM gateway's client
+
+    def before_request(self, request):
+        request.extensions["llm_usage_started"] = time.monotonic()
+
+    def after_response(self, response):
+        request = response.request
+        started = request.extensions.get("llm_usage_started")
+        if started is None or response.status_code >= 400 or not request.url.path.endswith("/completions"):
+            return
+        try:
+            body = json.loads(request.content or b"{}")
+        except ValueError:
+            body = {}
+        model = body.get("model") or "unknown"
+        if "json" in response.headers.get("content-type", ""):
+            try:
+                response.read()
+                data = response.json()
+            except Exception:
+                return
+            usage = data.get("usage") or {}
+            latency_ms = (time.monotonic() - started) * 1000
+            self.record(data.get("model") or model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), latency_ms)
+        else:
+            # Streamed replies report their usage in the last chunk when the request asks for it
+            # (STREAMING_LLM_CONFIG does) - it is recorded once the openai client has read the whole stream
+            attribution = self.attribution()
+
+            def stream_done(stream):
+                latency_ms = (time.monotonic() - started) * 1000
+                if stream.usage:
+                    self.record(stream.model or model, stream.usage.get("prompt_tokens", 0),
+                                stream.usage.get("completion_tokens", 0), latency_ms, attribution=attribution)
+                else:
+                    # Without it the prompt is estimated from the request and the completion from the text streamed
+                    self.record(model, estimate_request_tokens(body, 0), stream.characters // 4, latency_ms,
+                                estimated=True, attribution=attribution)
+
+            usage = _StreamUsage(stream_done)
+            if isinstance(response.stream, httpx.AsyncByteStream):
+                response.stream = _AsyncUsageStream(response.stream, usage)
+            else:
+                response.stream = _SyncUsageStream(response.stream, usage)
+
+    def _start_flusher(self):
+        if self._flusher is not None or not self.flush_interval:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_forever, name="llm_usage_flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_forever(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            self.flush()
+
+
+#Per user and per agent totals from llmusage - optionally for one user and from a start time
+def usage_rollups(email=None, since=None):
+    conditions, params = [], []
+    if email:
+        conditions.append("useremail = %s")
+        params.append(email)
+    if since:
+        conditions.append("periodstart >= %s")
+        params.append(since)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    columns = ("SUM(calls), SUM(prompttokens), SUM(completiontokens), SUM(costusd), "
+               "SUM(latencyms) / GREATEST(SUM(calls), 1), SUM(estimatedcalls)")
+    rollups = {}
+    with database_connection() as conn:
+        cursor = conn.cursor()
+        for name, group in (("users", "useremail"), ("agents", "agentid"), ("teams", "teamkey")):
+            cursor.execute(
+                f"SELECT {group}, {columns} FROM llmusage {where}GROUP BY {group} ORDER BY SUM(costusd) DESC",
+                params
+            )
+            rollups[name] = [
+                {
+                    "id": row[0],
+                    "calls": int(row[1]),
+                    "prompt_tokens": int(row[2]),
+                    "completion_tokens": int(row[3]),
+                    "cost_usd": float(row[4]),
+                    "average_latency_ms": int(row[5]),
+                    "estimated_calls": int(row[6]),
+                }
+                for row in cursor.fetchall()
+                # Calls outside a team chat have no team
+                if row[0] is not None
+            ]
+        cursor.close()
+    return rollups
+
+
+# Process wide recorder installed on the LLM gateway - None when accounting is turned off
+usage_recorder = UsageRecorder(
+    flush_interval=LLM_USAGE_FLUSH_INTERVAL,
+    batch_size=LLM_USAGE_BATCH_SIZE,
+) if LLM_USAGE_ENABLED else None
@@ -0,0 +1,188 @@
+import json
+import threading
+import time
+from psycopg2.extras import execute_values
+from db_connection import database_connection
+from chat_storage import compress_chunk, decompress_chunk
+from config import (
+    MESSAGE_LOG_ENABLED, MESSAGE_LOG_BATCH_SIZE, MESSAGE_LOG_FLUSH_INTERVAL, MESSAGE_LOG_MAX_PENDING,
+    MESSAGE_LOG_RETENTION_DAYS,
+)
+
+# Seconds between deletes of messages past the retention period
+EXPIRE_INTERVAL = 3600
+
+
+''' Write behind log of websocket conversations. Each message is given the next index of its conversation and
+    buffered, then the buffer is written to sessionmessages in one insert once batch_size messages are waiting,
+    every flush_interval seconds, or when a conversation ends. A client that reconnects sends the index of the
+    last message it saw and the conversation is rebuilt from the log (see resume_session in socket_handlers).
+    Messages carry the email of the user who sent the conversation's messages, for /purge_users, and are deleted
+    once they are older than retention_days.
+'''
+class MessageLog:
+
+    def __init__(self, batch_size=20, flush_interval=2.0, max_pending=10000, retention_days=7):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Messages kept while the database can not be written - the oldest are dropped past this
+        self.max_pending = max_pending
+        # None or 0 to keep messages
+        self.retention_days = retention_days
+        # (conversation id, index, sender, compressed message, user email) waiting to be written
+        self._pending = []
+        # conversation id -> index of its next message
+        self._next_index = {}
+        # conversation id -> email of its user, when the client sent one
+        self._owners = {}
+        self._last_expired = time.monotonic()
+        self._lock = threading.Lock()
+        # Only one flush writes at a time so messages are inserted in order
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._stop_flusher = threading.Event()
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.expired = 0
+
+    #Records the user a conversation's messages belong to - messages appended after this carry the email
+    def set_owner(self, conversation_id, email):
+        if email:
+            with self._lock:
+                self._owners[conversation_id] = email
+
+    def append(self, conversation_id, sender, message):
+        # Returns the index given to the message - sent to the client so it knows where to resume from
+        data = compress_chunk(json.dumps(message, default=str))
+        with self._lock:
+            index = self._next_index.get(conversation_id, 0)
+            self._next_index[conversation_id] = index + 1
+            self._pending.append((conversation_id, index, sender, data, self._owners.get(conversation_id)))
+            full = len(self._pending) >= self.batch_size
+        self._start_flusher()
+        if full:
+            self.flush()
+        return index
+
+    def flush(self):
+        # Writes every buffered message - returns the number written
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            try:
+                with database_connection() as conn:
+                    cursor = conn.cursor()
+                    # Messages already written by an earlier flush that failed part way are skipped
+                    execute_values(
+                        cursor,
+                        "INSERT INTO sessionmessages (sessionid, messageindex, sender, content, useremail) VALUES %s "
+                        "ON CONFLICT (sessionid, messageindex) DO NOTHING",
+                        rows,
+                    )
+                    conn.commit()
+                    cursor.close()
+            except Exception as e:
+                print(f"Error writing conversation messages: {str(e)}")
+                with self._lock:
+                    # Keep the messages for the next flush
+                    self._pending = rows + self._pending
+                    self.failures += 1
+                    overflow = len(self._pending) - self.max_pending
+                    if overflow > 0:
+                        del self._pending[:overflow]
+                        self.dropped += overflow
+                return 0
+            with self._lock:
+                self.written += len(rows)
+                self.flushes += 1
+            return len(rows)
+
+    def load(self, conversation_id):
+        # Every logged message of a conversation as (index, sender, message) in order
+        self.flush()
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT messageindex, sender, content FROM sessionmessages WHERE sessionid = %s ORDER BY messageindex",
+                (conversation_id,)
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+        messages = [(index, sender, json.loads(decompress_chunk(content))) for index, sender, content in rows]
+        with self._lock:
+            # Continue numbering after the logged messages when the conversation is resumed
+            if messages:
+                self._next_index[conversation_id] = max(self._next_index.get(conversation_id, 0), messages[-1][0] + 1)
+        return messages
+
+    def end(self, conversation_id):
+        # Called when the client disconnects - writes its messages and forgets its index counter and owner
+        self.flush()
+        with self._lock:
+            self._next_index.pop(conversation_id, None)
+            self._owners.pop(conversation_id, None)
+
+    def expire(self):
+        # Deletes messages older than the retention period - returns the number deleted
+        if not self.retention_days:
+            return 0
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM sessionmessages WHERE createdat < NOW() - make_interval(days => %s)",
+                (self.retention_days,)
+            )
+            deleted = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        with self._lock:
+            self.expired += deleted
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "conversations": len(self._next_index),
+                "written": self.written,
+                "flushes": self.flushes,
+                "failures": self.failures,
+                "dropped": self.dropped,
+                "expired": self.expired,
+            }
+
+    def close(self):
+        self._stop_flusher.set()
+        self.flush()
+
+    def _start_flusher(self):
+        if self._flusher is not None or not self.flush_interval:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_forever, name="message_log_flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_forever(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() - self._last_expired >= EXPIRE_INTERVAL:
+                self._last_expired = time.monotonic()
+                try:
+                    self.expire()
+                except Exception as e:
+                    print(f"Error deleting expired conversation messages: {str(e)}")
+
+
+# Process wide message log used by the socket handlers - None when logging is turned off
+message_log = MessageLog(
+    batch_size=MESSAGE_LOG_BATCH_SIZE,
+    flush_interval=MESSAGE_LOG_FLUSH_INTERVAL,
+    max_pending=MESSAGE_LOG_MAX_PENDING,
+    retention_days=MESSAGE_LOG_RETENTION_DAYS,
+) if MESSAGE_LOG_ENABLED else None
@@ -0,0 +1,110 @@
+from db_connection import connect_to_database
+
+''' Schema changes applied to the PostgreSQL database, in order. Each one is recorded in schema_migrations
+    once it has run, so running this file again only applies new ones:
+
+        python migrations.py
+
+    Indexes are built CONCURRENTLY so the tables stay writable while they are created, which means
+    each statement runs outside a transaction.
+'''
+MIGRATIONS = [
+    ("001_agentteams_teamid", [
+        # Key used to page through a users teams - existing rows are numbered when the column is added
+        "ALTER TABLE agentteams ADD COLUMN IF NOT EXISTS teamid INTEGER GENERATED BY DEFAULT AS IDENTITY",
+    ]),
+    ("002_list_pagination_indexes", [
+        # Keyset pagination and counts for /gather_previous_chat_names and /count_previous_chats
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS chattable_useremail_chatid_idx ON chattable (useremail, chatid)",
+        # Keyset pagination and counts for /gather_teams and /count_teams
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS agentteams_useremail_teamid_idx ON agentteams (useremail, teamid)",
+    ]),
+    ("003_chatchunks", [
+        # Compressed messages of saved chats - see chat_storage.py
+        "CREATE TABLE IF NOT EXISTS chatchunks ("
+        "chatid INTEGER NOT NULL REFERENCES chattable (chatid) ON DELETE CASCADE, "
+        "chunkindex INTEGER NOT NULL, "
+        "chunkcontent BYTEA NOT NULL, "
+        "PRIMARY KEY (chatid, chunkindex))",
+    ]),
+    ("004_sessionmessages", [
+        # Websocket conversations written as they happen - see message_log.py
+        "CREATE TABLE IF NOT EXISTS sessionmessages ("
+        "sessionid TEXT NOT NULL, "
+        "messageindex INTEGER NOT NULL, "
+        "sender TEXT, "
+        "content BYTEA NOT NULL, "
+        "createdat TIMESTAMP DEFAULT NOW(), "
+        "PRIMARY KEY (sessionid, messageindex))",
+    ]),
+    ("005_chat_search", [
+        # Full text search over saved chats - written by /store_chat from the chat text, see chat_search.py
+        "ALTER TABLE chattable ADD COLUMN IF NOT EXISTS searchvector tsvector",
+        # Chats saved before compression still hold their text, so their search vector is built here
+        "UPDATE chattable SET searchvector = "
+        "setweight(to_tsvector('english', coalesce(chatname, '')), 'A') || "
+        "setweight(to_tsvector('english', left(regexp_replace(chatcontent, '<[^>]*>', ' ', 'g'), 200000)), 'B') "
+        "WHERE searchvector IS NULL AND chatcontent NOT LIKE 'chatchunks:v1:%'",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS chattable_searchvector_idx ON chattable USING GIN (searchvector)",
+    ]),
+    ("006_team_speaker_selection", [
+        # Per team speaker selection rules - see speaker_selection.py
+        "ALTER TABLE agentteams ADD COLUMN IF NOT EXISTS speakerselection JSONB",
+    ]),
+    ("007_llmusage", [
+        # Token use and cost of LLM calls, aggregated per flush - see llm_usage.py
+        "CREATE TABLE IF NOT EXISTS llmusage ("
+        "usageid BIGSERIAL PRIMARY KEY, "
+        "periodstart TIMESTAMP NOT NULL, "
+        "useremail TEXT NOT NULL, "
+        "sessionid TEXT, "
+        "teamkey TEXT, "
+        "agentid TEXT NOT NULL, "
+        "model TEXT NOT NULL, "
+        "calls INTEGER NOT NULL, "
+        "prompttokens BIGINT NOT NULL, "
+        "completiontokens BIGINT NOT NULL, "
+        "costusd NUMERIC(14, 6) NOT NULL, "
+        "latencyms BIGINT NOT NULL, "
+        "estimatedcalls INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS llmusage_user_period_idx ON llmusage (useremail, periodstart)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS llmusage_agent_period_idx ON llmusage (agentid, periodstart)",
+    ]),
+    ("008_sessionmessages_retention", [
+        # Owner of a logged conversation, so /purge_users can remove it, and the age used to expire it
+        "ALTER TABLE sessionmessages ADD COLUMN IF NOT EXISTS useremail TEXT",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS sessionmessages_useremail_idx ON sessionmessages (useremail)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS sessionmessages_createdat_idx ON sessionmessages (createdat)",
+    ]),
+]
+
+
+def run_migrations(conn, migrations=MIGRATIONS):
+    # Returns the names of the migrations applied
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, appliedat TIMESTAMP DEFAULT NOW())")
+    cursor.execute("SELECT name FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+
+    newly_applied = []
+    for name, statements in migrations:
+        if name in applied:
+            continue
+        print(f"Applying migration {name}")
+        # Statements are safe to repeat, so a migration interrupted part way can simply be run again
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+        newly_applied.append(name)
+    cursor.close()
+    return newly_applied
+
+
+if __name__ == '__main__':
+    conn = connect_to_database()
+    try:
+        applied = run_migrations(conn)
+        print(f"Applied {len(applied)} migrations" if applied else "Database schema is up to date")
+    finally:
+        conn.close()
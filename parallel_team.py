@@ -0,0 +1,49 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import TEAM_PARALLEL_MAX_WORKERS
+
+''' Parallel team mode. Instead of a group chat, where the agents speak one at a time with a manager call in
+    between to pick the next speaker, every agent of the team answers the question at the same time and a
+    synthesis agent combines the answers - two rounds of LLM calls however many agents the team has.
+'''
+
+# Shared by all parallel team chats - each chat submits one task per agent
+_executor = ThreadPoolExecutor(max_workers=TEAM_PARALLEL_MAX_WORKERS, thread_name_prefix="team_parallel")
+
+
+#Text of a reply from generate_reply - replies can be a string or a message dict
+def reply_text(reply):
+    if isinstance(reply, dict):
+        return reply.get("content") or ""
+    return reply or ""
+
+
+#Asks each agent the question at the same time - returns (agent name, answer) in the order of the agents
+#Agents that fail are left out so one failing agent does not lose the others' answers
+def answer_in_parallel(agents, question, sender, cache=None):
+    def answer(agent):
+        # Repeated deterministic requests are answered from the response cache
+        if cache is not None:
+            agent.client_cache = cache
+        # The question is passed as the whole history so the agent's own chat history is left untouched
+        return reply_text(agent.generate_reply(messages=[{"role": "user", "content": question}], sender=sender))
+
+    # Each task runs in a copy of the caller's context so its LLM requests are scheduled for the same user
+    futures = [(agent.name, _executor.submit(contextvars.copy_context().run, answer, agent)) for agent in agents]
+    answers = []
+    for name, future in futures:
+        try:
+            answers.append((name, future.result()))
+        except Exception as e:
+            print(f"Error getting answer from {name}: {str(e)}")
+    if not answers:
+        raise RuntimeError("No team agent answered the question")
+    return answers
+
+
+#Combines the team's answers into one with a single call to the synthesis agent
+def synthesise(synthesiser, question, answers, sender, cache=None):
+    if cache is not None:
+        synthesiser.client_cache = cache
+    prompt = f"Question:\n{question}\n\n" + "\n\n".join(f"Answer from {name}:\n{answer}" for name, answer in answers)
+    return reply_text(synthesiser.generate_reply(messages=[{"role": "user", "content": prompt}], sender=sender))
@@ -0,0 +1,202 @@
+import gc
+import importlib
+import json
+import os
+import resource
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+import traceback
+
+''' Code executor worker - runs in its own process started by code_executor.ExecutorPool. Common modules are
+    imported once when the worker starts, then each code block runs in a child forked from the warm worker, so a
+    block starts without paying interpreter startup or those imports again. The child gets CPU and memory rlimits
+    and is killed with its process group when the wall clock timeout passes. Standard library only - the worker
+    is started as its own interpreter (python sandbox_worker.py <socket fd> <modules>) and never imports the app.
+    Messages on the socket are length prefixed JSON - nothing received from the worker is unpickled by the app.
+'''
+
+# Output kept per code block - the rest is read and dropped
+MAX_OUTPUT_BYTES = 1024 * 1024
+# Environment variables with these in their name are not passed to generated code
+HIDDEN_ENV = ("KEY", "PASSWORD", "SECRET", "TOKEN")
+# Programs shell code blocks are run with
+SHELLS = {"bash": "bash", "sh": "sh", "shell": "sh"}
+# Largest message read from the socket - a code block's output is capped well below it
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+#Sends a JSON message prefixed with its length
+def send_message(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(data)) + data)
+
+
+#Reads the next message - EOFError when the other end has closed the socket
+def recv_message(sock):
+    size, = struct.unpack(">I", _recv_exactly(sock, 4))
+    if size > MAX_MESSAGE_BYTES:
+        raise OSError(f"message of {size} bytes is too large")
+    return json.loads(_recv_exactly(sock, size).decode("utf-8"))
+
+
+def _recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("socket closed")
+        data += chunk
+    return data
+
+
+#Entry point of a worker process - answers tasks sent over sock until it receives None
+def worker_main(sock, preload=()):
+    for name in list(os.environ):
+        if any(hidden in name.upper() for hidden in HIDDEN_ENV):
+            del os.environ[name]
+    # Plots are saved to files - there is no display
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    loaded = []
+    for module in preload:
+        try:
+            importlib.import_module(module)
+            loaded.append(module)
+        except Exception:
+            pass
+    send_message(sock, {"ready": loaded})
+    while True:
+        try:
+            task = recv_message(sock)
+        except (EOFError, OSError, ValueError):
+            return
+        if task is None:
+            return
+        send_message(sock, run_task(**task))
+
+
+#Runs one code file in a forked child and collects its output
+def run_task(path, language, work_dir, timeout, cpu_seconds=None, memory_mb=None, max_file_bytes=None):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        _run_child(path, language, work_dir, write_fd, cpu_seconds, memory_mb, max_file_bytes)
+    os.close(write_fd)
+
+    chunks, size, truncated, timed_out = [], 0, False, False
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            ready, _, _ = select.select([read_fd], [], [], remaining)
+            if not ready:
+                continue
+            data = os.read(read_fd, 65536)
+            if not data:
+                break
+            if size < MAX_OUTPUT_BYTES:
+                chunks.append(data[:MAX_OUTPUT_BYTES - size])
+            else:
+                truncated = True
+            size += len(data)
+    finally:
+        os.close(read_fd)
+        # Also ends anything the code left running in the background
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        _, status = os.waitpid(pid, 0)
+
+    output = b"".join(chunks).decode("utf-8", "replace")
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code == -signal.SIGXCPU:
+        output += "\nCPU time limit exceeded"
+    return {"exit_code": exit_code, "output": output, "timed_out": timed_out, "truncated": truncated}
+
+
+#Runs in the forked child - never returns
+def _run_child(path, language, work_dir, write_fd, cpu_seconds, memory_mb, max_file_bytes):
+    exit_code = 1
+    try:
+        # Own process group so the code and anything it starts can be killed together
+        os.setsid()
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds) + 1))
+        if memory_mb:
+            # On top of what the warm worker already has mapped
+            limit = _address_space() + int(memory_mb) * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        if max_file_bytes is not None:
+            # Writing past the limit fails with "File too large" - python ignores SIGXFSZ
+            resource.setrlimit(resource.RLIMIT_FSIZE, (max_file_bytes, max_file_bytes))
+        os.chdir(work_dir)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(devnull)
+        os.close(write_fd)
+        # Nothing but stdin, stdout and stderr is left to the code - above all not the worker's socket to the app
+        os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+        if language in SHELLS:
+            os.execvp(SHELLS[language], [SHELLS[language], path])
+        exit_code = _run_python(path)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+#Runs a python file as __main__ the way the python command would and returns its exit code
+def _run_python(path):
+    sys.argv = [path]
+    sys.path.insert(0, os.path.dirname(path))
+    namespace = {"__name__": "__main__", "__file__": path, "__builtins__": __builtins__}
+    try:
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        exec(compile(source, path, "exec"), namespace)
+        exit_code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            exit_code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        sys.stdout.flush()
+        error_type, error, tb = sys.exc_info()
+        # Leave out this function's frame so the traceback starts in the code file
+        traceback.print_exception(error_type, error, tb.tb_next)
+        exit_code = 1
+    # Files the code left open are flushed and closed as they would be when the interpreter exits
+    namespace.clear()
+    gc.collect()
+    return exit_code
+
+
+#Bytes of address space the process has mapped, 0 if it cannot be read
+def _address_space():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+if __name__ == "__main__":
+    worker_main(socket.socket(fileno=int(sys.argv[1])), sys.argv[2:])
@@ -0,0 +1,61 @@
+import os
+import sys
+import dotenv
+
+''' Production entry point - python serve.py. SERVER_ASYNC_MODE picks the worker model:
+        threading - one OS thread per request and websocket event on werkzeug's development server, as app.py.
+                    Refused unless SERVER_ALLOW_DEV_SERVER=true, as werkzeug is not made for production traffic
+        eventlet / gevent - green threads, so one process holds thousands of idle websockets and hundreds of
+                            conversations waiting on OpenAI (pip install gevent gevent-websocket, or eventlet)
+    The standard library is monkey patched before the app's modules are imported, so the locks, queues and
+    sockets they create at import are the cooperative ones.
+'''
+
+dotenv.load_dotenv()
+
+
+def monkey_patch(mode):
+    if mode == "gevent":
+        from gevent import monkey
+        # Not aggressive - httpcore imports trio, which needs select.epoll to stay in place
+        monkey.patch_all(aggressive=False)
+    elif mode == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode != "threading":
+        raise SystemExit(f"Unknown SERVER_ASYNC_MODE {mode} - use threading, eventlet or gevent")
+
+
+#Threading mode runs werkzeug's development server - stop unless it was asked for, and say so when it was
+#Returns whether socket_io.run has to be allowed to start werkzeug
+def check_dev_server(mode, allowed):
+    if mode != "threading":
+        return False
+    if not allowed:
+        raise SystemExit("SERVER_ASYNC_MODE=threading runs werkzeug's development server, which is not made for "
+                         "production - set SERVER_ASYNC_MODE=gevent or eventlet, or SERVER_ALLOW_DEV_SERVER=true "
+                         "to run it anyway")
+    print("WARNING: serving on werkzeug's development server (SERVER_ASYNC_MODE=threading) - do not use it for "
+          "production traffic, set SERVER_ASYNC_MODE=gevent or eventlet", file=sys.stderr, flush=True)
+    return True
+
+
+if __name__ == "__main__":
+    mode = os.getenv("SERVER_ASYNC_MODE", "threading").lower()
+    allow_dev_server = check_dev_server(mode, os.getenv("SERVER_ALLOW_DEV_SERVER", "false").lower() == "true")
+    monkey_patch(mode)
+
+    from async_runtime import cooperative_database, configure_offload
+    from config import SERVER_HOST, SERVER_PORT, OFFLOAD_THREADS
+    if mode != "threading":
+        cooperative_database()
+        configure_offload(OFFLOAD_THREADS)
+
+    from app import app, socket_io
+    from code_executor import executor_pool
+    if executor_pool is not None:
+        executor_pool.start()
+
+    print(f"Serving on http://{SERVER_HOST}:{SERVER_PORT} ({socket_io.async_mode})", flush=True)
+    socket_io.run(app, host=SERVER_HOST, port=SERVER_PORT, debug=False, use_reloader=False, log_output=False,
+                  allow_unsafe_werkzeug=allow_dev_server)
@@ -0,0 +1,215 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Optional dependency - only needed for the redis session backend
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+#Rough size of a session in bytes - the chat histories make up nearly all of the memory a session holds
+def estimate_session_size(session):
+    size = 0
+    for agent in session.values():
+        chat_messages = getattr(agent, "chat_messages", None)
+        if not isinstance(chat_messages, dict):
+            continue
+        for messages in chat_messages.values():
+            for message in messages:
+                content = message.get("content") if isinstance(message, dict) else message
+                size += len(str(content or "")) + 64
+    return size
+
+
+#Clears the agents of a session that has been closed or replaced
+def cleanup_session(session):
+    for agent in session.values():
+        reset = getattr(agent, "reset", None)
+        if callable(reset):
+            try:
+                reset()
+            except Exception as e:
+                print(f"Error cleaning up session agent: {str(e)}")
+
+
+''' Session state kept outside the worker process. Agents can not be serialised, so the backend holds the
+    conversation state (chat history and how the session was set up) and the agents are rebuilt from it.
+'''
+class RedisSessionBackend:
+
+    def __init__(self, url, ttl=3600, prefix="genaicolab:session:"):
+        if redis is None:
+            raise ImportError("Please install `redis` to use the redis session backend.")
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def save(self, session_id, state):
+        self._client.set(self.prefix + session_id, json.dumps(state), ex=self.ttl)
+
+    def load(self, session_id):
+        data = self._client.get(self.prefix + session_id)
+        return json.loads(data) if data else None
+
+    def delete(self, session_id):
+        self._client.delete(self.prefix + session_id)
+
+
+def create_session_backend(url, ttl=3600):
+    if not url:
+        return None
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisSessionBackend(url, ttl=ttl)
+    raise ValueError(f"Unsupported session backend: {url}")
+
+
+''' Bounded store for the websocket sessions' agents. Used like the dict it replaces (ACTIVE_SESSIONS[sid]),
+    but least recently used sessions are evicted once max_sessions or max_memory is reached, and a background
+    reaper removes sessions idle for longer than idle_ttl seconds.
+'''
+class SessionStore:
+
+    def __init__(self, max_sessions=500, idle_ttl=1800, max_memory=None, reaper_interval=60, backend=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # Total bytes of chat history held before sessions are evicted - None for no limit
+        self.max_memory = max_memory
+        self.reaper_interval = reaper_interval
+        # Optional out of process backend holding session state - see RedisSessionBackend
+        self.backend = backend
+
+        # session id -> [session, last used time, estimated size]
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self._reaper = None
+        self._stop_reaper = threading.Event()
+        self.evicted = 0
+        self.expired = 0
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def __getitem__(self, session_id):
+        with self._lock:
+            entry = self._sessions[session_id]
+            entry[1] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def __setitem__(self, session_id, session):
+        with self._lock:
+            # Replacing a session - clean up the agents of the old one
+            old = self._sessions.pop(session_id, None)
+            if old is not None and old[0] is not session:
+                cleanup_session(old[0])
+            self._sessions[session_id] = [session, time.monotonic(), estimate_session_size(session)]
+            self._enforce_limits()
+        self._start_reaper()
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            entry = self._sessions.pop(session_id)
+        cleanup_session(entry[0])
+        if self.backend is not None:
+            self.backend.delete(session_id)
+
+    def discard(self, session_id):
+        # Drop this worker's agents but keep the saved state - the conversation can carry on on another worker
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            cleanup_session(entry[0])
+
+    def get(self, session_id, default=None):
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def touch(self, session_id):
+        # Called after a message is handled - marks the session used and updates its size
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            entry[1] = time.monotonic()
+            entry[2] = estimate_session_size(entry[0])
+            self._sessions.move_to_end(session_id)
+            self._enforce_limits()
+
+    def save_state(self, session_id, state):
+        # Persist the serialisable state of a session so another worker can rebuild it
+        if self.backend is not None:
+            self.backend.save(session_id, state)
+
+    def load_state(self, session_id):
+        if self.backend is None:
+            return None
+        return self.backend.load(session_id)
+
+    def reap(self):
+        # Remove sessions idle for longer than idle_ttl
+        cutoff = time.monotonic() - self.idle_ttl
+        with self._lock:
+            expired = [session_id for session_id, entry in self._sessions.items() if entry[1] < cutoff]
+            # Dropping the last reference frees the agents - a reset here could clear a conversation still running
+            for session_id in expired:
+                del self._sessions[session_id]
+            self.expired += len(expired)
+        if expired:
+            print(f"Removed {len(expired)} idle sessions")
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "memory_bytes": sum(entry[2] for entry in self._sessions.values()),
+                "max_memory_bytes": self.max_memory,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "largest_sessions": sorted(
+                    ({"session_id": session_id, "bytes": entry[2], "idle_seconds": round(now - entry[1], 1)}
+                     for session_id, entry in self._sessions.items()),
+                    key=lambda session: session["bytes"], reverse=True)[:10],
+            }
+
+    def close(self):
+        self._stop_reaper.set()
+
+    def _enforce_limits(self):
+        # Evict least recently used sessions - caller holds the lock
+        while len(self._sessions) > self.max_sessions or self._over_memory():
+            if len(self._sessions) <= 1:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def _over_memory(self):
+        return self.max_memory is not None and sum(entry[2] for entry in self._sessions.values()) > self.max_memory
+
+    def _start_reaper(self):
+        if self._reaper is not None or not self.reaper_interval:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_forever, name="session_reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_forever(self):
+        while not self._stop_reaper.wait(self.reaper_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Error removing idle sessions: {str(e)}")
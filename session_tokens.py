@@ -0,0 +1,37 @@
+import hashlib
+import hmac
+import secrets
+from config import SESSION_TOKEN_SECRET
+
+''' Tokens that prove a client owns a websocket session. The server signs the session id when the socket connects
+    and the client sends the token back to reach the session's workspace (and, after a reconnect, its
+    conversation). Without SESSION_TOKEN_SECRET a random key is used, so tokens last as long as the process and
+    are only accepted by it - several nodes behind a message queue need the same secret.
+'''
+_secret = (SESSION_TOKEN_SECRET or secrets.token_hex(32)).encode("utf-8")
+
+
+def _sign(session_id):
+    return hmac.new(_secret, session_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def issue_token(session_id):
+    return f"{session_id}.{_sign(session_id)}"
+
+
+#Session id the token was issued for, None if the token is missing or was not signed by this server
+def verify_token(token):
+    if not isinstance(token, str) or "." not in token:
+        return None
+    session_id, signature = token.rsplit(".", 1)
+    if not session_id or not hmac.compare_digest(signature, _sign(session_id)):
+        return None
+    return session_id
+
+
+#Refuses a message queue without SESSION_TOKEN_SECRET - every node would sign with a random key of its own and
+#refuse the tokens the others issued. memory:// nodes run in one process and share its key
+def check_shared_secret(message_queue, secret=SESSION_TOKEN_SECRET):
+    if message_queue and not message_queue.startswith("memory://") and not secret:
+        raise ValueError("SOCKETIO_MESSAGE_QUEUE is set without SESSION_TOKEN_SECRET - set the same secret on every "
+                         "node so a session token issued by one node is accepted by the others")
@@ -1,10 +1,24 @@
 from flask import request
+from flask_socketio import join_room
 import autogen
-from agents import WebSocketUserProxy
-from config import LLM_CONFIG, ACTIVE_SESSIONS
-from db_connection import connect_to_database
-from utils import refactor_agent_name
-from agents import agent_one
+from autogen.io import IOStream
+from agents import WebSocketUserProxy, SocketIOStream
+from config import LLM_CONFIG, STREAMING_LLM_CONFIG, SOCKET_STREAMING, ACTIVE_SESSIONS
+from config import CONTEXT_WINDOW_MAX_TOKENS, CONTEXT_SUMMARISE, CONTEXT_SUMMARY_MAX_TOKENS
+from utils import refactor_agent_name, agent_llm_config
+from llm_cache import response_cache
+from context_window import ConversationWindow, make_llm_summariser
+from jobs import chat_jobs
+from agent_cache import agent_configs, team_cache
+from message_log import message_log
+from speaker_selection import team_speaker_selector
+from llm_scheduler import requester, INTERACTIVE
+from llm_usage import track_agent, usage_scope
+from code_executor import code_execution_config
+from workspaces import workspace_manager
+from session_tokens import issue_token, verify_token
+from async_runtime import conversation_limiter
+from tracing import tracer
 # Used to troublshoot websockets
 import traceback
 
@@ -15,37 +29,95 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
     def handle_connect():
         #Used for troubleshooting
         print(f"Client connected: {request.sid}")
-        socket_io.emit('connection_status', {'status': 'connected', 'session_id': request.sid}, room=request.sid) # Emit to the connecting client
+        # The token proves the client owns the session - sent with /workspace_snapshot, and with the socket events
+        # after a reconnect to carry on the conversation
+        socket_io.emit('connection_status', {'status': 'connected', 'session_id': request.sid,
+                                             'session_token': issue_token(request.sid)}, room=request.sid) # Emit to the connecting client
+
+    #Push chat job status changes to clients subscribed to the job - the room is the job id
+    def emit_chat_job_status(job):
+        socket_io.emit('chat_job_status', job.to_dict(), room=job.job_id)
+
+    chat_jobs.add_listener(emit_chat_job_status)
+
+    #Conversation each connected socket on this node is carrying on
+    socket_sessions = {}
+
+    #Conversation an event belongs to - the one named by the sessionToken the client was given when it first
+    #connected, otherwise the one the socket already carries on or the socket id. The socket joins a room named
+    #after it, so with a message queue the replies reach the client whichever node it is connected to and no sticky
+    #sessions are needed. None, after an error is sent, if the token was not signed by this server
+    def session_key(data):
+        token = data.get('sessionToken')
+        if token is not None:
+            session_id = verify_token(token)
+            if session_id is None:
+                socket_io.emit('error', {'error': 'Invalid session token'}, room=request.sid)
+                return None
+        else:
+            session_id = socket_sessions.get(request.sid) or request.sid
+        if session_id != request.sid and socket_sessions.get(request.sid) != session_id:
+            join_room(session_id)
+            socket_sessions[request.sid] = session_id
+        return session_id
+
+    #Subscribe to a chat job started with /chat or /chat_team in async mode
+    @socket_io.on('subscribe_chat_job')
+    def handle_subscribe_chat_job(data):
+        job = chat_jobs.get(data.get('jobId'))
+        if job is None:
+            socket_io.emit('error', {'error': 'Chat job not found'}, room=request.sid)
+            return
+        join_room(job.job_id)
+        # Send the current status straight away in case the job finished before subscribing
+        socket_io.emit('chat_job_status', job.to_dict(), room=request.sid)
 
     #Called when websocket is disconnected
     @socket_io.on('disconnect')
     def handle_disconnect():
          #Used for troubleshooting
          print(f"Client disconnected: {request.sid}")
+         session_id = socket_sessions.pop(request.sid, request.sid)
+         # Write the rest of the conversation to the message log so the client can resume it - team chats and
+         # sessions already evicted from the store log under the session too
+         if message_log is not None:
+            message_log.end(session_id)
          #check and ensure the request sid is removed from Active Session {}.
          #Had issues reconnecting to websocket when ititial connection is diconnected and then try reconnecting
-         if request.sid in ACTIVE_SESSIONS:
-            del ACTIVE_SESSIONS[request.sid]
-            print(f"Session {request.sid} removed from active sessions.")
+         session = ACTIVE_SESSIONS.get(session_id)
+         if session is not None:
+            # A conversation the client keeps its own id for can carry on on the node it reconnects to - keep its state
+            if session_id != request.sid:
+                ACTIVE_SESSIONS.discard(session_id)
+            else:
+                del ACTIVE_SESSIONS[session_id]
+            print(f"Session {session_id} removed from active sessions.")
+         # Files written by the session's code go with it - download them first with /workspace_snapshot
+         workspace_manager.release(session_id)
 
     def get_or_create_session_agents(session_id):
         #Retrieves or creates agents for given Socketio session id
-        if session_id not in ACTIVE_SESSIONS:
+        session = ACTIVE_SESSIONS.get(session_id)
+        state = ACTIVE_SESSIONS.load_state(session_id)
+        # Another node carried on the conversation since these agents were built - rebuild them from its state
+        if session is not None and state and state.get("version", 0) > session.get("version", 0):
+            print(f"Session {session_id} was continued on another node - rebuilding agents")
+            session = None
+        # A team chat session stored under the same id has no assistant - replace it
+        if session is None or "assistant" not in session:
             print(f"Creating new agents for session: {session_id}")
 
             # Create the WebSocketUserProxy instance
             user_proxy = WebSocketUserProxy(
                 session_id=session_id,
                 socketio_instance=socket_io,
+                message_log=message_log,
                 name="User_Proxy",
                 system_message="You are the user proxy. Relay messages clearly.",
                 
                 human_input_mode="NEVER",
                 # max_consecutive_auto_reply=1, # Often set low for turn-based
-                code_execution_config={
-                    "work_dir": "groupchat", 
-                    "use_docker": False,
-                },
+                code_execution_config=code_execution_config("groupchat"),
                 # Check if the message content ends with TERMINATE
                 is_termination_msg=lambda x: isinstance(x, dict) and x.get("content", "").rstrip().endswith("TERMINATE"),
             )
@@ -54,21 +126,48 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
             assistant = autogen.AssistantAgent(
                 name="MultiTalentAgent",
                 system_message="You are a helpful AI assistant. Generate a concise and relevant response based *only* on the most recent user message in the conversation history. Do not repeat or append previous responses unless specifically asked to summarize. Reply with TERMINATE when the task is fully complete.",
-                llm_config=LLM_CONFIG,
+                # Streaming config sends the reply in chunks as it is generated
+                llm_config=STREAMING_LLM_CONFIG if SOCKET_STREAMING else LLM_CONFIG,
+            )
+            # Repeated deterministic requests are answered from the response cache
+            assistant.client_cache = response_cache
+            track_agent(assistant, assistant.name)
+
+            # Keep the prompt under the token budget - older turns are summarised rather than resent every time
+            context_window = ConversationWindow(
+                max_tokens=CONTEXT_WINDOW_MAX_TOKENS,
+                summariser=make_llm_summariser(assistant.client, CONTEXT_SUMMARY_MAX_TOKENS) if CONTEXT_SUMMARISE else None,
+                model=LLM_CONFIG["config_list"][0]["model"],
+                summary_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
             )
-            ACTIVE_SESSIONS[session_id] = {
+            assistant.register_hook("process_all_messages_before_reply", context_window)
+
+            # Restore the conversation if the session was saved by another worker or before a restart
+            if state and state.get("kind") == "single":
+                assistant.chat_messages[user_proxy] = list(state["messages"])
+                context_window.summary = state.get("summary")
+                context_window.summarised_count = state.get("summarised_count", 0)
+                print(f"Restored {len(state['messages'])} messages for session {session_id}")
+
+            session = {
                 "user_proxy": user_proxy,
                 "assistant": assistant,
+                "context_window": context_window,
+                "version": state.get("version", 0) if state else 0,
             }
+            ACTIVE_SESSIONS[session_id] = session
             print(f"Agents created for session {session_id}")
         else:
             print(f"Using existing agents for session: {session_id}")
-        return ACTIVE_SESSIONS[session_id]["user_proxy"], ACTIVE_SESSIONS[session_id]["assistant"]
+        return session["user_proxy"], session["assistant"], session["context_window"]
 
     # Called on user message - client sends message with event called user_message
     @socket_io.on('user_message')
+    @tracer.traced("socketio user_message")
     def handle_user_message(data):
-        session_id = request.sid
+        session_id = session_key(data)
+        if session_id is None:
+            return
         print(f"Received message from {session_id}: {data.get('message')}")
 
         try:
@@ -77,12 +176,11 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
                 socket_io.emit('error', {'error': 'No message content provided'}, room=session_id)
                 return
 
-            # Get agents for this session
+            # Get agents for this session - created again if the session was evicted or expired
             if session_id not in ACTIVE_SESSIONS:
                 print(f"ERROR: No agents found for session {session_id}. Re-initializing.")
-                get_or_create_session_agents(session_id) # Attempt re-initialization
 
-            user_proxy, assistant = ACTIVE_SESSIONS[session_id]["user_proxy"], ACTIVE_SESSIONS[session_id]["assistant"]
+            user_proxy, assistant, context_window = get_or_create_session_agents(session_id)
 
             socket_io.emit('processing_status', {'status': 'processing'}, room=session_id)
 
@@ -96,16 +194,24 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
             user_proxy.chat_messages.setdefault(assistant, []).append(
                 {"role": "user", "content": user_input} 
             )
-
-
-            # Generate the reply using the assistants updayed history
-            assistant_reply = assistant.generate_reply(
-                # proxy messages 
-                messages=assistant.chat_messages[user_proxy],
-                # Identify the sender for context
-                sender=user_proxy, 
-                config=LLM_CONFIG 
-            )
+            # Log the users message - the replies are logged by the proxy's receive
+            if message_log is not None:
+                message_log.set_owner(user_proxy.conversation_id, data.get('email'))
+                message_log.append(user_proxy.conversation_id, "user", user_input)
+
+
+            # Chunks printed by the OpenAI client while streaming are emitted as agent_message_delta events
+            # A user is waiting on the reply - its requests go ahead of REST and batch chats under the rate limit
+            # The reply is counted against the user's email when the client sends it, as the REST routes do
+            with IOStream.set_default(SocketIOStream(session_id, socket_io, assistant.name)), requester(data.get('email') or session_id, INTERACTIVE), usage_scope(session=session_id), workspace_manager.scope(session_id), conversation_limiter.slot():
+                # Generate the reply using the assistants updayed history
+                assistant_reply = assistant.generate_reply(
+                    # proxy messages 
+                    messages=assistant.chat_messages[user_proxy],
+                    # Identify the sender for context
+                    sender=user_proxy, 
+                    config=LLM_CONFIG 
+                )
 
             # Send the assistant's reply to the user proxy.
             # The proxy's overridden receive method will handle emitting it.
@@ -117,6 +223,22 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
             # The super().receive call inside WebSocketUserProxy.receive will handle
             # adding the assistant's reply to the proxys history.
 
+            print(f"Prompt tokens for session {session_id}: {context_window.last_prompt_tokens} "
+                  f"(history {context_window.last_history_tokens})")
+
+            # Update the session's last use and size, and save its history for other workers
+            session = ACTIVE_SESSIONS.get(session_id)
+            if session is not None:
+                session["version"] = session.get("version", 0) + 1
+            ACTIVE_SESSIONS.touch(session_id)
+            ACTIVE_SESSIONS.save_state(session_id, {
+                "kind": "single",
+                "version": session.get("version", 0) if session is not None else 0,
+                "messages": assistant.chat_messages[user_proxy],
+                "summary": context_window.summary,
+                "summarised_count": context_window.summarised_count,
+            })
+
             #Check for termination based on the assistant's reply
             is_terminate = user_proxy._is_termination_msg(assistant_reply)
             
@@ -124,6 +246,9 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
             socket_io.emit('processing_status', {'status': status_message}, room=session_id)
             if is_terminate:
                 print(f"Termination message {session_id}")
+                # The conversation is over - write it now rather than on the next timed flush
+                if message_log is not None:
+                    message_log.flush()
 
 
         except Exception as e:
@@ -143,7 +268,7 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
                     return
 
                 # Get or create agents for this specific session
-                user_proxy, assistant = get_or_create_session_agents(session_id)
+                user_proxy, assistant, context_window = get_or_create_session_agents(session_id)
 
                 # Emit processing status once
                 socket_io.emit('processing_status', {'status': 'processing'}, room=session_id)
@@ -171,11 +296,60 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
                 socket_io.emit('processing_status', {'status': 'error'}, room=session_id)
 
 
+    #Called by a client that reconnected - rebuilds its single agent conversation from the message log
+    #and sends the messages logged after the last index the client saw. The conversation is the one its
+    #sessionToken was issued for, so a client can only resume its own
+    @socket_io.on('resume_session')
+    @tracer.traced("socketio resume_session")
+    def handle_resume_session(data):
+        session_id = session_key(data)
+        if session_id is None:
+            return
+        try:
+            conversation_id = session_id
+            after = int(data.get('after', -1))
+            if message_log is None or 'sessionToken' not in data:
+                socket_io.emit('error', {'error': 'Conversation can not be resumed'}, room=session_id)
+                return
+
+            logged = message_log.load(conversation_id)
+            if not logged:
+                socket_io.emit('error', {'error': 'Conversation not found'}, room=session_id)
+                return
+
+            user_proxy, assistant, context_window = get_or_create_session_agents(session_id)
+            # New messages carry on the same conversation in the log
+            user_proxy.conversation_id = conversation_id
+            assistant_history, proxy_history = [], []
+            for index, sender, content in logged:
+                if sender == "user":
+                    assistant_history.append({"role": "user", "content": content})
+                    proxy_history.append({"role": "user", "content": content})
+                else:
+                    # Replies as the proxy's receive stores them
+                    proxy_history.append({"role": "user", "content": content, "name": sender})
+            assistant.chat_messages[user_proxy] = assistant_history
+            user_proxy.chat_messages[assistant] = proxy_history
+            context_window.reset()
+
+            socket_io.emit('resumed_messages', {
+                'sessionId': conversation_id,
+                'messages': [{'index': index, 'sender': sender, 'content': content}
+                             for index, sender, content in logged if index > after],
+                'last_index': logged[-1][0],
+            }, room=session_id)
+        except Exception as e:
+            print(f"Error resuming conversation {session_id}: {str(e)}")
+            socket_io.emit('error', {'error': f"An error occurred: {str(e)}"}, room=session_id)
+
     @socket_io.on('user_message_team')
+    @tracer.traced("socketio user_message_team")
     def handle_team_chat_message(data):
         
-        print(f"Received message for team chat from {request.sid}: {data['message']}")
-        session_id = request.sid
+        session_id = session_key(data)
+        if session_id is None:
+            return
+        print(f"Received message for team chat from {session_id}: {data['message']}")
 
         try:
             message = data['message']
@@ -186,53 +360,51 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
             # Send acknowledgment
             socket_io.emit('processing_status', {'status': 'started'}, room=session_id)
 
-            print(f"Creating new session for {session_id}")
-            # Create a proxy agent for this session
-            #User proxy configuration is the exact same as in handle_message()
-            user_proxy = WebSocketUserProxy(
-            session_id=session_id,
-            socketio_instance=socket_io, 
-            name="User_proxy",                
-            human_input_mode="NEVER",
-            max_consecutive_auto_reply=2,
-            code_execution_config={
-                "use_docker" : False,
-                "work_dir": "groupchat",                    
-            },
-        )
-
-            #Get the data of the requiested agents to be inserted 
-            conn = connect_to_database()
-            try:
-                cursor = conn.cursor()
-                query = "SELECT agentspecialisation, agentconfig FROM agentdata WHERE agentid IN (%s, %s, %s)"
-                cursor.execute(query, (agentOneId, agentTwoId, agentThreeId))
-                result = cursor.fetchall()
-                cursor.close()
-            finally:
-                conn.close()
+            #Get the data of the requiested agents to be inserted - from the agent config cache, the database on a miss
+            result = agent_configs.get_many([agentOneId, agentTwoId, agentThreeId])
 
             #verify 3 agents are returned 
-            if len(result) == 3:
+            if len(result) != 3:
+                #Used for troubleshooting
+                print(f"Error: Could not retrieve all agent configurations for IDs {agentOneId}, {agentTwoId}, {agentThreeId}")
+                socket_io.emit('error', {'error': "Could not retrieve configurations for agents."}, room=session_id)
+                # return if setup failed
+                return 
+
+            def build_socket_team():
                 #Unpack the results
-                (specialisationOne, configOne), (specialisationTwo, configTwo), (specialisationThree, configThree) = result
+                (specialisationOne, configOne, temperatureOne), (specialisationTwo, configTwo, temperatureTwo), (specialisationThree, configThree, temperatureThree) = result
                 #refactor the names ensuring 
                 nameOne = refactor_agent_name(specialisationOne)
                 nameTwo = refactor_agent_name(specialisationTwo)
                 nameThree = refactor_agent_name(specialisationThree)
 
+                # Create a proxy agent for the team
+                #User proxy configuration is the exact same as in handle_message()
+                #The session id is set on each checkout so a cached team can serve any client
+                user_proxy = WebSocketUserProxy(
+                    session_id=session_id,
+                    socketio_instance=socket_io, 
+                    message_log=message_log,
+                    name="User_proxy",                
+                    human_input_mode="NEVER",
+                    max_consecutive_auto_reply=2,
+                    code_execution_config=code_execution_config("groupchat"),
+                )
 
                 # Create assistant agents
                 #The conversation is handled by the user proxy - socket io not required for these agents
-                agent_one_team = autogen.AssistantAgent(name=nameOne, description=configOne, llm_config=LLM_CONFIG)
-                agent_two_team = autogen.AssistantAgent(name=nameTwo, description=configTwo, llm_config=LLM_CONFIG)
-                agent_three_team = autogen.AssistantAgent(name=nameThree, description=configThree, llm_config=LLM_CONFIG)
+                agent_one_team = autogen.AssistantAgent(name=nameOne, description=configOne, llm_config=agent_llm_config(temperatureOne))
+                agent_two_team = autogen.AssistantAgent(name=nameTwo, description=configTwo, llm_config=agent_llm_config(temperatureTwo))
+                agent_three_team = autogen.AssistantAgent(name=nameThree, description=configThree, llm_config=agent_llm_config(temperatureThree))
 
                 # Setup group chat - same configuration as in chat_routes file - chat_team()
                 groupchat = autogen.GroupChat(
                     agents=[user_proxy, agent_one_team, agent_two_team, agent_three_team],
                     messages=[],
-                    max_round=12 
+                    max_round=12,
+                    # Rule based speaker selection, falling back to the manager's LLM
+                    **team_speaker_selector(agentOneId, agentTwoId, agentThreeId).group_chat_kwargs()
                 )
 
                 # Setup group chat manager - same configuration as in chat_routes file - chat_team() - no description
@@ -241,31 +413,34 @@ def register_socket_handlers(socket_io): # socket_io is the initialised instance
                     llm_config=LLM_CONFIG                        
                     
                 )
-
-                # Store the session data
-                ACTIVE_SESSIONS[session_id] = {
-                    'user_proxy': user_proxy,
-                    'manager': manager,
+                # Token use is accounted per agentdata id, the speaker selection calls against the manager
+                for agent, agent_id in ((agent_one_team, agentOneId), (agent_two_team, agentTwoId), (agent_three_team, agentThreeId), (manager, "manager")):
+                    track_agent(agent, agent_id)
+                return {
+                    "user_proxy": user_proxy,
+                    "agents": [agent_one_team, agent_two_team, agent_three_team],
+                    "groupchat": groupchat,
+                    "manager": manager,
                 }
-                
-                print(f"Session {session_id} created and stored.")
-            else:
-                #Used for troubleshooting
-                print(f"Error: Could not retrieve all agent configurations for IDs {agentOneId}, {agentTwoId}, {agentThreeId}")
-                socket_io.emit('error', {'error': "Could not retrieve configurations for agents."}, room=session_id)
-                # return if setup failed
-                return 
-
-
-
-            # Get the session data (user_proxy already has socket_io)
-            session_data = ACTIVE_SESSIONS[session_id]
-            user_proxy = session_data['user_proxy']
-            manager = session_data['manager']
 
-            # Initiate the chat
-            # The user_proxy will use self.socket_io to emit messages when its receive method is called
-            user_proxy.initiate_chat(manager, message=message)
+            # Reuse a prebuilt team for these agents if one is idle
+            team_key = ("socket", str(agentOneId), str(agentTwoId), str(agentThreeId))
+            with team_cache.checkout(team_key, build_socket_team) as team:
+                user_proxy = team["user_proxy"]
+                user_proxy.session_id = session_id
+                user_proxy.conversation_id = session_id
+                if message_log is not None:
+                    message_log.set_owner(session_id, data.get('email'))
+                    message_log.append(session_id, "user", message)
+
+                # Initiate the chat
+                # The user_proxy will use self.socket_io to emit messages when its receive method is called
+                # The chat is counted against the user's email when the client sends it, as the REST routes do
+                with requester(data.get('email') or session_id, INTERACTIVE), usage_scope(session=session_id, team=f"{agentOneId},{agentTwoId},{agentThreeId}"), workspace_manager.scope(session_id), conversation_limiter.slot():
+                    user_proxy.initiate_chat(team["manager"], message=message, cache=response_cache)
+
+            if message_log is not None:
+                message_log.flush()
 
             # Send completion status
             socket_io.emit('processing_status', {'status': 'completed'}, room=session_id)
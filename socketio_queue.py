@@ -0,0 +1,66 @@
+import queue
+import threading
+import socketio
+
+''' Message queue for running several nodes behind a load balancer. Flask-SocketIO keeps its clients and rooms in
+    the process, so an emit only reaches clients connected to the node that made it. With a client manager on a
+    shared pub/sub backend every emit is published to all the nodes and each delivers it to its own clients - a
+    reply produced on one node reaches the client wherever it is connected.
+'''
+
+
+''' In process stand-in for a pub/sub backend - the servers created in one process with the same channel share
+    their emits as separate nodes would through redis. Messages are sent as JSON like a real backend's.
+'''
+class LocalPubSubManager(socketio.PubSubManager):
+    name = 'local'
+
+    _subscribers = {}
+    _lock = threading.Lock()
+
+    def __init__(self, url='memory://', channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.url = url
+        self._queue = queue.Queue()
+        if not write_only:
+            with self._lock:
+                self._subscribers.setdefault(channel, []).append(self._queue)
+
+    def _publish(self, data):
+        message = self.json.dumps(data)
+        with self._lock:
+            subscribers = list(self._subscribers.get(self.channel, []))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._queue.get()
+
+    def close(self):
+        with self._lock:
+            subscribers = self._subscribers.get(self.channel, [])
+            if self._queue in subscribers:
+                subscribers.remove(self._queue)
+
+
+#Client manager for the message queue url - None for a single node. write_only for processes that only emit
+def create_client_manager(url, channel='genaicolab', write_only=False):
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return LocalPubSubManager(url, channel=channel, write_only=write_only)
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return socketio.RedisManager(url, channel=channel, write_only=write_only)
+    if url.startswith("kafka://"):
+        return socketio.KafkaManager(url, channel=channel, write_only=write_only)
+    if url.startswith("zmq"):
+        return socketio.ZmqManager(url, channel=channel, write_only=write_only)
+    # amqp:// and the other transports kombu supports
+    return socketio.KombuManager(url, channel=channel, write_only=write_only)
+
+
+#Name of the backend shared by the nodes, for the stats endpoints
+def message_queue_name(socket_io):
+    manager = getattr(socket_io.server, "manager", None)
+    return manager.name if isinstance(manager, socketio.PubSubManager) else None
@@ -0,0 +1,153 @@
+import json
+import re
+import threading
+from db_connection import database_connection
+from config import TEAM_SPEAKER_SELECTION, TEAM_SPEAKER_ROUTES
+
+''' Picks the next speaker of a team group chat without asking the manager's LLM when rules can decide.
+    Passed to autogen.GroupChat as speaker_selection_method - autogen calls it with the last speaker and the
+    group chat before each turn, and it returns the next agent or "auto" to leave the choice to the LLM.
+
+    A team's selection is configured in agentteams.speakerselection, e.g.
+        {"mode": "rules", "routes": [{"pattern": "Traceback", "agent": "program"}], "fallback": "auto"}
+        {"mode": "state_machine", "transitions": {"proxy": ["program"], "program": ["proxy", "test"]}}
+    Agents are named by any part of their name, case insensitive. Modes:
+        auto         - the manager's LLM picks every speaker (autogen's default)
+        round_robin  - agents speak in turn
+        rules        - the first agent whose route pattern matches the last message speaks
+        state_machine - the last speaker's only allowed next agent speaks, routes choose between several
+    When the rules do not settle on exactly one agent the fallback is used - "auto" unless set.
+'''
+MODES = ("auto", "round_robin", "rules", "state_machine")
+
+
+class SelectionStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Speakers chosen by rules - each one is a manager LLM call saved
+        self.rule_selections = 0
+        self.llm_fallbacks = 0
+        self.by_mode = {}
+
+    def record(self, mode, used_llm):
+        with self._lock:
+            if used_llm:
+                self.llm_fallbacks += 1
+            else:
+                self.rule_selections += 1
+            self.by_mode[mode] = self.by_mode.get(mode, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            total = self.rule_selections + self.llm_fallbacks
+            return {
+                "manager_calls_saved": self.rule_selections,
+                "llm_fallbacks": self.llm_fallbacks,
+                "saved_rate": round(self.rule_selections / total, 3) if total else 0.0,
+                "by_mode": dict(self.by_mode),
+            }
+
+
+# Process wide counters for all teams
+selection_stats = SelectionStats()
+
+
+def _matches(agent, name_part):
+    return name_part.lower() in agent.name.lower()
+
+
+class SpeakerSelector:
+
+    def __init__(self, mode="auto", routes=None, transitions=None, fallback="auto", stats=selection_stats):
+        if mode not in MODES:
+            raise ValueError(f"Unknown speaker selection mode: {mode}")
+        self.mode = mode
+        # [(compiled pattern, agent name part)] checked in order
+        self.routes = [(re.compile(route["pattern"], re.IGNORECASE), route["agent"]) for route in (routes or [])]
+        # agent name part -> agent name parts allowed to speak next
+        self.transitions = transitions or {}
+        self.fallback = fallback
+        self.stats = stats
+
+    @classmethod
+    def from_config(cls, config):
+        # config is the team's speakerselection value - a dict, its JSON, or None for the defaults
+        if isinstance(config, str):
+            config = json.loads(config)
+        if not isinstance(config, dict):
+            config = {}
+        return cls(
+            mode=config.get("mode", TEAM_SPEAKER_SELECTION),
+            routes=config.get("routes", TEAM_SPEAKER_ROUTES),
+            transitions=config.get("transitions"),
+            fallback=config.get("fallback", "auto"),
+        )
+
+    def group_chat_kwargs(self):
+        # Keyword arguments for autogen.GroupChat - auto keeps autogen's own selection untouched
+        if self.mode == "auto":
+            return {}
+        return {"speaker_selection_method": self}
+
+    def __call__(self, last_speaker, groupchat):
+        speaker = self.select(last_speaker, groupchat)
+        if speaker is None:
+            speaker = groupchat.next_agent(last_speaker) if self.fallback == "round_robin" else "auto"
+        self.stats.record(self.mode, used_llm=isinstance(speaker, str))
+        return speaker
+
+    def select(self, last_speaker, groupchat):
+        # The next agent when the rules decide, otherwise None
+        if self.mode == "round_robin":
+            return groupchat.next_agent(last_speaker)
+
+        candidates = [agent for agent in groupchat.agents if agent is not last_speaker]
+        if self.mode == "state_machine":
+            allowed = next((targets for source, targets in self.transitions.items() if _matches(last_speaker, source)), None)
+            if allowed is not None:
+                candidates = [agent for agent in candidates if any(_matches(agent, target) for target in allowed)]
+                if len(candidates) == 1:
+                    return candidates[0]
+        if self.mode in ("rules", "state_machine"):
+            return self._route(groupchat.messages[-1] if groupchat.messages else None, candidates)
+        return None
+
+    def _route(self, message, candidates):
+        content = message.get("content") if isinstance(message, dict) else message
+        if not isinstance(content, str) or not candidates:
+            return None
+        for pattern, name_part in self.routes:
+            if pattern.search(content):
+                matched = [agent for agent in candidates if _matches(agent, name_part)]
+                # Ambiguous when the name part fits several agents - left to the fallback
+                return matched[0] if len(matched) == 1 else None
+        return None
+
+
+#Speaker selection stored with the team made of these three agents - None if there is no such team
+def load_team_selection_config(agentOne, agentTwo, agentThree):
+    try:
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT speakerselection FROM agentteams WHERE teamagentone = %s AND teamagenttwo = %s AND teamagentthree = %s "
+                "AND speakerselection IS NOT NULL LIMIT 1",
+                (str(agentOne), str(agentTwo), str(agentThree))
+            )
+            result = cursor.fetchone()
+            cursor.close()
+    except Exception as e:
+        # The team chat still runs with the default selection
+        print(f"Error loading team speaker selection: {str(e)}")
+        return None
+    return result[0] if result else None
+
+
+#Selector for the team made of these three agents
+def team_speaker_selector(agentOne, agentTwo, agentThree):
+    try:
+        return SpeakerSelector.from_config(load_team_selection_config(agentOne, agentTwo, agentThree))
+    except (ValueError, KeyError, re.error) as e:
+        print(f"Invalid team speaker selection, using the default: {str(e)}")
+        return SpeakerSelector.from_config(None)
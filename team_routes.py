@@ -1,5 +1,10 @@
+import json
+import re
 from flask import Blueprint, request, jsonify
-from db_connection import connect_to_database
+from db_connection import database_connection
+from utils import read_page_params, query_limit, split_page
+from speaker_selection import SpeakerSelector
+from agent_cache import team_cache
 
 team_blueprint = Blueprint('team', __name__)
 
@@ -15,55 +20,93 @@ def store_team():
         agentOne = data['agentOne']
         agentTwo = data['agentTwo']
         agentThree = data['agentThree']
+        #Optional speaker selection rules for the team's group chat - see speaker_selection.py
+        speakerSelection = data.get('speakerSelection')
+        if speakerSelection is not None:
+            try:
+                SpeakerSelector.from_config(speakerSelection)
+            except (ValueError, KeyError, TypeError, re.error) as e:
+                return jsonify({"error": f"Invalid speakerSelection: {str(e)}"}), 400
+            speakerSelection = json.dumps(speakerSelection) if not isinstance(speakerSelection, str) else speakerSelection
         
-        conn = connect_to_database()        
-        cursor = conn.cursor()
-        #execute the query with inserted variables
-        cursor.execute(
-            "INSERT INTO agentteams (useremail, teamname, teamdescription, teamagentone, teamagenttwo, teamagentthree) VALUES (%s, %s, %s, %s, %s, %s)",
-            (userEmail, teamName, teamDescription, agentOne, agentTwo, agentThree)
-        )
-        #commit transaction, close cursor and close connection
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            #execute the query with inserted variables
+            cursor.execute(
+                "INSERT INTO agentteams (useremail, teamname, teamdescription, teamagentone, teamagenttwo, teamagentthree, speakerselection) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (userEmail, teamName, teamDescription, agentOne, agentTwo, agentThree, speakerSelection)
+            )
+            #commit transaction and close cursor - the connection goes back to the pool
+            conn.commit()
+            cursor.close()
+        #Cached teams were built with the previous speaker selection
+        if speakerSelection is not None:
+            team_cache.invalidate()
         
         return jsonify({"response": "Team stored"}), 200
     except Exception as e:
         print("Error:", str(e))
         return jsonify({"error": str(e)}), 500
 
-#POST endpoint to get all the teams belonging to a user of a particulary email address
+#POST endpoint to get the teams belonging to a user of a particulary email address - a page at a time
 @team_blueprint.route('/gather_teams', methods=['POST'])
 def gather_teams():
     try:
         data = request.json
         email = data['email']
+        try:
+            #Optional "cursor" (teamid of the last team of the previous page) and "limit" - all teams without either
+            cursor_id, limit = read_page_params(data, paged_by_default=False)
+        except ValueError:
+            return jsonify({"error": "cursor and limit must be numbers"}), 400
+        next_cursor = None
 
         if isinstance(email, str):
-            conn = connect_to_database()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "SELECT teamname, teamdescription, teamagentone, teamagenttwo, teamagentthree FROM agentteams WHERE useremail = %s", 
-                (email,)
-            )
+            with database_connection() as conn:
+                cursor = conn.cursor()
 
-            #Get all agent teams
-            result = cursor.fetchall()
+                #Keyset pagination on the (useremail, teamid) index - one row more than the page shows if there is another page
+                if cursor_id is None:
+                    cursor.execute(
+                        "SELECT teamname, teamdescription, teamagentone, teamagenttwo, teamagentthree, teamid FROM agentteams WHERE useremail = %s ORDER BY teamid LIMIT %s", 
+                        (email, query_limit(limit))
+                    )
+                else:
+                    cursor.execute(
+                        "SELECT teamname, teamdescription, teamagentone, teamagenttwo, teamagentthree, teamid FROM agentteams WHERE useremail = %s AND teamid > %s ORDER BY teamid LIMIT %s", 
+                        (email, cursor_id, query_limit(limit))
+                    )
+
+                #Get the page of agent teams
+                result = cursor.fetchall()
+                cursor.close()
+            result, next_cursor = split_page(result, limit)
             #format for easy extraction on frontend
             formatted_result = [[[teamname], [teamdescription], [teamagentone], [teamagenttwo], [teamagentthree]] 
-                               for teamname, teamdescription, teamagentone, teamagenttwo, teamagentthree in result]
+                               for teamname, teamdescription, teamagentone, teamagenttwo, teamagentthree, teamid in result]
 
             
             if not result:
                 chat_content = "<div id='previous_chat_error'><h1 id='returned_data'>Error fetching chat data</h1><br /><h3 id='previous_chat_error_sub'>Please try again later</h3></div>"  
                 return jsonify({"message": chat_content}), 200
-                
-            cursor.close()
-            conn.close()
         
-        return jsonify({"message": formatted_result}), 200
+        return jsonify({"message": formatted_result, "next_cursor": next_cursor}), 200
+    except Exception as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 500
+
+#POST endpoint to count a users teams without fetching them
+@team_blueprint.route('/count_teams', methods=['POST'])
+def count_teams():
+    try:
+        data = request.json
+        email = data['email']
+        with database_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM agentteams WHERE useremail = %s", (email,))
+            count = cursor.fetchone()[0]
+            cursor.close()
+        return jsonify({"message": count}), 200
     except Exception as e:
         print("Error:", str(e))
         return jsonify({"error": str(e)}), 500
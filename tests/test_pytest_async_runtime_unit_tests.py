@@ -0,0 +1,52 @@
+# test_async_runtime.py
+import threading
+import pytest
+from async_runtime import ConversationLimiter, ServerBusyError, active_mode, offload
+
+def test_threading_mode_runs_offloaded_calls_inline():
+    assert active_mode() == "threading"
+    assert offload(sorted, [3, 1, 2], reverse=True) == [3, 2, 1]
+
+def test_limiter_bounds_running_conversations():
+    limiter = ConversationLimiter(max_active=1, wait_timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+
+    def conversation():
+        with limiter.slot():
+            started.set()
+            release.wait(2)
+
+    worker = threading.Thread(target=conversation)
+    worker.start()
+    started.wait(2)
+    assert limiter.stats()["active_conversations"] == 1
+
+    #No slot frees up within the wait timeout
+    with pytest.raises(ServerBusyError):
+        with limiter.slot():
+            pass
+    release.set()
+    worker.join(2)
+
+    with limiter.slot():
+        pass
+    stats = limiter.stats()
+    assert stats["active_conversations"] == 0
+    assert stats["completed_conversations"] == 2
+    assert stats["rejected_conversations"] == 1
+
+def test_slot_is_released_when_the_conversation_fails():
+    limiter = ConversationLimiter(max_active=1, wait_timeout=0.05)
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError("LLM error")
+    with limiter.slot():
+        assert limiter.stats()["active_conversations"] == 1
+
+def test_serve_refuses_the_development_server_unless_allowed(capsys):
+    from serve import check_dev_server
+    with pytest.raises(SystemExit, match="SERVER_ALLOW_DEV_SERVER"):
+        check_dev_server("threading", allowed=False)
+    assert check_dev_server("threading", allowed=True) is True
+    assert "WARNING" in capsys.readouterr().err
+    assert check_dev_server("gevent", allowed=False) is False
@@ -0,0 +1,55 @@
+# test_benchmarks.py
+import requests
+from benchmarks.run_benchmarks import percentile, find_regressions
+from benchmarks.stub_llm_server import StubLLM, start_stub_server
+from benchmarks.stub_database import StubConnection
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([0.2], 99) == 0.2
+    assert percentile([], 50) == 0.0
+
+def test_find_regressions_against_baseline():
+    baseline = {"rest_chat": {"p95_ms": 100.0, "throughput_per_second": 50.0, "errors": 0}}
+    assert find_regressions({"rest_chat": {"p95_ms": 110.0, "throughput_per_second": 48.0, "errors": 0}}, baseline, 0.2) == []
+
+    regressions = find_regressions({"rest_chat": {"p95_ms": 150.0, "throughput_per_second": 30.0, "errors": 2}}, baseline, 0.2)
+    assert len(regressions) == 3
+    #Scenarios missing from the baseline are not compared
+    assert find_regressions({"rest_list_chats": {"p95_ms": 1.0, "throughput_per_second": 1.0, "errors": 0}}, baseline, 0.2) == []
+
+def test_stub_answers_speaker_selection_and_terminates():
+    stub = StubLLM(reply_tokens=5, terminate_after=3)
+    prompt = "Read the above conversation. Then select the next role from ['Programmer', 'Tester'] to play. Only return the role."
+    assert stub.reply({"messages": [{"role": "system", "content": prompt}]}) in ("Programmer", "Tester")
+    assert stub.reply({"messages": [{"role": "user", "content": "hi"}]}) == "word0 word1 word2 word3 word4"
+    assert stub.reply({"messages": [{"role": "user", "content": "hi"}] * 3}) == "TERMINATE"
+
+def test_stub_server_replies_like_chat_completions():
+    server = start_stub_server(StubLLM(latency_ms=0, tokens_per_second=0, reply_tokens=3))
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+        body = requests.post(url, json={"model": "gpt-4o", "messages": [{"role": "user", "content": "x" * 40}]}).json()
+        assert body["choices"][0]["message"]["content"] == "word0 word1 word2"
+        assert body["usage"] == {"prompt_tokens": 14, "completion_tokens": 3, "total_tokens": 17}
+
+        streamed = requests.post(url, json={"model": "gpt-4o", "messages": [], "stream": True}).text
+        assert streamed.count("chat.completion.chunk") == 4
+        assert streamed.rstrip().endswith("data: [DONE]")
+    finally:
+        server.shutdown()
+
+def test_stub_database_answers_agent_lookups():
+    conn = StubConnection(latency_ms=0)
+    cursor = conn.cursor()
+    cursor.execute("SELECT agentid, agentspecialisation, agentconfig, temperature FROM agentdata WHERE agentid IN (%s, %s)", ("1", "2"))
+    rows = cursor.fetchall()
+    assert [row[0] for row in rows] == ["1", "2"]
+    assert rows[0][1] != rows[1][1]
+
+    cursor.execute("SELECT chatname, chatid FROM chattable WHERE useremail = %s", ("a@example.com",))
+    assert cursor.fetchall() == []
+    assert conn.statements == 2
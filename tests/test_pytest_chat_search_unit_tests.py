@@ -0,0 +1,23 @@
+# test_chat_search.py
+from chat_search import chat_search_text, headline_text, query_terms, make_snippet
+
+def test_search_text_strips_html_and_message_structure():
+    content = [{"role": "user", "content": "<p>Fix the <b>parser</b></p>"}, {"role": "assistant", "content": "Done &amp; tested"}]
+
+    assert chat_search_text(content) == "Fix the parser Done & tested"
+
+def test_snippet_marks_terms_around_first_match():
+    text = "intro " * 100 + "the connection pool timed out while the pool was full " + "outro " * 100
+    snippet = make_snippet(text, query_terms("pool OR timeout"), max_chars=80)
+
+    assert snippet.startswith("...") and snippet.endswith("...")
+    assert "<b>pool</b>" in snippet
+    assert len(snippet) < 200
+
+def test_snippet_escapes_chat_text():
+    #Only the term markers are HTML - text from the chat is escaped
+    assert make_snippet("a <script> tag", ["tag"]) == "a &lt;script&gt; <b>tag</b>"
+
+def test_headline_is_marked_like_other_snippets():
+    headline = "the <b>pool</b>, &amp; <img src=x onerror=alert(1)"
+    assert make_snippet(headline_text(headline), ["pool"]) == "the <b>pool</b>, &amp; &lt;img src=x onerror=alert(1)"
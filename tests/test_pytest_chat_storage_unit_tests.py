@@ -0,0 +1,30 @@
+# test_chat_storage.py
+import pytest
+from chat_storage import compress_chunk, decompress_chunk, encode_chat, read_header, decode_messages, CHUNKED_MARKER
+
+def test_chunks_round_trip_with_each_format():
+    #Chunks carry their own format marker so zlib and uncompressed chunks can be read back side by side
+    text = "Traceback (most recent call last):\n" * 200
+    compressed = compress_chunk(text, method="zlib")
+    raw = compress_chunk(text, method="none")
+
+    assert len(compressed) < len(text) / 10
+    assert decompress_chunk(compressed) == text
+    assert decompress_chunk(raw) == text
+
+def test_unknown_chunk_format_is_rejected():
+    with pytest.raises(ValueError):
+        decompress_chunk(b"?not a chunk")
+
+def test_encode_chat_stores_one_chunk_per_message():
+    #Each message of a list is its own chunk - message dicts are stored as JSON
+    header, chunks = encode_chat([{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])
+
+    assert header.startswith(CHUNKED_MARKER)
+    assert read_header(header) == {"kind": "json", "count": 2}
+    assert decode_messages(read_header(header), chunks[1:]) == [{"role": "assistant", "content": "hello"}]
+
+def test_chats_saved_before_chunking_have_no_header():
+    #Existing rows hold the chat content itself
+    assert read_header("<div>Previous chat content</div>") is None
+    assert read_header(None) is None
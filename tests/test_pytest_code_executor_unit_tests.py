@@ -0,0 +1,184 @@
+# test_code_executor.py
+import os
+import pytest
+from autogen.coding.base import CodeBlock
+import code_executor
+from code_executor import ExecutorPool, PooledCodeExecutor, LocalCodeExecutor
+from workspaces import WorkspaceManager
+from execution_cache import ExecutionCache
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ExecutorPool(size=1, timeout=2, cpu_seconds=5, memory_mb=256, preload=["json"])
+    yield pool
+    pool.close()
+
+@pytest.fixture
+def executor(pool, tmp_path):
+    return PooledCodeExecutor(pool, tmp_path)
+
+def test_runs_python_in_the_work_dir(executor, tmp_path):
+    result = executor.execute_code_blocks([CodeBlock(code="import os\nprint(os.getcwd())", language="python")])
+    assert result.exit_code == 0
+    assert result.output.strip() == str(tmp_path.resolve())
+    assert os.path.exists(result.code_file)
+
+def test_secrets_are_not_passed_to_code(executor):
+    result = executor.execute_code_blocks([CodeBlock(code="import os\nprint('OPEN_AI_KEY' in os.environ)", language="python")])
+    assert result.output.strip() == "False"
+
+def test_failed_block_stops_the_run(executor):
+    result = executor.execute_code_blocks([
+        CodeBlock(code="raise ValueError('bad input')", language="python"),
+        CodeBlock(code="print('not run')", language="python"),
+    ])
+    assert result.exit_code == 1
+    assert "Traceback (most recent call last)" in result.output
+    assert "ValueError: bad input" in result.output
+    assert "not run" not in result.output
+
+def test_code_cannot_reach_the_worker_socket(executor):
+    #Only stdin, stdout and stderr are open in the child - a forged reply has nowhere to go
+    code = """import os, json, struct
+open_fds = []
+for fd in range(3, 1024):
+    try:
+        os.fstat(fd)
+        open_fds.append(fd)
+    except OSError:
+        pass
+forged = json.dumps({"exit_code": 0, "output": "forged", "timed_out": False}).encode()
+for fd in open_fds:
+    try:
+        os.write(fd, struct.pack(">I", len(forged)) + forged)
+    except OSError:
+        pass
+print(open_fds)"""
+    result = executor.execute_code_blocks([CodeBlock(code=code, language="python")])
+    assert result.exit_code == 0
+    assert result.output.strip() == "[]"
+    #The worker still answers with the real result of the next block
+    assert executor.execute_code_blocks([CodeBlock(code="print(3)", language="python")]).output == "3\n"
+
+def test_shell_block_and_exit_code(executor):
+    result = executor.execute_code_blocks([CodeBlock(code="echo from shell\nexit 3", language="sh")])
+    assert result.exit_code == 3
+    assert result.output.strip() == "from shell"
+
+def test_timeout_kills_the_block(executor, pool):
+    result = executor.execute_code_blocks([CodeBlock(code="import time\ntime.sleep(30)", language="python")])
+    assert result.exit_code == 124
+    assert "Timeout" in result.output
+    #The worker is still usable after the kill
+    assert executor.execute_code_blocks([CodeBlock(code="print(2)", language="python")]).output == "2\n"
+    assert pool.stats()["timeouts"] >= 1
+
+def test_memory_limit(executor):
+    result = executor.execute_code_blocks([CodeBlock(code="x = bytearray(512 * 1024 * 1024)", language="python")])
+    assert result.exit_code == 1
+    assert "MemoryError" in result.output
+
+def test_filename_comment_and_unknown_language(executor, tmp_path):
+    result = executor.execute_code_blocks([CodeBlock(code="# filename: app/main.py\nprint('saved')", language="python")])
+    assert result.code_file == str(tmp_path.resolve() / "app" / "main.py")
+
+    result = executor.execute_code_blocks([CodeBlock(code="fn main() {}", language="rust")])
+    assert result.exit_code == 1
+    assert "unknown language rust" in result.output
+
+    result = executor.execute_code_blocks([CodeBlock(code="# filename: ../outside.py\nprint(1)", language="python")])
+    assert result.output == "Filename is not in the workspace"
+
+def test_code_runs_in_the_current_workspace(pool, tmp_path):
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), max_bytes=64 * 1024, max_files=5, reaper_interval=0)
+    executor = PooledCodeExecutor(pool, tmp_path / "shared", manager)
+    with manager.scope("session-a"):
+        result = executor.execute_code_blocks([CodeBlock(code="import os\nprint(os.getcwd())", language="python")])
+    assert result.output.strip() == manager.directory("session-a")
+
+    #A file larger than the space left in the workspace cannot be written
+    with manager.scope("session-a"):
+        result = executor.execute_code_blocks([CodeBlock(code="open('big.bin', 'wb').write(b'x' * 128 * 1024)", language="python")])
+    assert result.exit_code == 1
+    assert "File too large" in result.output
+
+    #Over the file limit - no more code runs in the workspace
+    with manager.scope("session-b"):
+        executor.execute_code_blocks([CodeBlock(code="for i in range(10): open(f'f{i}.txt', 'w')", language="python")])
+        result = executor.execute_code_blocks([CodeBlock(code="print('ran')", language="python")])
+    assert result.exit_code == 1
+    assert result.output.startswith("Workspace quota exceeded")
+
+def test_code_execution_config_falls_back_to_local(monkeypatch, tmp_path):
+    monkeypatch.setattr(code_executor, "executor_pool", None)
+    config = code_executor.code_execution_config(str(tmp_path))
+    assert isinstance(config["executor"], LocalCodeExecutor)
+    assert code_executor.get_code_executor_stats()["enabled"] is False
+
+    result = config["executor"].execute_code_blocks([CodeBlock(code="print(6 * 7)", language="python")])
+    assert result.exit_code == 0
+    assert result.output.strip() == "42"
+
+def test_repeated_blocks_are_served_from_the_cache(pool, tmp_path):
+    cache = ExecutionCache()
+    executor = PooledCodeExecutor(pool, tmp_path, cache=cache)
+    block = CodeBlock(code="# filename: check.py\nimport json\nprint(json.dumps([1, 2]))", language="python")
+    first = executor.execute_code_blocks([block])
+    executions = pool.stats()["executions"]
+
+    second = executor.execute_code_blocks([block])
+    assert second == first
+    assert pool.stats()["executions"] == executions
+    assert cache.stats()["hits"] == 1
+
+    #A changed file in the work dir means the code has to run again
+    (tmp_path / "data.txt").write_text("new")
+    executor.execute_code_blocks([block])
+    assert pool.stats()["executions"] == executions + 1
+
+    #Timeouts are not cached
+    slow = CodeBlock(code="while True: pass", language="python")
+    executor.execute_code_blocks([slow])
+    executor.execute_code_blocks([slow])
+    assert cache.stats()["hits"] == 1
+
+def test_cache_hit_writes_the_code_file(tmp_path):
+    executor = LocalCodeExecutor(tmp_path, cache=ExecutionCache(), timeout=10)
+    version = lambda text: CodeBlock(code=f"# filename: app.py\nprint('{text}')", language="python")
+    assert executor.execute_code_blocks([version("v1")]).output.strip() == "v1"
+    assert executor.execute_code_blocks([version("v2")]).output.strip() == "v2"
+
+    #Served from the cache - app.py holds v1 again, as if it had run
+    assert executor.execute_code_blocks([version("v1")]).output.strip() == "v1"
+    assert executor.cache.stats()["hits"] == 1
+    result = executor.execute_code_blocks([CodeBlock(code="python app.py", language="sh")])
+    assert result.output.strip() == "v1"
+
+def test_worker_that_can_not_be_replaced_is_not_reused(monkeypatch, tmp_path):
+    pool = ExecutorPool(size=1, timeout=2, cpu_seconds=5, memory_mb=256)
+    executor = PooledCodeExecutor(pool, tmp_path)
+    try:
+        assert executor.execute_code_blocks([CodeBlock(code="print('ok')", language="python")]).exit_code == 0
+        worker = pool._idle.queue[0]
+        worker.process.kill()
+        worker.process.wait()
+
+        #The lost worker's replacement fails to start - out of file descriptors
+        def no_fds(preload):
+            raise OSError(24, "Too many open files")
+        real_worker = code_executor._Worker
+        monkeypatch.setattr(code_executor, "_Worker", no_fds)
+        result = executor.execute_code_blocks([CodeBlock(code="print('ok')", language="python")])
+        assert result.output.startswith(code_executor.WORKER_FAILED)
+        assert pool.stats()["workers"] == 0 and pool.stats()["worker_start_failures"] == 1
+        #No worker to wait for - the run fails instead of blocking
+        result = executor.execute_code_blocks([CodeBlock(code="print('ok')", language="python")])
+        assert result.output.endswith("no worker could be started")
+
+        #Started again once it can be
+        monkeypatch.setattr(code_executor, "_Worker", real_worker)
+        result = executor.execute_code_blocks([CodeBlock(code="print('ok')", language="python")])
+        assert result.exit_code == 0 and result.output.strip() == "ok"
+        assert pool.stats()["workers"] == 1
+    finally:
+        pool.close()
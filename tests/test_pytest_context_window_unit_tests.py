@@ -0,0 +1,48 @@
+from unittest.mock import MagicMock
+from context_window import ConversationWindow
+
+# Build a conversation of count messages, each roughly 25 tokens long
+def make_messages(count):
+    return [{"role": "user", "content": f"message {i} " + "x" * 100} for i in range(count)]
+
+# Token counter used in place of tiktoken - one token per message keeps the arithmetic obvious
+def one_token_each(monkeypatch):
+    monkeypatch.setattr('context_window.count_message_tokens',
+                        lambda messages, model="gpt-4o": len(messages))
+
+def test_short_history_sent_unchanged(monkeypatch):
+    one_token_each(monkeypatch)
+    window = ConversationWindow(max_tokens=10)
+    messages = make_messages(5)
+
+    assert window.apply(messages) is messages
+
+def test_long_history_trimmed_to_budget(monkeypatch):
+    one_token_each(monkeypatch)
+    window = ConversationWindow(max_tokens=4)
+    messages = make_messages(10)
+
+    prompt = window.apply(messages)
+
+    # The newest messages that fit the budget are kept
+    assert prompt == messages[-4:]
+    assert window.last_history_tokens == 10
+    assert window.last_prompt_tokens == 4
+
+def test_dropped_messages_summarised_once(monkeypatch):
+    one_token_each(monkeypatch)
+    summariser = MagicMock(return_value="summary so far")
+    window = ConversationWindow(max_tokens=4, summariser=summariser, summary_tokens=1)
+    messages = make_messages(10)
+
+    prompt = window.apply(messages)
+
+    assert prompt[0]["content"] == "Summary of the earlier conversation: summary so far"
+    # Summary takes one token of the budget, leaving room for three messages
+    assert prompt[1:] == messages[-3:]
+    summariser.assert_called_once_with(None, messages[:7])
+
+    # Next turn only the newly dropped message is summarised
+    messages.append({"role": "user", "content": "next"})
+    window.apply(messages)
+    summariser.assert_called_with("summary so far", messages[7:8])
@@ -0,0 +1,82 @@
+import pytest
+from unittest.mock import MagicMock
+from psycopg2 import extensions
+from db_connection import ConnectionPool, PoolTimeoutError
+
+# Build a mock connection that looks like an open, idle psycopg2 connection
+def make_mock_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    conn.get_transaction_status.return_value = extensions.TRANSACTION_STATUS_IDLE
+    return conn
+
+@pytest.fixture
+def connect():
+    return MagicMock(side_effect=lambda: make_mock_connection())
+
+def test_connection_is_reused(connect):
+    pool = ConnectionPool(connect, min_size=0, max_size=2)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    # Only one connection opened - the second checkout reused the first
+    assert first is second
+    assert connect.call_count == 1
+    assert pool.stats()["checkouts"] == 2
+    assert pool.stats()["idle"] == 1
+
+def test_checkout_times_out_when_pool_exhausted(connect):
+    pool = ConnectionPool(connect, min_size=0, max_size=1, timeout=0.05)
+    conn = pool.getconn()
+
+    with pytest.raises(PoolTimeoutError):
+        pool.getconn()
+
+    assert pool.stats()["timeouts"] == 1
+    pool.putconn(conn)
+
+def test_connection_recycled_after_max_uses(connect):
+    pool = ConnectionPool(connect, min_size=0, max_size=1, max_uses=2)
+
+    for _ in range(3):
+        with pool.connection():
+            pass
+
+    # Two uses on the first connection, then a replacement is opened
+    assert connect.call_count == 2
+    assert pool.stats()["recycled"] == 1
+
+def test_broken_connection_discarded_on_checkout(connect):
+    pool = ConnectionPool(connect, min_size=1, max_size=1)
+    pool.fill()
+    # Simulate the server dropping the idle connection
+    pool._idle[0][0].closed = 1
+
+    with pool.connection() as conn:
+        assert conn.closed == 0
+
+    assert pool.stats()["discarded"] == 1
+
+def test_rollback_on_error(connect):
+    pool = ConnectionPool(connect, min_size=0, max_size=1)
+
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            raise ValueError("query failed")
+
+    conn.rollback.assert_called_once()
+    # Rolled back connection is still usable and returned to the pool
+    assert pool.stats()["idle"] == 1
+
+def test_traced_statement_leaves_out_values():
+    from db_connection import traced_statement
+    assert traced_statement("SELECT chatid FROM chattable WHERE useremail = %s") == "SELECT chatid FROM chattable WHERE useremail = %s"
+    #Queries built by execute_values or mogrify arrive with the values in them
+    assert traced_statement(b"INSERT INTO sessionmessages (sessionid, content) VALUES ('sid', 'secret chat')") == \
+        "INSERT INTO sessionmessages (sessionid, content) VALUES"
+    assert traced_statement(b"DELETE FROM usertable WHERE useremail = 'user@example.com'") is None
+    assert traced_statement("INSERT INTO usertable (useremail) values ('user@example.com')") == "INSERT INTO usertable (useremail) values"
+    assert traced_statement("SELECT 1 FROM usertable WHERE useremail = 'it''s@example.com'") == "SELECT 1 FROM usertable WHERE useremail = ?"
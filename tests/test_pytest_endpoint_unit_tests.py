@@ -1,9 +1,15 @@
 # test_endpoints.py
 import pytest
 import json
+from contextlib import contextmanager
 from app import app
 from unittest.mock import MagicMock
+import threading
+import chat_routes
 from config import ACTIVE_SESSIONS
+from jobs import chat_jobs, JobManager
+from agents import AgentPool, SocketIOStream, WebSocketUserProxy
+from agent_cache import AgentConfigCache, TeamCache
 
 @pytest.fixture
 def client():
@@ -24,17 +30,20 @@ def mock_db_connection(monkeypatch):
     #"Update" mcok_con state 
     mock_conn.cursor.return_value = mock_cursor
     
-    # Function returning the mock connection
-    def mock_connect_to_database():
-        return mock_conn
+    # Context manager yielding the mock connection - stands in for a pooled connection checkout
+    @contextmanager
+    def mock_database_connection():
+        yield mock_conn
     
-    #  Replace the connect_to_database mathod with mock_connect_to_database, ensuring no actual transactions occur  
+    #  Replace the database_connection method with mock_database_connection, ensuring no actual transactions occur  
      
-    monkeypatch.setattr('chat_routes.connect_to_database', mock_connect_to_database)
-    monkeypatch.setattr('agent_routes.connect_to_database', mock_connect_to_database)
-    monkeypatch.setattr('user_routes.connect_to_database', mock_connect_to_database)
-    monkeypatch.setattr('team_routes.connect_to_database', mock_connect_to_database)
-    monkeypatch.setattr('socket_handlers.connect_to_database', mock_connect_to_database)
+    monkeypatch.setattr('chat_routes.database_connection', mock_database_connection)
+    monkeypatch.setattr('agent_routes.database_connection', mock_database_connection)
+    monkeypatch.setattr('user_routes.database_connection', mock_database_connection)
+    monkeypatch.setattr('team_routes.database_connection', mock_database_connection)
+    monkeypatch.setattr('agent_cache.database_connection', mock_database_connection)
+    monkeypatch.setattr('speaker_selection.database_connection', mock_database_connection)
+    monkeypatch.setattr('llm_usage.database_connection', mock_database_connection)
     
     #return both mock cursor and conn
     return mock_conn, mock_cursor
@@ -65,9 +74,12 @@ def mock_autogen(monkeypatch):
     def mock_group_chat_manager(**kwargs):
         return MagicMock()
 
-    # Replace autogen objects with mocks
-    monkeypatch.setattr('chat_routes.user_proxy', mock_user_proxy)
-    monkeypatch.setattr('chat_routes.agent_one', mock_assistant_agent)
+    # Replace autogen objects with mocks - the pools hand out the mock agents
+    monkeypatch.setattr('chat_routes.chat_agent_pool', AgentPool(lambda: (mock_user_proxy, mock_agent)))
+    # Fresh caches so teams built by one test are not reused by the next
+    monkeypatch.setattr('chat_routes.agent_configs', AgentConfigCache())
+    monkeypatch.setattr('chat_routes.team_cache', TeamCache())
+    monkeypatch.setattr('chat_routes.create_user_proxy', lambda: mock_user_proxy)
     monkeypatch.setattr('autogen.AssistantAgent', mock_assistant_agent)
     monkeypatch.setattr('autogen.GroupChat', mock_group_chat)
     monkeypatch.setattr('autogen.GroupChatManager', mock_group_chat_manager)
@@ -93,8 +105,8 @@ def test_chat_endpoint(client, mock_autogen):
 
     # Verify mocks were called correctly (once)
     mock_user_proxy.initiate_chat.assert_called_once()
-    # Assert the  clear method was called once - after chat completion
-    mock_user_proxy.chat_messages.clear.assert_called_once()
+    # Assert the proxy was reset once - after chat completion, before going back to the pool
+    mock_user_proxy.reset.assert_called_once()
 
 
 
@@ -105,9 +117,9 @@ def test_chat_team_endpoint(client, mock_db_connection, mock_autogen):
     
     # Set up the mock to return test data
     mock_cursor.fetchall.return_value = [
-        ('AI Specialist', 'You are an AI expert'),
-        ('Programming Expert', 'You are an coding expert'),
-        ('Marketing Manager', 'You are a marketing manager') 
+        (1, 'AI Specialist', 'You are an AI expert', 0.0),
+        (2, 'Programming Expert', 'You are an coding expert', 0.0),
+        (3, 'Marketing Manager', 'You are a marketing manager', 0.0) 
     ]
 
     #Mock client POST request
@@ -129,8 +141,94 @@ def test_chat_team_endpoint(client, mock_db_connection, mock_autogen):
     mock_cursor.execute.assert_called()
      # Verify mocks were called correctly (once)
     mock_user_proxy.initiate_chat.assert_called_once()
-    # Assert the  clear method was called once - after chat completion
-    mock_user_proxy.chat_messages.clear.assert_called_once()
+    # Assert the proxy was reset once - after chat completion, before the team goes back to the cache
+    mock_user_proxy.reset.assert_called_once()
+
+def test_chat_team_reuses_cached_team(client, mock_db_connection, mock_autogen):
+    #A second message to the same team uses the cached agent configs and the prebuilt team
+    mock_conn, mock_cursor = mock_db_connection
+    mock_user_proxy, mock_agent = mock_autogen
+    mock_cursor.fetchall.return_value = [
+        (1, 'AI Specialist', 'You are an AI expert', 0.0),
+        (2, 'Programming Expert', 'You are an coding expert', 0.0),
+        (3, 'Marketing Manager', 'You are a marketing manager', 0.0) 
+    ]
+    payload = json.dumps({'message': 'Test team message', 'agentOne': '1', 'agentTwo': '2', 'agentThree': '3'})
+
+    for _ in range(2):
+        response = client.post('/chat_team', data=payload, content_type='application/json')
+        assert response.status_code == 200
+
+    # The agents and the team's speaker selection were only read from the database for the first message
+    queries = [call.args[0] for call in mock_cursor.execute.call_args_list]
+    assert len([query for query in queries if 'FROM agentdata' in query]) == 1
+    assert len([query for query in queries if 'FROM agentteams' in query]) == 1
+    stats = chat_routes.team_cache.stats()
+    assert stats['built'] == 1
+    assert stats['reused'] == 1
+
+def test_team_cache_drops_teams_checked_out_before_invalidate():
+    #A team in use when the agents change is not put back in the cache
+    cache = TeamCache()
+    build = lambda: {"user_proxy": MagicMock(), "agents": [MagicMock()], "groupchat": MagicMock(), "manager": MagicMock()}
+
+    with cache.checkout(("rest", "1", "2", "3"), build):
+        cache.invalidate()
+    with cache.checkout(("rest", "1", "2", "3"), build):
+        pass
+
+    assert cache.stats()['built'] == 2
+    assert cache.stats()['reused'] == 0
+
+def test_chat_team_parallel_mode(client, mock_db_connection, mock_autogen):
+    #In parallel mode each agent answers once and the answers are combined - no group chat is run
+    mock_conn, mock_cursor = mock_db_connection
+    mock_user_proxy, mock_agent = mock_autogen
+    mock_agent.name = 'Specialist'
+    mock_agent.generate_reply.return_value = 'An answer'
+    mock_cursor.fetchall.return_value = [
+        (1, 'AI Specialist', 'You are an AI expert', 0.0),
+        (2, 'Programming Expert', 'You are an coding expert', 0.0),
+        (3, 'Marketing Manager', 'You are a marketing manager', 0.0) 
+    ]
+
+    response = client.post('/chat_team',
+                          data=json.dumps({
+                              'message': 'Should we rewrite the parser?',
+                              'agentOne': '1',
+                              'agentTwo': '2',
+                              'agentThree': '3',
+                              'mode': 'parallel'
+                          }),
+                          content_type='application/json')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    # Three answers and the combined answer
+    assert len(data['response']) == 4
+    assert mock_agent.generate_reply.call_count == 4
+    mock_user_proxy.initiate_chat.assert_not_called()
+
+def test_parallel_answers_run_concurrently():
+    #The agents are asked at the same time, and an agent that fails does not lose the other answers
+    from parallel_team import answer_in_parallel
+    barrier = threading.Barrier(2, timeout=5)
+
+    def make_agent(name, fail=False):
+        agent = MagicMock()
+        agent.name = name
+        def generate_reply(messages, sender):
+            if fail:
+                raise RuntimeError("model error")
+            # Both agents must be answering at once to get past the barrier
+            barrier.wait()
+            return {'content': f'{name} answer'}
+        agent.generate_reply.side_effect = generate_reply
+        return agent
+
+    answers = answer_in_parallel([make_agent('One'), make_agent('Two'), make_agent('Three', fail=True)], 'Question', MagicMock())
+
+    assert answers == [('One', 'One answer'), ('Two', 'Two answer')]
 
 def test_get_previous_chat(client, mock_db_connection):
     #Test the /get_previous_chat endpoint
@@ -151,6 +249,24 @@ def test_get_previous_chat(client, mock_db_connection):
     # Verify database was queried properly
     mock_cursor.execute.assert_called_once()
 
+def test_get_previous_chat_range(client, mock_db_connection):
+    #A chunked chat returns only the requested messages
+    from chat_storage import encode_chat
+    mock_conn, mock_cursor = mock_db_connection
+    header, chunks = encode_chat(['<p>one</p>', '<p>two</p>', '<p>three</p>'])
+    mock_cursor.fetchone.return_value = [header]
+    mock_cursor.fetchall.return_value = [(chunks[1],), (chunks[2],)]
+
+    response = client.post('/get_previous_chat',
+                          data=json.dumps({'chatName': 7, 'start': 1, 'limit': 5}),
+                          content_type='application/json')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data == {'message': ['<p>two</p>', '<p>three</p>'], 'start': 1, 'total': 3}
+    # The chunk query is limited to the range that exists
+    assert mock_cursor.execute.call_args[0][1] == (7, 1, 3)
+
 def test_get_previous_chat_not_found(client, mock_db_connection):
     #Test the /get_previous_chat endpoit when chat is not found
     mock_conn, mock_cursor = mock_db_connection
@@ -184,9 +300,85 @@ def test_gather_previous_chat_names(client, mock_db_connection):
     assert response.status_code == 200
     data = json.loads(response.data)
     assert 'message' in data
+    # Without a cursor or limit the whole list is returned, as before paging
+    assert len(data['message']) == 2
+    assert data['next_cursor'] is None
     
     # Verify database was queried properly
     mock_cursor.execute.assert_called_once()
+    assert mock_cursor.execute.call_args[0][1] == ('test@ncirl.ie', None)
+
+def test_gather_previous_chat_names_paginated(client, mock_db_connection):
+    #A full page returns the chatid to pass as the cursor for the next one
+    mock_conn, mock_cursor = mock_db_connection
+    # The query asks for one row more than the page to know if there is another page
+    mock_cursor.fetchall.return_value = [('Chat 1', 1), ('Chat 2', 2), ('Chat 3', 3)]
+
+    response = client.post('/gather_previous_chat_names',
+                          data=json.dumps({'email': 'test@ncirl.ie', 'cursor': 0, 'limit': 2}),
+                          content_type='application/json')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['message'] == [[['Chat 1'], [1]], [['Chat 2'], [2]]]
+    assert data['next_cursor'] == 2
+    assert mock_cursor.execute.call_args[0][1] == ('test@ncirl.ie', 0, 3)
+
+def test_gather_previous_chat_names_cursor_without_limit(client, mock_db_connection):
+    #A cursor alone pages at the default page size
+    from config import LIST_PAGE_SIZE
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = []
+
+    response = client.post('/gather_previous_chat_names',
+                          data=json.dumps({'email': 'test@ncirl.ie', 'cursor': 5}),
+                          content_type='application/json')
+
+    assert response.status_code == 200
+    assert mock_cursor.execute.call_args[0][1] == ('test@ncirl.ie', 5, LIST_PAGE_SIZE + 1)
+
+def test_count_previous_chats(client, mock_db_connection):
+    #Test the /count_previous_chats endpoint
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (1200,)
+
+    response = client.post('/count_previous_chats',
+                          data=json.dumps({'email': 'test@ncirl.ie'}),
+                          content_type='application/json')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)['message'] == 1200
+    mock_cursor.fetchall.assert_not_called()
+
+def test_search_chats(client, mock_db_connection):
+    #Compressed chats get their snippet from their messages, older chats from ts_headline
+    from chat_storage import encode_chat
+    mock_conn, mock_cursor = mock_db_connection
+    header, chunks = encode_chat(['<p>The connection pool was exhausted</p>'])
+    #ts_headline works on tag-stripped text, an unclosed tag in the chat is left in its output
+    headline = 'old <b>pool</b> notes <img src=x onerror=alert(1)'
+    mock_cursor.fetchall.side_effect = [
+        [(2, 'Pool chat', 0.5, None, header), (1, 'Old chat', 0.1, headline, None)],
+        [(2, chunks[0])],
+    ]
+
+    response = client.post('/search_chats',
+                          data=json.dumps({'email': 'test@ncirl.ie', 'query': 'pool'}),
+                          content_type='application/json')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [chat['chatid'] for chat in data['message']] == [2, 1]
+    assert '<b>pool</b>' in data['message'][0]['snippet']
+    assert data['message'][1]['snippet'] == 'old <b>pool</b> notes &lt;img src=x onerror=alert(1)'
+    assert data['next_cursor'] is None
+
+def test_search_chats_requires_query(client, mock_db_connection):
+    response = client.post('/search_chats',
+                          data=json.dumps({'email': 'test@ncirl.ie', 'query': ' '}),
+                          content_type='application/json')
+
+    assert response.status_code == 400
 
 def test_store_chat(client, mock_db_connection):
     #Test the /store_chat endpoint
@@ -228,6 +420,68 @@ def test_delete_chat(client, mock_db_connection):
     mock_cursor.execute.assert_called_once()
     mock_conn.commit.assert_called_once()
 
+def test_chat_endpoint_async(client, mock_autogen):
+    #Test the /chat endpoint in async mode - returns a job id which is polled for the result
+    mock_user_proxy, mock_agent = mock_autogen
+
+    response = client.post('/chat',
+                             data=json.dumps({'message': 'Test message', 'async': True}),
+                             content_type='application/json')
+
+    # Verify the job was accepted
+    assert response.status_code == 202
+    job_id = json.loads(response.data)['job_id']
+
+    # Wait for the worker to finish the job
+    chat_jobs.get(job_id).future.result(timeout=5)
+
+    response = client.post('/chat_job_status',
+                             data=json.dumps({'jobId': job_id}),
+                             content_type='application/json')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['message']['status'] == 'completed'
+    assert 'response' in data['message']
+    mock_user_proxy.initiate_chat.assert_called_once()
+
+def test_agent_pool_isolates_concurrent_checkouts():
+    #Two requests at the same time get different agents, which are reset and reused afterwards
+    pool = AgentPool(lambda: (MagicMock(), MagicMock()), max_idle=2)
+
+    with pool.checkout() as first:
+        with pool.checkout() as second:
+            assert first is not second
+    with pool.checkout() as third:
+        assert third in (first, second)
+
+    first[0].reset.assert_called()
+    assert pool.stats()['created'] == 2
+    assert pool.stats()['reused'] == 1
+
+def test_chat_job_status_not_found(client):
+    #Test the /chat_job_status endpoint with an unknown job id
+    response = client.post('/chat_job_status',
+                             data=json.dumps({'jobId': 'missing'}),
+                             content_type='application/json')
+
+    assert response.status_code == 404
+
+def test_cancel_queued_chat_job():
+    #A job cancelled before a worker picks it up never runs
+    manager = JobManager(max_workers=1)
+    release = threading.Event()
+    #Occupy the only worker so the second job stays queued
+    manager.submit('chat', release.wait)
+    job_function = MagicMock()
+    job = manager.submit('chat', job_function)
+
+    assert manager.cancel(job.job_id)
+    release.set()
+    manager.shutdown()
+
+    assert job.status == 'cancelled'
+    job_function.assert_not_called()
+
 # =============== AGENT ROUTES TESTS ========================
 
 def test_create_agent(client, mock_db_connection):
@@ -439,6 +693,36 @@ def test_delete_user_failure(client, monkeypatch):
     data = json.loads(response.data)
     assert data['response'] == 'User Not Deleted'
 
+def test_purge_users(client, mock_db_connection):
+    #Test the /purge_users endpoint - every table is cleared for all the emails in one transaction
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.rowcount = 2
+
+    response = client.post('/purge_users',
+                          data=json.dumps({
+                              'emails': ['one@ncirl.ie', 'two@ncirl.ie']
+                          }),
+                          content_type='application/json')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['response']['users'] == 2
+    assert data['response']['deleted'] == {'chattable': 2, 'agentteams': 2, 'agentdata': 2, 'llmusage': 2, 'sessionmessages': 2, 'usertable': 2}
+    # One statement per table with the whole batch, and a single commit
+    assert mock_cursor.execute.call_count == 6
+    assert mock_cursor.execute.call_args[0][1] == (['one@ncirl.ie', 'two@ncirl.ie'],)
+    mock_conn.commit.assert_called_once()
+
+def test_delete_user_flow_failure_commits_nothing(mock_db_connection):
+    #If a delete fails part way through the transaction is not committed
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.rowcount = 1
+    mock_cursor.execute.side_effect = [None, None, Exception("agentdata delete failed")]
+
+    from user_routes import delete_user_flow
+    assert delete_user_flow('test@ncirl.ie') is None
+    mock_conn.commit.assert_not_called()
+
 # ==================== TEAM ROUTES TESTS ====================
 
 def test_store_team(client, mock_db_connection):
@@ -471,8 +755,8 @@ def test_gather_teams(client, mock_db_connection):
     
     # Set up return teams mock
     mock_cursor.fetchall.return_value = [
-        ('AI Team', 'A team of AI experts', '1', '2', '3'),
-        ('AI Team2', 'A team of AI experts2', '4', '5', '6'),
+        ('AI Team', 'A team of AI experts', '1', '2', '3', 1),
+        ('AI Team2', 'A team of AI experts2', '4', '5', '6', 2),
     ]
     
     response = client.post('/gather_teams', 
@@ -486,9 +770,43 @@ def test_gather_teams(client, mock_db_connection):
     data = json.loads(response.data)
     
     assert len(data['message']) == 2
+    # Last page - no cursor for another
+    assert data['next_cursor'] is None
     
     # Verify database was queried properly
     mock_cursor.execute.assert_called_once()
+    # Without a cursor or limit every team is returned
+    assert mock_cursor.execute.call_args[0][1] == ('test@ncirl.ie', None)
+
+def test_usage(client, mock_db_connection):
+    #Test the /usage endpoint returns the per user, agent and team rollups
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.side_effect = [
+        [('test@ncirl.ie', 4, 400, 40, 0.0014, 120, 0)],
+        [('1', 4, 400, 40, 0.0014, 120, 0)],
+        [('1,2,3', 4, 400, 40, 0.0014, 120, 0)],
+    ]
+
+    response = client.post('/usage',
+                          data=json.dumps({'email': 'test@ncirl.ie'}),
+                          content_type='application/json')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['message']['users'][0]['cost_usd'] == 0.0014
+    assert data['message']['agents'][0]['id'] == '1'
+    assert data['message']['teams'][0]['calls'] == 4
+
+def test_metrics(client):
+    #Test the /metrics endpoint serves the span histograms in the Prometheus text format
+    client.get('/session_stats')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'span_duration_seconds_count{span="http GET /session_stats"}' in text
+    assert '# TYPE db_pool_in_use gauge' in text
 
 def test_gather_teams_none_found(client, mock_db_connection):
     #test the /gather_teams endpoint when no teams are found
@@ -506,4 +824,83 @@ def test_gather_teams_none_found(client, mock_db_connection):
     # Verify response contains error message
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert "<div id='previous_chat_error'><h1 id='returned_data'>Error fetching chat data</h1><br /><h3 id='previous_chat_error_sub'>Please try again later</h3></div>" in data['message']
\ No newline at end of file
+    assert "<div id='previous_chat_error'><h1 id='returned_data'>Error fetching chat data</h1><br /><h3 id='previous_chat_error_sub'>Please try again later</h3></div>" in data['message']
+# ==================== SOCKET TESTS ====================
+
+def test_socket_stream_emits_reply_chunks():
+    #Test chunks printed by the OpenAI client are emitted as agent_message_delta events
+    mock_socket_io = MagicMock()
+    stream = SocketIOStream('session-1', mock_socket_io, 'MultiTalentAgent')
+
+    # Colour code printed before streaming starts - stays on the console
+    stream.print("\033[32m", end="")
+    stream.print("Hello", end="", flush=True)
+    stream.print(" world", end="", flush=True)
+
+    assert mock_socket_io.emit.call_count == 2
+    event, payload = mock_socket_io.emit.call_args_list[1].args
+    assert event == 'agent_message_delta'
+    assert payload == {'content': ' world', 'sender': 'MultiTalentAgent', 'index': 1}
+
+def test_websocket_proxy_logs_received_messages():
+    #Messages received by the proxy are logged and emitted with their index
+    mock_socket_io = MagicMock()
+    mock_log = MagicMock()
+    mock_log.append.return_value = 4
+    user_proxy = WebSocketUserProxy('session-1', mock_socket_io, message_log=mock_log, name="User_Proxy",
+                                    human_input_mode="NEVER", code_execution_config=False, llm_config=False)
+    sender = MagicMock()
+    sender.name = 'MultiTalentAgent'
+
+    user_proxy.receive("Hello", sender, request_reply=False)
+
+    mock_log.append.assert_called_once_with('session-1', 'MultiTalentAgent', 'Hello')
+    mock_socket_io.emit.assert_called_once_with('agent_message', {'content': 'Hello', 'index': 4}, room='session-1')
+
+def test_code_executor_stats(client, monkeypatch):
+    #Test the /code_executor_stats endpoint reports the executor pool
+    monkeypatch.setattr('app.get_code_executor_stats', lambda: {"enabled": True, "executions": 3})
+    response = client.get('/code_executor_stats')
+
+    assert response.status_code == 200
+    assert response.get_json()["message"]["executions"] == 3
+
+def test_workspace_snapshot(client, monkeypatch, tmp_path):
+    #Test /workspace_snapshot returns the session's files to the session's owner and 404 for an unknown session
+    import io, tarfile
+    from workspaces import WorkspaceManager
+    from session_tokens import issue_token
+    manager = WorkspaceManager(root=str(tmp_path), reaper_interval=0)
+    monkeypatch.setattr('workspace_routes.workspace_manager', manager)
+    with open(f"{manager.path('sid-1')}/app.py", "w") as f:
+        f.write("print('hi')")
+
+    response = client.post('/workspace_snapshot', json={"sessionToken": issue_token("sid-1")})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    with tarfile.open(fileobj=io.BytesIO(response.data)) as tar:
+        assert "workspace/app.py" in tar.getnames()
+
+    assert client.post('/workspace_snapshot', json={"sessionToken": issue_token("other")}).status_code == 404
+    #Knowing the session id is not enough
+    assert client.post('/workspace_snapshot', json={"sessionId": "sid-1"}).status_code == 400
+    assert client.post('/workspace_snapshot', json={"sessionToken": "sid-1.forged"}).status_code == 403
+    assert client.post('/workspace_snapshot', json={"sessionToken": issue_token("..")}).status_code == 404
+
+def test_chat_endpoint_busy(client, mock_autogen, monkeypatch):
+    #Test /chat answers 503 when no conversation slot frees up in time
+    from async_runtime import ConversationLimiter
+    limiter = ConversationLimiter(max_active=1, wait_timeout=0.01)
+    monkeypatch.setattr('chat_routes.conversation_limiter', limiter)
+    with limiter.slot():
+        response = client.post('/chat', json={'message': 'Test message'})
+    assert response.status_code == 503
+    assert client.post('/chat', json={'message': 'Test message'}).status_code == 200
+
+def test_runtime_stats(client):
+    #Test the /runtime_stats endpoint reports the worker model
+    response = client.get('/runtime_stats')
+    assert response.status_code == 200
+    assert response.get_json()["message"]["mode"] == "threading"
+    #A single node - no message queue configured
+    assert response.get_json()["message"]["message_queue"] is None
@@ -0,0 +1,69 @@
+# test_execution_cache.py
+from autogen.coding.base import CodeBlock
+from execution_cache import ExecutionCache, is_non_deterministic, workspace_digest
+
+def test_non_deterministic_code_is_detected():
+    assert is_non_deterministic("import random\nprint(random.random())", "python")
+    assert is_non_deterministic("from datetime import datetime\nprint(datetime.now())", "python")
+    assert is_non_deterministic("import requests\nrequests.get('http://localhost')", "python")
+    assert is_non_deterministic("name = input('name?')", "python")
+    assert is_non_deterministic("print(1)  # nocache", "python")
+    assert is_non_deterministic("curl http://localhost:5000", "bash")
+    assert not is_non_deterministic("from datetime import date\nprint(date(2024, 1, 1))", "python")
+    assert not is_non_deterministic("import json\nprint(json.dumps({}))", "python")
+    assert not is_non_deterministic("ls -la", "sh")
+
+def test_every_import_is_checked():
+    #Comma separated, aliased, nested and dynamic imports
+    assert is_non_deterministic("import os, random\nprint(random.random())", "python")
+    assert is_non_deterministic("import sys, time\nprint(time.time())", "python")
+    assert is_non_deterministic("import random as r\nprint(r.random())", "python")
+    assert is_non_deterministic("import numpy.random as npr\nprint(npr.rand())", "python")
+    assert is_non_deterministic("from os import urandom\nprint(urandom(4))", "python")
+    assert is_non_deterministic("def main():\n    from uuid import uuid4\n    return uuid4()", "python")
+    assert is_non_deterministic("rng = __import__('random')", "python")
+    assert is_non_deterministic("from datetime import datetime as dt\nprint(dt.now())", "python")
+    #Code that does not parse can not be checked
+    assert is_non_deterministic("print(", "python")
+    assert not is_non_deterministic("import os, sys, json\nprint(os.sep, json.dumps(sys.argv))", "python")
+    assert not is_non_deterministic("import datetime as dt\nprint(dt.date(2024, 1, 1))", "python")
+
+def test_key_depends_on_code_and_workspace_files(tmp_path):
+    cache = ExecutionCache()
+    blocks = [CodeBlock(code="print(open('data.txt').read())", language="python")]
+    (tmp_path / "data.txt").write_text("one")
+    key = cache.key(blocks, tmp_path, "PooledCodeExecutor")
+    assert key == cache.key(blocks, tmp_path, "PooledCodeExecutor")
+    assert key != cache.key(blocks, tmp_path, "LocalCodeExecutor")
+    assert key != cache.key([CodeBlock(code="print(2)", language="python")], tmp_path, "PooledCodeExecutor")
+
+    (tmp_path / "data.txt").write_text("two")
+    assert key != cache.key(blocks, tmp_path, "PooledCodeExecutor")
+
+    assert cache.key([CodeBlock(code="import random", language="python")], tmp_path, "PooledCodeExecutor") is None
+    assert cache.stats()["skipped"] == 1
+
+def test_blocks_own_code_files_and_pycache_are_ignored(tmp_path):
+    before = workspace_digest(tmp_path, {"app.py"})
+    (tmp_path / "app.py").write_text("print(1)")
+    (tmp_path / "__pycache__").mkdir()
+    (tmp_path / "__pycache__" / "app.cpython-311.pyc").write_bytes(b"\0")
+    assert workspace_digest(tmp_path, {"app.py"}) == before
+    assert workspace_digest(tmp_path) != before
+
+def test_least_recently_used_results_are_evicted():
+    cache = ExecutionCache(max_entries=2, max_bytes=10)
+    cache.set("a", 0, "aaaa")
+    cache.set("b", 0, "bbbb")
+    assert cache.get("a") == (0, "aaaa", None)
+    cache.set("c", 1, "cccc")
+    #b was least recently used
+    assert cache.get("b") is None
+    assert cache.stats()["entries"] == 2
+
+    #Over max_bytes of output
+    cache.set("d", 0, "dddddddd")
+    assert cache.stats()["bytes"] <= 10
+    #Larger than the whole cache - not stored
+    cache.set("e", 0, "e" * 11)
+    assert cache.get("e") is None
@@ -0,0 +1,66 @@
+import json
+from llm_cache import ResponseCache, MemoryCacheBackend, SQLiteCacheBackend
+
+# Build the JSON key autogen passes to the cache for a request
+def make_key(content, temperature=0.0, stream=False):
+    return json.dumps({
+        "model": "gpt-4o",
+        "temperature": temperature,
+        "stream": stream,
+        "messages": [
+            {"role": "system", "content": "You are a helpful AI assistant."},
+            {"role": "user", "content": content},
+        ],
+    }, sort_keys=True)
+
+def test_deterministic_request_is_cached():
+    cache = ResponseCache(MemoryCacheBackend())
+
+    assert cache.get(make_key("Hello")) is None
+    cache.set(make_key("Hello"), "cached reply")
+
+    # Surrounding whitespace and streaming do not change the key
+    assert cache.get(make_key("  Hello \n", stream=True)) == "cached reply"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_indentation_and_line_breaks_change_the_key():
+    cache = ResponseCache(MemoryCacheBackend())
+    cache.set(make_key("Fix this:\nif x:\n    f()\ng()"), "fix for g outside the if")
+
+    assert cache.get(make_key("Fix this:\nif x:\n    f()\n    g()")) is None
+    assert cache.get(make_key("Fix this: if x: f() g()")) is None
+    # Line endings and trailing spaces are normalised
+    assert cache.get(make_key("Fix this:  \r\nif x:\r\n    f()\r\ng()")) == "fix for g outside the if"
+
+def test_non_deterministic_request_is_skipped():
+    cache = ResponseCache(MemoryCacheBackend())
+
+    cache.set(make_key("Hello", temperature=0.5), "cached reply")
+
+    assert cache.get(make_key("Hello", temperature=0.5)) is None
+    assert cache.stats()["skipped"] == 1
+    assert cache.stats()["entries"] == 0
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    # Use a so b becomes the least recently used
+    backend.get("a")
+    backend.set("c", 3)
+
+    assert backend.get("b") is None
+    assert backend.get("a") == 1
+
+def test_memory_backend_expires_entries():
+    backend = MemoryCacheBackend(ttl=-1)
+    backend.set("a", 1)
+
+    assert backend.get("a") is None
+
+def test_sqlite_backend_round_trip(tmp_path):
+    cache = ResponseCache(SQLiteCacheBackend(str(tmp_path / "llm_cache.db")))
+    cache.set(make_key("Hello"), {"content": "cached reply"})
+
+    assert cache.get(make_key("Hello")) == {"content": "cached reply"}
@@ -0,0 +1,48 @@
+# test_llm_gateway.py
+import copy
+import threading
+import pytest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from llm_gateway import LLMGateway
+
+class OkHandler(BaseHTTPRequestHandler):
+    #Keep-alive server standing in for the OpenAI API
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = HTTPServer(("127.0.0.1", 0), OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+
+def test_requests_reuse_pooled_connection(server):
+    gateway = LLMGateway(http2=False)
+    for _ in range(3):
+        gateway.http_client.get(server)
+
+    stats = gateway.stats()
+    assert stats["requests"] == 3
+    assert stats["connections_opened"] == 1
+    assert stats["connection_reuse_rate"] == 0.667
+    gateway.close()
+
+def test_install_shares_client_across_copied_configs():
+    #Autogen deep copies each agent's llm_config - every copy must keep the one pooled client
+    gateway = LLMGateway(http2=False, api_key="sk-test")
+    llm_config = gateway.install({"config_list": [{"model": "gpt-4o", "api_key": "sk-test"}], "temperature": 0})
+
+    copied = copy.deepcopy({**llm_config, "temperature": 0.5})
+
+    assert copied["config_list"][0]["http_client"] is gateway.http_client
+    assert gateway.async_client() is gateway.async_client()
+    gateway.close()
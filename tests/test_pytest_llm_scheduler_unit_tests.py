@@ -0,0 +1,161 @@
+# test_llm_scheduler.py
+import json
+import threading
+import time
+import pytest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from llm_gateway import LLMGateway
+from llm_scheduler import (
+    RequestScheduler, TokenBucket, requester, bind_requester, estimate_request_tokens, _retry_after, _requester,
+    INTERACTIVE, BATCH,
+)
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    #Stands in for the chat completions API - reports 120 tokens used
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"choices": [], "usage": {"total_tokens": 120}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = HTTPServer(("127.0.0.1", 0), CompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+
+class FakeResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+def wait_for_waiting(scheduler, count):
+    deadline = time.monotonic() + 2
+    while len(scheduler._waiting) < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+def acquire_in_thread(scheduler, order, user, priority):
+    def run():
+        scheduler.acquire(10, user, priority)
+        order.append(user)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(60)
+    bucket.level = 0
+    bucket.refill(bucket.updated + 2)
+    assert bucket.level == pytest.approx(2)
+    assert bucket.wait_time(5) == pytest.approx(3)
+
+def test_acquire_is_immediate_under_the_limits():
+    scheduler = RequestScheduler(rpm=100, tpm=1000)
+    assert scheduler.acquire(100) < 0.05
+    stats = scheduler.stats()
+    assert stats["granted"] == 1
+    assert stats["tokens_available"] == 900
+
+def test_acquire_waits_for_the_token_bucket():
+    #600 tokens a minute refills 10 a second - 5 more tokens than are left take about half a second
+    scheduler = RequestScheduler(rpm=100, tpm=600)
+    scheduler.tokens.level = 0
+    waited = scheduler.acquire(5)
+    assert 0.4 <= waited < 1.0
+
+def test_interactive_requests_go_before_batch():
+    scheduler = RequestScheduler(rpm=600, tpm=100000)
+    scheduler.requests.level = 0
+    order = []
+    batch = acquire_in_thread(scheduler, order, "batch", BATCH)
+    wait_for_waiting(scheduler, 1)
+    interactive = acquire_in_thread(scheduler, order, "interactive", INTERACTIVE)
+    wait_for_waiting(scheduler, 2)
+    batch.join(2)
+    interactive.join(2)
+    assert order == ["interactive", "batch"]
+
+def test_fair_share_serves_the_lighter_user_first():
+    scheduler = RequestScheduler(rpm=600, tpm=100000)
+    scheduler.acquire(5000, "heavy")
+    scheduler.requests.level = 0
+    order = []
+    heavy = acquire_in_thread(scheduler, order, "heavy", BATCH)
+    wait_for_waiting(scheduler, 1)
+    light = acquire_in_thread(scheduler, order, "light", BATCH)
+    wait_for_waiting(scheduler, 2)
+    heavy.join(2)
+    light.join(2)
+    assert order == ["light", "heavy"]
+
+def test_max_wait_lets_the_request_through():
+    scheduler = RequestScheduler(rpm=1, tpm=100000, max_wait=0.1)
+    scheduler.requests.level = 0
+    waited = scheduler.acquire(10)
+    assert 0.1 <= waited < 0.5
+    assert scheduler.stats()["wait_timeouts"] == 1
+
+def test_max_wait_is_waited_out_when_the_wait_would_be_longer():
+    #The second request needs about 48s of refill - it is held for max_wait, not sent at once
+    scheduler = RequestScheduler(rpm=100, tpm=1000, max_wait=0.3)
+    scheduler.acquire(900)
+    assert scheduler.acquire(900) >= 0.3
+    assert scheduler.stats()["wait_timeouts"] == 1
+
+    #A 429 resetting after longer than max_wait holds requests for max_wait too
+    scheduler = RequestScheduler(rpm=100, tpm=100000, max_wait=0.3)
+    scheduler.pause(600)
+    assert scheduler.acquire(10) >= 0.3
+
+def test_429_pauses_requests_for_retry_after():
+    scheduler = RequestScheduler(rpm=100, tpm=100000)
+    scheduler.after_response(FakeResponse(429, {"retry-after": "0.3"}))
+    waited = scheduler.acquire(10)
+    assert waited >= 0.25
+    assert scheduler.stats()["throttled_429"] == 1
+
+def test_retry_after_reads_openai_reset_headers():
+    assert _retry_after({"retry-after": "2"}) == 2.0
+    assert _retry_after({"x-ratelimit-reset-tokens": "1m30s"}) == 90.0
+    assert _retry_after({"x-ratelimit-reset-requests": "120ms"}) == pytest.approx(0.12)
+    assert _retry_after({}) == 1.0
+
+def test_adjust_corrects_the_estimate():
+    scheduler = RequestScheduler(rpm=100, tpm=1000)
+    scheduler.acquire(600)
+    scheduler.adjust(600, 150)
+    assert scheduler.stats()["tokens_available"] == 850
+
+def test_estimate_counts_prompt_and_completion():
+    body = {"messages": [{"role": "user", "content": "x" * 400}], "max_tokens": 50}
+    assert estimate_request_tokens(body) == 100 + 4 + 50
+    assert estimate_request_tokens({"messages": []}, completion_estimate=300) == 300
+
+def test_requester_context_and_bound_functions():
+    assert _requester.get()[0] == "anonymous"
+    with requester("user@example.com", INTERACTIVE):
+        assert _requester.get() == ("user@example.com", INTERACTIVE)
+    assert bind_requester(_requester.get, "batch@example.com", BATCH)() == ("batch@example.com", BATCH)
+    assert _requester.get()[0] == "anonymous"
+
+def test_gateway_requests_are_scheduled_and_corrected_from_usage(server):
+    scheduler = RequestScheduler(rpm=100, tpm=10000, completion_estimate=500)
+    gateway = LLMGateway(http2=False, scheduler=scheduler)
+    with requester("user@example.com", INTERACTIVE):
+        gateway.http_client.post(server, json={"messages": [{"role": "user", "content": "hello"}]})
+
+    stats = scheduler.stats()
+    assert stats["granted"] == 1
+    #Estimated 1 + 4 prompt tokens and 500 completion tokens, corrected to the 120 the response used
+    assert stats["tokens_available"] == 10000 - 120
+    assert "user@example.com" in scheduler._usage
+    gateway.close()
@@ -0,0 +1,161 @@
+# test_llm_usage.py
+import json
+import threading
+import pytest
+from contextlib import contextmanager
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest.mock import MagicMock
+from llm_gateway import LLMGateway
+from llm_scheduler import requester
+from llm_usage import UsageRecorder, usage_scope, track_agent, call_cost, usage_rollups
+
+PRICES = {"gpt-4o": [2.5, 10.0], "gpt-4o-mini": [0.15, 0.6]}
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    #Stands in for the chat completions API - json replies report their usage, streamed replies only when asked
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if request.get("stream"):
+            chunks = [{"model": "gpt-4o-2024-08-06", "choices": [{"index": 0, "delta": {"content": "y" * 40}}]}]
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage = {"prompt_tokens": 90, "completion_tokens": 12, "total_tokens": 102}
+                chunks.append({"model": "gpt-4o-2024-08-06", "choices": [], "usage": usage})
+            body = b"".join(b"data: " + json.dumps(chunk).encode() + b"\n\n" for chunk in chunks) + b"data: [DONE]\n\n"
+            content_type = "text/event-stream"
+        else:
+            usage = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+            body, content_type = json.dumps({"model": "gpt-4o-2024-08-06", "usage": usage}).encode(), "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = HTTPServer(("127.0.0.1", 0), CompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    server.shutdown()
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+
+    @contextmanager
+    def mock_database_connection():
+        yield mock_conn
+
+    monkeypatch.setattr('llm_usage.database_connection', mock_database_connection)
+    return mock_conn, mock_cursor
+
+def test_call_cost_uses_longest_model_prefix():
+    assert call_cost("gpt-4o-2024-08-06", 1000000, 1000000, PRICES) == pytest.approx(12.5)
+    assert call_cost("gpt-4o-mini-2024-07-18", 1000000, 0, PRICES) == pytest.approx(0.15)
+    assert call_cost("unknown-model", 1000, 1000, PRICES) == 0.0
+
+def test_record_totals_calls_per_user_and_agent():
+    recorder = UsageRecorder(flush_interval=0, prices=PRICES)
+    with requester("user@example.com"), usage_scope(session="s1", team="1,2,3"):
+        with usage_scope(agent="1"):
+            recorder.record("gpt-4o", 100, 10, 200)
+            recorder.record("gpt-4o", 50, 5, 100)
+        with usage_scope(agent="manager"):
+            recorder.record("gpt-4o", 10, 1, 50)
+
+    assert recorder._pending[("user@example.com", "s1", "1,2,3", "1", "gpt-4o")][:3] == [2, 150, 15]
+    assert recorder._pending[("user@example.com", "s1", "1,2,3", "manager", "gpt-4o")][0] == 1
+    stats = recorder.stats()
+    assert stats["calls"] == 3
+    assert stats["prompt_tokens"] == 160
+    assert stats["pending_rows"] == 2
+
+def test_track_agent_attributes_replies():
+    recorder = UsageRecorder(flush_interval=0, prices=PRICES)
+
+    class Agent:
+        def generate_reply(self, messages=None, sender=None):
+            recorder.record("gpt-4o", 10, 1, 5)
+            return "reply"
+
+    agent = track_agent(Agent(), "42")
+    assert track_agent(agent, "other") is agent
+    assert agent.generate_reply(messages=[]) == "reply"
+    assert ("anonymous", None, None, "42", "gpt-4o") in recorder._pending
+
+def test_flush_writes_one_row_per_total(mock_db, monkeypatch):
+    mock_conn, mock_cursor = mock_db
+    written = []
+    monkeypatch.setattr('llm_usage.execute_values', lambda cursor, query, rows: written.extend(rows))
+    recorder = UsageRecorder(flush_interval=0, prices=PRICES)
+    with usage_scope(agent="1"):
+        recorder.record("gpt-4o", 100, 10, 200)
+        recorder.record("gpt-4o", 100, 10, 200)
+
+    assert recorder.flush() == 1
+    assert written[0][1:] == ("anonymous", None, None, "1", "gpt-4o", 2, 200, 20, pytest.approx(0.0007), 400, 0)
+    mock_conn.commit.assert_called_once()
+    assert recorder.stats()["pending_rows"] == 0
+
+def test_failed_flush_keeps_the_totals(monkeypatch):
+    @contextmanager
+    def failing_connection():
+        raise RuntimeError("database down")
+        yield
+
+    monkeypatch.setattr('llm_usage.database_connection', failing_connection)
+    recorder = UsageRecorder(flush_interval=0, prices=PRICES)
+    recorder.record("gpt-4o", 100, 10, 200)
+    assert recorder.flush() == 0
+    recorder.record("gpt-4o", 100, 10, 200)
+    assert recorder._pending[("anonymous", None, None, "unknown", "gpt-4o")][0] == 2
+    assert recorder.stats()["failures"] == 1
+
+def test_usage_rollups_group_by_user_agent_and_team(mock_db):
+    mock_conn, mock_cursor = mock_db
+    mock_cursor.fetchall.side_effect = [
+        [("user@example.com", 3, 300, 30, 0.0011, 150, 0)],
+        [("1", 2, 200, 20, 0.0007, 200, 0), ("manager", 1, 100, 10, 0.0004, 50, 0)],
+        [(None, 1, 10, 1, 0.0001, 50, 0)],
+    ]
+    rollups = usage_rollups(email="user@example.com")
+
+    assert rollups["users"][0]["id"] == "user@example.com"
+    assert [agent["id"] for agent in rollups["agents"]] == ["1", "manager"]
+    #Calls outside a team chat are left out of the team rollup
+    assert rollups["teams"] == []
+    query, params = mock_cursor.execute.call_args_list[0][0]
+    assert "WHERE useremail = %s" in query
+    assert params == ["user@example.com"]
+
+def test_gateway_records_completions(server):
+    recorder = UsageRecorder(flush_interval=0, prices=PRICES)
+    gateway = LLMGateway(http2=False, usage=recorder)
+    messages = [{"role": "user", "content": "x" * 400}]
+    with requester("user@example.com"), usage_scope(agent="1"):
+        gateway.http_client.post(server, json={"model": "gpt-4o", "messages": messages})
+        gateway.http_client.post(server, json={"model": "gpt-4o", "messages": messages, "stream": True})
+
+    reported = recorder._pending[("user@example.com", None, None, "1", "gpt-4o-2024-08-06")]
+    assert reported[:3] == [1, 100, 20]
+    #Streamed replies without a usage chunk have their prompt and completion estimated and are flagged
+    streamed = recorder._pending[("user@example.com", None, None, "1", "gpt-4o")]
+    assert streamed[:3] == [1, 104, 10]
+    assert streamed[5] == 1
+
+    #With include_usage the last chunk's usage is recorded once the stream has been read
+    with requester("user@example.com"), usage_scope(agent="2"):
+        with gateway.http_client.stream("POST", server, json={"model": "gpt-4o", "messages": messages, "stream": True,
+                                                              "stream_options": {"include_usage": True}}) as response:
+            assert ("user@example.com", None, None, "2", "gpt-4o-2024-08-06") not in recorder._pending
+            response.read()
+    assert recorder._pending[("user@example.com", None, None, "2", "gpt-4o-2024-08-06")][:3] == [1, 90, 12]
+    assert recorder._pending[("user@example.com", None, None, "2", "gpt-4o-2024-08-06")][5] == 0
+    gateway.close()
@@ -0,0 +1,86 @@
+# test_message_log.py
+import pytest
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+from chat_storage import compress_chunk
+from message_log import MessageLog
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    #Mock pooled connection and the batched insert
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+
+    @contextmanager
+    def mock_database_connection():
+        yield mock_conn
+
+    mock_execute_values = MagicMock()
+    monkeypatch.setattr('message_log.database_connection', mock_database_connection)
+    monkeypatch.setattr('message_log.execute_values', mock_execute_values)
+    return mock_conn, mock_cursor, mock_execute_values
+
+def test_messages_are_written_in_batches(mock_db):
+    #Nothing is written until the batch is full, then the whole batch goes in one insert
+    mock_conn, mock_cursor, mock_execute_values = mock_db
+    log = MessageLog(batch_size=3, flush_interval=0)
+
+    assert [log.append('sid-1', 'user', 'hi'), log.append('sid-1', 'Agent', 'hello')] == [0, 1]
+    mock_execute_values.assert_not_called()
+
+    log.append('sid-2', 'user', 'other conversation')
+    mock_execute_values.assert_called_once()
+    rows = mock_execute_values.call_args[0][2]
+    assert [(row[0], row[1], row[2], row[4]) for row in rows] == [('sid-1', 0, 'user', None), ('sid-1', 1, 'Agent', None), ('sid-2', 0, 'user', None)]
+    mock_conn.commit.assert_called_once()
+    assert log.stats()['written'] == 3
+
+def test_failed_write_keeps_messages_for_next_flush(mock_db):
+    mock_conn, mock_cursor, mock_execute_values = mock_db
+    mock_execute_values.side_effect = [Exception("database down"), None]
+    log = MessageLog(batch_size=10, flush_interval=0)
+    log.append('sid-1', 'user', 'hi')
+
+    assert log.flush() == 0
+    assert log.stats()['pending'] == 1
+    assert log.flush() == 1
+    assert log.stats()['pending'] == 0
+
+def test_resumed_conversation_continues_numbering(mock_db):
+    #Loading a conversation returns its messages and the next message follows the last logged index
+    mock_conn, mock_cursor, mock_execute_values = mock_db
+    mock_cursor.fetchall.return_value = [(0, 'user', compress_chunk('"hi"')), (1, 'Agent', compress_chunk('"hello"'))]
+    log = MessageLog(batch_size=10, flush_interval=0)
+
+    assert log.load('old-sid') == [(0, 'user', 'hi'), (1, 'Agent', 'hello')]
+    assert log.append('old-sid', 'user', 'next question') == 2
+
+def test_messages_carry_their_owner_until_the_conversation_ends(mock_db):
+    mock_conn, mock_cursor, mock_execute_values = mock_db
+    log = MessageLog(batch_size=10, flush_interval=0)
+    log.set_owner('sid-1', 'user@example.com')
+    log.append('sid-1', 'user', 'hi')
+    log.append('sid-2', 'user', 'no email sent')
+    log.flush()
+    rows = mock_execute_values.call_args[0][2]
+    assert [(row[0], row[4]) for row in rows] == [('sid-1', 'user@example.com'), ('sid-2', None)]
+
+    #Ending a conversation forgets its counter and owner
+    log.end('sid-1')
+    log.end('sid-2')
+    assert log.stats()['conversations'] == 0
+    assert log._owners == {}
+
+def test_expire_deletes_messages_past_retention(mock_db):
+    mock_conn, mock_cursor, mock_execute_values = mock_db
+    mock_cursor.rowcount = 3
+    assert MessageLog(flush_interval=0, retention_days=0).expire() == 0
+    mock_cursor.execute.assert_not_called()
+
+    log = MessageLog(flush_interval=0, retention_days=7)
+    assert log.expire() == 3
+    query, params = mock_cursor.execute.call_args[0]
+    assert query.startswith("DELETE FROM sessionmessages WHERE createdat <")
+    assert params == (7,)
+    assert log.stats()['expired'] == 3
@@ -0,0 +1,24 @@
+# test_migrations.py
+from unittest.mock import MagicMock
+from migrations import run_migrations
+
+def test_run_migrations_applies_only_new_migrations():
+    #Migrations already recorded in schema_migrations are skipped
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [('001_first',)]
+    migrations = [
+        ('001_first', ["CREATE INDEX first_idx ON chattable (useremail)"]),
+        ('002_second', ["CREATE INDEX second_idx ON agentteams (useremail)"]),
+    ]
+
+    applied = run_migrations(mock_conn, migrations)
+
+    assert applied == ['002_second']
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    assert mock_conn.autocommit is True
+    statements = [call.args[0] for call in mock_cursor.execute.call_args_list]
+    assert "CREATE INDEX second_idx ON agentteams (useremail)" in statements
+    assert "CREATE INDEX first_idx ON chattable (useremail)" not in statements
+    assert mock_cursor.execute.call_args.args == ("INSERT INTO schema_migrations (name) VALUES (%s)", ('002_second',))
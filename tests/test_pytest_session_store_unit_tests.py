@@ -0,0 +1,65 @@
+from unittest.mock import MagicMock
+from session_store import SessionStore
+
+# Session shaped like the ones socket_handlers stores - agents with a chat history
+def make_session(content="Hello"):
+    agent = MagicMock()
+    agent.chat_messages = {"other_agent": [{"role": "user", "content": content}]}
+    return {"user_proxy": MagicMock(), "assistant": agent}
+
+def test_least_recently_used_session_evicted():
+    store = SessionStore(max_sessions=2, reaper_interval=0)
+    store["a"] = make_session()
+    store["b"] = make_session()
+    # Use a so b becomes the least recently used
+    store["a"]
+    store["c"] = make_session()
+
+    assert "b" not in store
+    assert "a" in store and "c" in store
+    assert store.stats()["evicted"] == 1
+
+def test_idle_sessions_reaped():
+    store = SessionStore(idle_ttl=-1, reaper_interval=0)
+    store["a"] = make_session()
+
+    assert store.reap() == 1
+    assert len(store) == 0
+
+def test_sessions_evicted_over_memory_limit():
+    store = SessionStore(max_memory=1000, reaper_interval=0)
+    store["a"] = make_session("x" * 600)
+    store["b"] = make_session("x" * 600)
+
+    assert "a" not in store
+    assert store.stats()["memory_bytes"] <= 1000
+
+def test_replaced_session_cleaned_up():
+    store = SessionStore(reaper_interval=0)
+    old = make_session()
+    store["a"] = old
+    store["a"] = make_session()
+
+    old["assistant"].reset.assert_called_once()
+
+def test_state_saved_to_backend():
+    backend = MagicMock()
+    store = SessionStore(reaper_interval=0, backend=backend)
+    store["a"] = make_session()
+    store.save_state("a", {"kind": "single", "messages": []})
+    del store["a"]
+
+    backend.save.assert_called_once_with("a", {"kind": "single", "messages": []})
+    backend.delete.assert_called_once_with("a")
+
+def test_discarded_session_keeps_saved_state():
+    backend = MagicMock()
+    store = SessionStore(reaper_interval=0, backend=backend)
+    session = make_session()
+    store["a"] = session
+    store.discard("a")
+    store.discard("missing")
+
+    assert "a" not in store
+    session["assistant"].reset.assert_called_once()
+    backend.delete.assert_not_called()
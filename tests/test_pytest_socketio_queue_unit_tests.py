@@ -0,0 +1,202 @@
+# test_socketio_queue.py
+import os
+import subprocess
+import sys
+import time
+import uuid
+from unittest.mock import MagicMock, patch
+import autogen
+import pytest
+import socketio
+from flask import Flask
+from flask_socketio import SocketIO
+import socket_handlers
+from config import ACTIVE_SESSIONS
+from socketio_queue import LocalPubSubManager, create_client_manager
+from session_tokens import issue_token, check_shared_secret
+
+#A node serving the socket events - without a queue, which Flask-SocketIO's test client does not support
+def make_node():
+    app = Flask(__name__)
+    socket_io = SocketIO(app, async_mode="threading")
+    socket_handlers.register_socket_handlers(socket_io)
+    return app, socket_io
+
+@pytest.fixture
+def channel():
+    return f"test-{uuid.uuid4().hex}"
+
+@pytest.fixture
+def no_message_log(monkeypatch):
+    monkeypatch.setattr(socket_handlers, "message_log", None)
+
+def test_client_manager_for_url():
+    assert create_client_manager(None) is None
+    assert create_client_manager("") is None
+    manager = create_client_manager("memory://", channel="nodes")
+    assert isinstance(manager, LocalPubSubManager)
+    assert manager.channel == "nodes"
+    manager.close()
+
+def test_emit_reaches_client_on_another_node(channel):
+    #Flask-SocketIO's test client can not run on a queue - the nodes are bare Socket.IO servers
+    node_one = socketio.Server(async_mode="threading", client_manager=LocalPubSubManager(channel=channel))
+    node_two = socketio.Server(async_mode="threading", client_manager=LocalPubSubManager(channel=channel))
+    sent = []
+    node_two._send_eio_packet = lambda eio_sid, packet: sent.append((eio_sid, packet.data))
+    #A client connected to node two
+    node_two._handle_eio_connect("client-eio", {})
+    sid = node_two.manager.connect("client-eio", "/")
+
+    #The reply is produced on node one
+    node_one.emit("agent_message", {"content": "Hello"}, room=sid)
+
+    deadline = time.monotonic() + 2
+    while not sent and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert sent and sent[0][0] == "client-eio"
+    assert '"agent_message"' in sent[0][1] and '"Hello"' in sent[0][1]
+    node_one.manager.close()
+    node_two.manager.close()
+
+def test_user_message_routed_by_session_token(no_message_log):
+    app, node = make_node()
+    client = node.test_client(app)
+    session_id = f"conversation-{uuid.uuid4().hex}"
+
+    with patch.object(autogen.AssistantAgent, "generate_reply", return_value="Hello"):
+        client.emit("user_message", {"message": "Hi", "sessionToken": issue_token(session_id)})
+
+    #Replies go to the conversation's room, which the socket joined
+    received = client.get_received()
+    assert any(event["name"] == "agent_message" for event in received)
+    assert any(event["name"] == "processing_status" and event["args"][0]["status"] == "completed_waiting_next"
+               for event in received)
+    session = ACTIVE_SESSIONS.get(session_id)
+    assert session is not None and session["version"] == 1
+
+    #The conversation outlives the socket, so disconnecting drops the agents but not the saved state
+    with patch.object(ACTIVE_SESSIONS, "backend", MagicMock()) as backend:
+        client.disconnect()
+    assert session_id not in ACTIVE_SESSIONS
+    backend.delete.assert_not_called()
+
+def test_session_continued_on_another_node_is_rebuilt(no_message_log):
+    app, node = make_node()
+    client = node.test_client(app)
+    session_id = f"conversation-{uuid.uuid4().hex}"
+    backend = MagicMock()
+    backend.load.return_value = None
+
+    with patch.object(ACTIVE_SESSIONS, "backend", backend), \
+         patch.object(autogen.AssistantAgent, "generate_reply", return_value="First reply"):
+        client.emit("user_message", {"message": "Hi", "sessionToken": issue_token(session_id)})
+        saved = backend.save.call_args.args[1]
+        assert saved["version"] == 1
+
+        #Another node answered two more messages since - its saved history replaces this node's
+        history = [{"role": "user", "content": f"Message {i}"} for i in range(4)]
+        backend.load.return_value = {"kind": "single", "version": 3, "messages": history}
+        client.emit("user_message", {"message": "Next", "sessionToken": issue_token(session_id)})
+
+    session = ACTIVE_SESSIONS.get(session_id)
+    assert session["version"] == 4
+    messages = session["assistant"].chat_messages[session["user_proxy"]]
+    assert [message["content"] for message in messages[:4]] == [f"Message {i}" for i in range(4)]
+    assert messages[4]["content"] == "Next"
+    client.disconnect()
+
+def test_session_id_without_a_valid_token_is_refused(no_message_log):
+    app, node = make_node()
+    client = node.test_client(app)
+    session_id = f"conversation-{uuid.uuid4().hex}"
+
+    with patch.object(autogen.AssistantAgent, "generate_reply", return_value="Hello") as generate_reply:
+        client.emit("user_message", {"message": "Hi", "sessionToken": f"{session_id}.forged"})
+        client.emit("user_message_team", {"message": "Hi", "sessionToken": "..", "agentOne": 1})
+    received = client.get_received()
+    assert [event["args"][0]["error"] for event in received if event["name"] == "error"] == ["Invalid session token"] * 2
+    generate_reply.assert_not_called()
+    assert session_id not in ACTIVE_SESSIONS
+
+    #A bare session id is ignored - the message carries on the socket's own conversation
+    with patch.object(autogen.AssistantAgent, "generate_reply", return_value="Hello"):
+        client.emit("user_message", {"message": "Hi", "sessionId": session_id})
+    assert session_id not in ACTIVE_SESSIONS
+    client.disconnect()
+
+def test_socket_chat_counted_against_the_users_email(no_message_log, monkeypatch):
+    import llm_scheduler
+    requesters = []
+
+    def recording_requester(user, priority):
+        requesters.append(user)
+        return llm_scheduler.requester(user, priority)
+
+    monkeypatch.setattr(socket_handlers, "requester", recording_requester)
+    app, node = make_node()
+    client = node.test_client(app)
+    with patch.object(autogen.AssistantAgent, "generate_reply", return_value="Hello"):
+        client.emit("user_message", {"message": "Hi", "email": "user@example.com"})
+        client.emit("user_message", {"message": "Again"})
+    #Without an email the session is the requester
+    assert requesters[0] == "user@example.com"
+    assert requesters[1] not in ("user@example.com", None)
+    client.disconnect()
+
+def test_disconnect_ends_team_and_evicted_conversations(monkeypatch):
+    from message_log import MessageLog
+    log = MessageLog(batch_size=100, flush_interval=0)
+    monkeypatch.setattr(log, "flush", lambda: 0)
+    monkeypatch.setattr(socket_handlers, "message_log", log)
+    app, node = make_node()
+    client = node.test_client(app)
+    with patch.object(autogen.AssistantAgent, "generate_reply", return_value="Hello"):
+        client.emit("user_message", {"message": "Hi", "email": "user@example.com"})
+    session_id = next(iter(log._next_index))
+    #The session is evicted from the store while the socket stays connected
+    ACTIVE_SESSIONS.discard(session_id)
+    client.disconnect()
+    assert log.stats()["conversations"] == 0
+    assert log._owners == {}
+
+def test_resume_needs_the_conversations_token(monkeypatch):
+    log = MagicMock()
+    log.load.return_value = [(0, "user", "secret question")]
+    monkeypatch.setattr(socket_handlers, "message_log", log)
+    app, node = make_node()
+    client = node.test_client(app)
+    client.get_received()
+
+    #Knowing another conversation's id is not enough
+    client.emit("resume_session", {"sessionId": "someone-else", "after": -1})
+    assert [event["name"] for event in client.get_received()] == ["error"]
+    log.load.assert_not_called()
+
+    client.emit("resume_session", {"sessionToken": issue_token("own-conversation"), "after": -1})
+    log.load.assert_called_once_with("own-conversation")
+    resumed = [event for event in client.get_received() if event["name"] == "resumed_messages"]
+    assert resumed[0]["args"][0]["messages"][0]["content"] == "secret question"
+    client.disconnect()
+
+#Runs python code in a new process, as another node would - returns what it prints
+def run_node(code, secret, stdin=None):
+    env = {**os.environ, "SESSION_TOKEN_SECRET": secret or ""}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run([sys.executable, "-c", code], env=env, cwd=root, input=stdin, capture_output=True,
+                          text=True, timeout=60, check=True).stdout.strip()
+
+def test_token_issued_on_one_node_is_accepted_by_another():
+    issue = "from session_tokens import issue_token; print(issue_token('conversation-1'))"
+    verify = "import sys; from session_tokens import verify_token; print(verify_token(sys.stdin.readline().strip()))"
+
+    token = run_node(issue, "shared-secret")
+    assert run_node(verify, "shared-secret", stdin=token) == "conversation-1"
+
+    #Without a shared secret each node has its own key - a queue is refused rather than failing on every token
+    assert run_node(verify, None, stdin=run_node(issue, None)) == "None"
+    with pytest.raises(ValueError, match="SESSION_TOKEN_SECRET"):
+        check_shared_secret("redis://localhost:6379/1", secret=None)
+    check_shared_secret("redis://localhost:6379/1", secret="shared-secret")
+    check_shared_secret("memory://", secret=None)
+    check_shared_secret(None, secret=None)
@@ -0,0 +1,58 @@
+# test_speaker_selection.py
+import autogen
+import pytest
+from speaker_selection import SpeakerSelector, SelectionStats
+
+@pytest.fixture
+def team():
+    #Group chat with agents named like the ones built from agentdata - no LLM is called
+    agents = [
+        autogen.UserProxyAgent(name="User_Proxy", human_input_mode="NEVER", code_execution_config=False, llm_config=False),
+        autogen.AssistantAgent(name="Programming_Expert", llm_config=False),
+        autogen.AssistantAgent(name="Test_Engineer", llm_config=False),
+        autogen.AssistantAgent(name="Marketing_Manager", llm_config=False),
+    ]
+    return agents, autogen.GroupChat(agents=agents, messages=[], max_round=10)
+
+def test_traceback_is_routed_to_the_programmer(team):
+    agents, groupchat = team
+    stats = SelectionStats()
+    selector = SpeakerSelector(mode="rules", routes=[{"pattern": r"Traceback \(most recent", "agent": "program"}], stats=stats)
+    groupchat.speaker_selection_method = selector
+    groupchat.messages.append({"role": "user", "name": "User_Proxy", "content": "exitcode: 1\nTraceback (most recent call last):"})
+
+    # autogen takes the agent returned by the selector without asking the manager
+    speaker, _, _ = groupchat._prepare_and_select_agents(agents[0])
+
+    assert speaker is agents[1]
+    assert stats.stats()["manager_calls_saved"] == 1
+
+def test_unmatched_message_falls_back_to_the_llm(team):
+    agents, groupchat = team
+    stats = SelectionStats()
+    selector = SpeakerSelector(mode="rules", routes=[{"pattern": "Traceback", "agent": "program"}], stats=stats)
+    groupchat.messages.append({"role": "user", "content": "What should the launch plan be?"})
+
+    assert selector(agents[0], groupchat) == "auto"
+    assert stats.stats()["llm_fallbacks"] == 1
+
+def test_state_machine_follows_single_transition_and_routes_between_several(team):
+    agents, groupchat = team
+    selector = SpeakerSelector(
+        mode="state_machine",
+        routes=[{"pattern": "```python", "agent": "proxy"}],
+        transitions={"proxy": ["program"], "program": ["proxy", "test"]},
+        stats=SelectionStats(),
+    )
+    groupchat.messages.append({"role": "user", "content": "```python\nprint(1)\n```"})
+
+    assert selector(agents[0], groupchat) is agents[1]
+    # Two agents may follow the programmer - the code block sends it to the proxy to run
+    assert selector(agents[1], groupchat) is agents[0]
+
+def test_round_robin_and_invalid_modes(team):
+    agents, groupchat = team
+
+    assert SpeakerSelector(mode="round_robin", stats=SelectionStats())(agents[3], groupchat) is agents[0]
+    with pytest.raises(ValueError):
+        SpeakerSelector.from_config('{"mode": "telepathy"}')
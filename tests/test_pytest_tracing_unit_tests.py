@@ -0,0 +1,122 @@
+# test_tracing.py
+import json
+import pytest
+from flask import Flask
+from tracing import Tracer, JsonLinesExporter, Histogram
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+def test_child_spans_share_the_trace():
+    exporter = ListExporter()
+    tracer = Tracer(exporter=exporter)
+    with tracer.span("http POST /chat_team") as root:
+        with tracer.span("db.execute", **{"db.statement": "SELECT 1"}) as child:
+            pass
+    assert tracer.current_span() is None
+
+    assert [span.name for span in exporter.spans] == ["db.execute", "http POST /chat_team"]
+    assert child.trace_id == root.trace_id
+    assert child.parent_id == root.span_id
+    assert root.parent_id is None
+    assert child.attributes["db.statement"] == "SELECT 1"
+
+def test_errors_are_recorded_and_raised():
+    exporter = ListExporter()
+    tracer = Tracer(exporter=exporter)
+    with pytest.raises(ValueError):
+        with tracer.span("agent.generate_reply"):
+            raise ValueError("bad reply")
+
+    assert exporter.spans[0].error == "ValueError: bad reply"
+    assert 'span_errors_total{span="agent.generate_reply"} 1' in tracer.metrics_text()
+
+def test_unsampled_traces_are_timed_but_not_exported():
+    exporter = ListExporter()
+    tracer = Tracer(exporter=exporter, sample_rate=0)
+    with tracer.span("http GET /metrics"):
+        with tracer.span("db.execute"):
+            pass
+    assert exporter.spans == []
+    assert 'span_duration_seconds_count{span="db.execute"} 1' in tracer.metrics_text()
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    histogram.observe("db.execute", 0.05)
+    histogram.observe("db.execute", 0.5)
+    histogram.observe("db.execute", 5)
+    assert histogram.snapshot()["db.execute"] == [1, 2, 3, pytest.approx(5.55)]
+
+def test_metrics_text_is_prometheus_format():
+    tracer = Tracer(buckets=(0.1, 1.0))
+    tracer.histogram.observe("llm.request", 0.5)
+    text = tracer.metrics_text({"db_pool_in_use": ("Database connections checked out", 2)})
+
+    assert "# TYPE span_duration_seconds histogram" in text
+    assert 'span_duration_seconds_bucket{span="llm.request",le="0.1"} 0' in text
+    assert 'span_duration_seconds_bucket{span="llm.request",le="1.0"} 1' in text
+    assert 'span_duration_seconds_bucket{span="llm.request",le="+Inf"} 1' in text
+    assert "# TYPE db_pool_in_use gauge\ndb_pool_in_use 2" in text
+
+def test_record_span_is_a_child_of_the_current_span():
+    exporter = ListExporter()
+    tracer = Tracer(exporter=exporter)
+    with tracer.span("agent.generate_reply") as parent:
+        started = parent.start_ns
+        tracer.record_span("llm.request", started, **{"http.status_code": 200})
+    assert exporter.spans[0].name == "llm.request"
+    assert exporter.spans[0].parent_id == parent.span_id
+
+def test_json_lines_exporter_writes_otel_layout(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = JsonLinesExporter(path=str(path), service_name="test", flush_interval=0)
+    tracer = Tracer(exporter=exporter)
+    with tracer.span("socketio.emit", **{"socketio.event": "agent_message"}):
+        pass
+    assert exporter.flush() == 1
+
+    line = json.loads(path.read_text().splitlines()[0])
+    assert line["name"] == "socketio.emit"
+    assert line["context"]["trace_id"].startswith("0x") and len(line["context"]["trace_id"]) == 34
+    assert line["attributes"] == {"socketio.event": "agent_message"}
+    assert line["resource"]["attributes"]["service.name"] == "test"
+
+def test_instrument_flask_traces_each_route():
+    exporter = ListExporter()
+    tracer = Tracer(exporter=exporter)
+    app = Flask(__name__)
+
+    @app.route('/items/<item_id>', methods=['POST'])
+    def item(item_id):
+        with tracer.span("db.execute"):
+            return "ok"
+
+    tracer.instrument_flask(app)
+    app.test_client().post('/items/7')
+
+    names = [span.name for span in exporter.spans]
+    assert names == ["db.execute", "http POST /items/<item_id>"]
+    assert exporter.spans[1].attributes["http.status_code"] == 200
+    assert exporter.spans[0].parent_id == exporter.spans[1].span_id
+
+def test_instrument_socketio_traces_emits():
+    exporter = ListExporter()
+    tracer = Tracer(exporter=exporter)
+
+    class FakeSocketIO:
+        def __init__(self):
+            self.emitted = []
+
+        def emit(self, event, data=None, room=None):
+            self.emitted.append((event, data, room))
+
+    socket_io = FakeSocketIO()
+    tracer.instrument_socketio(socket_io)
+    socket_io.emit('agent_message', {'content': 'hi'}, room='s1')
+
+    assert socket_io.emitted == [('agent_message', {'content': 'hi'}, 's1')]
+    assert exporter.spans[0].attributes["socketio.event"] == "agent_message"
@@ -0,0 +1,103 @@
+# test_workspaces.py
+import os
+import tarfile
+from workspaces import WorkspaceManager, current_workspace
+
+def make_manager(tmp_path, **kwargs):
+    return WorkspaceManager(root=str(tmp_path), reaper_interval=0, **kwargs)
+
+def test_workspace_is_created_on_first_use(tmp_path):
+    manager = make_manager(tmp_path)
+    assert not os.path.exists(manager.directory("sid/1"))
+    path = manager.path("sid/1")
+    #Keys are made safe to use as a directory name
+    assert os.path.isdir(path) and os.path.dirname(path) == str(tmp_path)
+    assert manager.stats()["created"] == 1
+
+def test_scope_sets_the_current_workspace(tmp_path):
+    manager = make_manager(tmp_path)
+    with manager.scope("sid-1"):
+        assert current_workspace() == "sid-1"
+        manager.path("sid-1")
+    assert current_workspace() is None
+    #The session's workspace stays until the session ends
+    assert os.path.isdir(manager.directory("sid-1"))
+
+    #A scope without a key gets a workspace of its own that is removed at the end
+    with manager.scope() as key:
+        path = manager.path(key)
+        assert current_workspace() == key != "sid-1"
+    assert not os.path.exists(path)
+
+def test_quota(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=100, max_files=2)
+    path = manager.path("sid-1")
+    with open(os.path.join(path, "a.txt"), "w") as f:
+        f.write("x" * 60)
+    assert manager.check_quota("sid-1") is None
+    assert manager.bytes_left("sid-1") == 40
+
+    with open(os.path.join(path, "b.txt"), "w") as f:
+        f.write("x" * 60)
+    assert "120 bytes used" in manager.check_quota("sid-1")
+
+    os.remove(os.path.join(path, "b.txt"))
+    for name in ("c", "d"):
+        open(os.path.join(path, name), "w").close()
+    assert "3 files" in manager.check_quota("sid-1")
+
+def test_release_and_reap(tmp_path):
+    manager = make_manager(tmp_path, ttl=60)
+    manager.path("sid-1")
+    manager.path("sid-2")
+    manager.release("sid-1")
+    assert not os.path.exists(manager.directory("sid-1"))
+
+    #Left on disk by an earlier run of the server
+    old = manager.directory("earlier-run")
+    os.makedirs(old)
+    os.utime(old, (0, 0))
+    #Not created by the manager - WORKSPACE_ROOT may be a directory shared with other data
+    os.makedirs(tmp_path / "data")
+    (tmp_path / "data" / "keep.txt").write_text("keep")
+    os.utime(tmp_path / "data", (0, 0))
+    assert manager.reap() == 1
+    assert not os.path.exists(old)
+    assert (tmp_path / "data" / "keep.txt").exists()
+    assert os.path.isdir(manager.directory("sid-2"))
+
+    manager.ttl = -1
+    assert manager.reap() == 1
+    assert manager.stats()["workspaces"] == 0
+
+def test_snapshot(tmp_path):
+    manager = make_manager(tmp_path / "root")
+    assert manager.snapshot("sid-1") is None
+    path = manager.path("sid-1")
+    os.makedirs(os.path.join(path, "static"))
+    with open(os.path.join(path, "static", "index.html"), "w") as f:
+        f.write("<h1>hi</h1>")
+    with tarfile.open(fileobj=manager.snapshot("sid-1")) as tar:
+        assert tar.extractfile("workspace/static/index.html").read() == b"<h1>hi</h1>"
+
+def test_keys_can_not_reach_outside_the_root(tmp_path):
+    root = tmp_path / "root"
+    manager = make_manager(root)
+    outside = tmp_path / "other"
+    os.makedirs(outside)
+    (outside / "keep.txt").write_text("keep")
+    manager.path("sid-1")
+    for key in (".", "..", "../other", "/tmp", ""):
+        #Every key is a directory of its own directly under the root
+        assert os.path.dirname(manager.directory(key)) == str(root)
+        assert manager.snapshot(key) is None
+        manager.release(key)
+    assert (outside / "keep.txt").exists()
+    assert os.path.isdir(manager.directory("sid-1"))
+
+    #A link in the root to somewhere else is neither archived nor followed when removed
+    os.symlink(outside, root / "link")
+    os.utime(root / "link", (0, 0), follow_symlinks=False)
+    manager.ttl = 60
+    manager.reap()
+    assert (outside / "keep.txt").exists()
@@ -0,0 +1,312 @@
+import json
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from config import TRACING_EXPORTER, TRACING_FILE_PATH, TRACING_SAMPLE_RATE, TRACING_SERVICE_NAME
+
+# Upper bounds in seconds of the latency histogram buckets - from a cached query to a long team chat
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# The span the code running here is inside of - new spans become its children
+_current_span = ContextVar("trace_span", default=None)
+
+
+class Span:
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name, parent=None, sampled=True, attributes=None, start_ns=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent.span_id if parent else None
+        # Whole traces are sampled or not - children follow the root span's decision
+        self.sampled = parent.sampled if parent else sampled
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def to_dict(self, service_name):
+        # Laid out like the OpenTelemetry SDK's console exporter so the lines can be loaded by its tooling
+        return {
+            "name": self.name,
+            "context": {"trace_id": f"0x{self.trace_id:032x}", "span_id": f"0x{self.span_id:016x}"},
+            "parent_id": f"0x{self.parent_id:016x}" if self.parent_id else None,
+            "start_time": _iso(self.start_ns),
+            "end_time": _iso(self.end_ns),
+            "status": {"status_code": "ERROR", "description": self.error} if self.error else {"status_code": "UNSET"},
+            "attributes": self.attributes,
+            "resource": {"attributes": {"service.name": service_name}},
+        }
+
+
+def _iso(ns):
+    return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc).isoformat()
+
+
+''' Writes finished spans as JSON lines to stdout or a file. Spans are buffered and written by a daemon thread
+    once a second (or once 100 are waiting) so the request that finished them never waits on the write.
+'''
+class JsonLinesExporter:
+
+    def __init__(self, path=None, service_name="app", flush_interval=1.0, batch_size=100):
+        self.path = path
+        self.service_name = service_name
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._stop_flusher = threading.Event()
+        self.exported = 0
+
+    def export(self, span):
+        with self._lock:
+            self._pending.append(span)
+            full = len(self._pending) >= self.batch_size
+        self._start_flusher()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                spans, self._pending = self._pending, []
+            if not spans:
+                return 0
+            lines = "".join(json.dumps(span.to_dict(self.service_name), default=str) + "\n" for span in spans)
+            try:
+                if self.path:
+                    with open(self.path, "a", encoding="utf-8") as file:
+                        file.write(lines)
+                else:
+                    sys.stdout.write(lines)
+                    sys.stdout.flush()
+            except OSError as e:
+                print(f"Error exporting spans: {str(e)}")
+                return 0
+            self.exported += len(spans)
+            return len(spans)
+
+    def close(self):
+        self._stop_flusher.set()
+        self.flush()
+
+    def _start_flusher(self):
+        if self._flusher is not None or not self.flush_interval:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_forever, name="trace_exporter", daemon=True)
+            self._flusher.start()
+
+    def _flush_forever(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            self.flush()
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # label -> [count per bucket..., count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {label: list(series) for label, series in self._series.items()}
+
+
+''' Tracing for the hot paths - HTTP routes, database connections and queries, agent replies, speaker
+    selection, LLM requests and Socket.IO emits. Every span is timed into a latency histogram per span name,
+    served in the Prometheus text format at /metrics. Spans are also exported as JSON lines (stdout or a file,
+    see TRACING_EXPORTER) for the sampled share of traces. Span names are kept to a small fixed set so the
+    histogram stays small - the details of a span (query, agent, event) go in its attributes.
+'''
+class Tracer:
+
+    def __init__(self, exporter=None, sample_rate=1.0, buckets=DEFAULT_BUCKETS):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.histogram = Histogram(buckets)
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def start_span(self, name, **attributes):
+        # For spans that start and end in different callbacks - returns the span and the token for end_span
+        parent = _current_span.get()
+        span = Span(name, parent, sampled=random.random() < self.sample_rate, attributes=attributes)
+        return span, _current_span.set(span)
+
+    def end_span(self, span, token, error=None):
+        _current_span.reset(token)
+        self._finish(span, error)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span, token = self.start_span(name, **attributes)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.end_span(span, token, error)
+
+    def record_span(self, name, start_ns, error=None, **attributes):
+        # A span that has already finished, as a child of the current span - used by callbacks that only see its end
+        span = Span(name, _current_span.get(), sampled=random.random() < self.sample_rate, attributes=attributes, start_ns=start_ns)
+        self._finish(span, error)
+
+    def traced(self, name):
+        # Decorator putting every call of a function in a span
+        def decorator(fn):
+            @wraps(fn)
+            def run(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return run
+        return decorator
+
+    def current_span(self):
+        return _current_span.get()
+
+    def metrics_text(self, gauges=None):
+        # Prometheus text exposition of the span latency histogram, error counts and any extra gauges
+        lines = [
+            "# HELP span_duration_seconds Latency of traced operations by span name",
+            "# TYPE span_duration_seconds histogram",
+        ]
+        buckets = self.histogram.buckets
+        for label, series in sorted(self.histogram.snapshot().items()):
+            name = _label_value(label)
+            for bound, count in zip(buckets, series):
+                lines.append(f'span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {series[-2]}')
+            lines.append(f'span_duration_seconds_sum{{span="{name}"}} {series[-1]}')
+            lines.append(f'span_duration_seconds_count{{span="{name}"}} {series[-2]}')
+        lines += ["# HELP span_errors_total Traced operations that raised", "# TYPE span_errors_total counter"]
+        with self._lock:
+            errors = sorted(self.errors.items())
+        for label, count in errors:
+            lines.append(f'span_errors_total{{span="{_label_value(label)}"}} {count}')
+        for name, (help_text, value) in (gauges or {}).items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    # Instrumentation of the app's libraries
+
+    def instrument_flask(self, app):
+        # One span per HTTP request, named by its route so every blueprint handler is covered
+        from flask import g, request
+
+        @app.before_request
+        def start_request_span():
+            rule = request.url_rule.rule if request.url_rule else "unmatched"
+            g.trace_span = self.start_span(f"http {request.method} {rule}", **{"http.method": request.method, "http.route": rule})
+
+        @app.after_request
+        def record_status(response):
+            if "trace_span" in g:
+                g.trace_span[0].set_attribute("http.status_code", response.status_code)
+            return response
+
+        @app.teardown_request
+        def end_request_span(exception):
+            started = g.pop("trace_span", None)
+            if started is not None:
+                self.end_span(*started, error=f"{type(exception).__name__}: {exception}" if exception else None)
+
+    def instrument_socketio(self, socket_io):
+        # Every emit - the proxies and handlers emit through this instance
+        emit = socket_io.emit
+
+        @wraps(emit)
+        def traced_emit(event, *args, **kwargs):
+            with self.span("socketio.emit", **{"socketio.event": event}):
+                return emit(event, *args, **kwargs)
+
+        socket_io.emit = traced_emit
+
+    def instrument_autogen(self, autogen):
+        # Every agent reply and group chat speaker selection, whichever agent or chat they belong to
+        agent_class, group_chat_class = autogen.ConversableAgent, autogen.GroupChat
+        if getattr(agent_class.generate_reply, "_traced", False):
+            return
+        generate_reply, select_speaker = agent_class.generate_reply, group_chat_class.select_speaker
+
+        @wraps(generate_reply)
+        def traced_generate_reply(agent, *args, **kwargs):
+            with self.span("agent.generate_reply", **{"agent.name": agent.name}):
+                return generate_reply(agent, *args, **kwargs)
+
+        @wraps(select_speaker)
+        def traced_select_speaker(groupchat, *args, **kwargs):
+            with self.span("groupchat.select_speaker") as span:
+                speaker = select_speaker(groupchat, *args, **kwargs)
+                span.set_attribute("agent.name", getattr(speaker, "name", str(speaker)))
+                return speaker
+
+        traced_generate_reply._traced = True
+        agent_class.generate_reply = traced_generate_reply
+        group_chat_class.select_speaker = traced_select_speaker
+
+    def _finish(self, span, error):
+        span.end_ns = time.time_ns()
+        if error:
+            span.error = error
+            with self._lock:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+        self.histogram.observe(span.name, span.duration)
+        if self.exporter is not None and span.sampled:
+            self.exporter.export(span)
+
+
+def _label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+#Exporter for the TRACING_EXPORTER setting - None keeps the metrics without exporting spans
+def create_exporter(kind, path=None, service_name="app"):
+    if kind == "stdout":
+        return JsonLinesExporter(service_name=service_name)
+    if kind == "file":
+        return JsonLinesExporter(path=path, service_name=service_name)
+    if kind not in ("none", ""):
+        print(f"Unknown TRACING_EXPORTER {kind} - spans are not exported")
+    return None
+
+
+# Process wide tracer used by every module
+tracer = Tracer(
+    exporter=create_exporter(TRACING_EXPORTER, TRACING_FILE_PATH, TRACING_SERVICE_NAME),
+    sample_rate=TRACING_SAMPLE_RATE,
+)
@@ -0,0 +1,18 @@
+from flask import Blueprint, request, jsonify
+from llm_usage import usage_recorder, usage_rollups
+
+usage_blueprint = Blueprint('usage', __name__)
+
+#Token use and cost per user, per agent and per team - optionally for one user ("email") and from a time ("since")
+@usage_blueprint.route('/usage', methods=['POST'])
+def usage():
+    try:
+        data = request.get_json(silent=True) or {}
+        # Write the totals still held in memory so the rollups include the latest calls
+        if usage_recorder is not None:
+            usage_recorder.flush()
+        rollups = usage_rollups(email=data.get('email'), since=data.get('since'))
+        return jsonify({"message": rollups}), 200
+    except Exception as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 500
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
-from db_connection import connect_to_database
+from db_connection import database_connection
+from agent_cache import invalidate_agent_caches
 
 user_blueprint = Blueprint('user', __name__)
 
@@ -12,15 +13,14 @@ def sign_in_user():
         userEmail = data["emailAddress"]
         userPassword = data["password"]  
         
-        conn = connect_to_database()
-        cursor = conn.cursor()
+        with database_connection() as conn:
+            cursor = conn.cursor()
 
-        query = "SELECT useremail, userpassword FROM usertable WHERE useremail = %s"
-        cursor.execute(query, (userEmail,))
+            query = "SELECT useremail, userpassword FROM usertable WHERE useremail = %s"
+            cursor.execute(query, (userEmail,))
 
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+            result = cursor.fetchone()
+            cursor.close()
          
         if result:
             email, password = result 
@@ -46,27 +46,25 @@ def review_sign_in():
         data = request.json
         name = data["name"]
         email = data["email"]
-        #connect to database and cursor
-        conn = connect_to_database()        
-        cursor = conn.cursor()
         new_user = False
+        #checkout a pooled connection and cursor
+        with database_connection() as conn:
+            cursor = conn.cursor()
+
+            #execute transaction
+            query = "SELECT useremail FROM usertable WHERE useremail = %s"
+            cursor.execute(query, (email,))
+            #get one single record
+            result = cursor.fetchone()
+            #commit transaction
+            conn.commit()
+            #close cursor
+            cursor.close()
 
-        #execute transaction
-        query = "SELECT useremail FROM usertable WHERE useremail = %s"
-        cursor.execute(query, (email,))
-        #get one single record
-        result = cursor.fetchone()
         if result is None:
             #if ther email is not found call the create_user method and save the new user to the database.
             create_user(email, name)
             new_user = True
-            
-        #commit transaction
-        conn.commit()
-        #close cursor
-        cursor.close()
-        #close connection
-        conn.close()
         
         if(new_user):    
             return jsonify({"response": "User Created"}), 200
@@ -89,8 +87,8 @@ def delete_user_route():
         #if all methods ran successfully the below message will be returned
         if deletion_result:
             response = "User Deleted"
-            #return the response
-            return jsonify({"response": response}), 200
+            #return the response along with the rows deleted from each table
+            return jsonify({"response": response, "deleted": deletion_result}), 200
 
         #Return the user was not deleted response
         response = "User Not Deleted"
@@ -99,99 +97,67 @@ def delete_user_route():
         print("Error:", str(e))
         return jsonify({"error": str(e)}), 500
 
+#Endpoint to delete many users at once - used to work through account deletion requests in bulk
+@user_blueprint.route('/purge_users', methods=['POST'])
+def purge_users_route():
+    try:
+        data = request.json
+        emails = data.get('emails')
+        if not isinstance(emails, list) or not emails:
+            return jsonify({"error": "A list of emails is required"}), 400
+
+        deleted = purge_users(emails)
+        return jsonify({"response": {"users": len(set(emails)), "deleted": deleted}}), 200
+    except Exception as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 500
+
 #Method to create a new user - called when verifying users sign in email - if the email is not stored in the database
 def create_user(email, name):
     try:   
-        conn = connect_to_database()        
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO usertable (useremail, UserFirstName) VALUES (%s, %s)",
-            (email, name)
-        )
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with database_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                "INSERT INTO usertable (useremail, UserFirstName) VALUES (%s, %s)",
+                (email, name)
+            )
+
+            conn.commit()
+            cursor.close()
     except Exception as e:
         print("Error:", str(e))
         return jsonify({"error": str(e)}), 500
 
-#Method to call methods to delete a users chats, teams, agents and then the user themself from the database
-def delete_user_flow(email):
-    # Call each delete method and store the result
-    chat_result = delete_chats(email)
-    team_result = delete_teams(email)
-    agent_result = delete_agents(email)
-    user_result = delete_user(email)
-
-    # These comparisons could be changed to booleans
-    #If I have time to refactor before submission I will
-    #Dont know what I was thinking :)
-    
-    if (chat_result and 
-        team_result and 
-        agent_result and 
-        user_result ):
-        return "All Deletions Successful"
-    else:
-        return "Deletion Failed"
-
-#function called to delete a users chats
-def delete_chats(email):
-    print("hello chats")
-    try:
-        conn = connect_to_database()        
-        cursor = conn.cursor() 
-        query = "DELETE FROM chattable WHERE useremail = %s"
-        cursor.execute(query, (email,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True
-    except Exception as e:       
-        return False
-
-#function called to delete all of a users teams stored
-def delete_teams(email):
-    print("hello teams")
-    try:
-        conn = connect_to_database()        
-        cursor = conn.cursor() 
-        query = "DELETE FROM agentteams WHERE useremail = %s"
-        cursor.execute(query, (email,))
+#Tables holding a users data - deleted in this order so the user row goes last
+USER_DATA_TABLES = ("chattable", "agentteams", "agentdata", "llmusage", "sessionmessages", "usertable")
+
+#Deletes the chats, teams, agents, LLM usage, logged conversations and accounts of one or more users in a single transaction on one connection
+#Returns the number of rows deleted from each table - if any delete fails nothing is deleted
+def purge_users(emails):
+    emails = list(dict.fromkeys(emails))
+    deleted = {table: 0 for table in USER_DATA_TABLES}
+    if not emails:
+        return deleted
+    with database_connection() as conn:
+        cursor = conn.cursor()
+        for table in USER_DATA_TABLES:
+            # One statement per table for the whole batch of emails
+            cursor.execute(f"DELETE FROM {table} WHERE useremail = ANY(%s)", (emails,))
+            deleted[table] = cursor.rowcount
+        # The pooled connection is rolled back if an error is raised before this commit
         conn.commit()
         cursor.close()
-        conn.close()
-        return True
-    except Exception as e:
-        return False    
+    #Deleted agents must not be served from the agent or team caches
+    if deleted["agentdata"]:
+        invalidate_agent_caches()
+    return deleted
 
-#a method to delete a users agents
-def delete_agents(email):
-    print("hello agents")
-    try:
-        conn = connect_to_database()        
-        cursor = conn.cursor() 
-        query = "DELETE FROM agentdata WHERE useremail = %s"
-        cursor.execute(query, (email,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True
-    except Exception as e:
-        return False
-#A method used to delete the users account - the user will still have an Auth0 account after deleting their information from the GenAIColab Application
-def delete_user(email):
-    print("hello user")
+#Method to delete a users chats, teams, agents and then the user themself from the database
+#Returns the per table row counts, or None if the deletion failed
+def delete_user_flow(email):
     try:
-        conn = connect_to_database()        
-        cursor = conn.cursor() 
-        query = "DELETE FROM usertable WHERE useremail = %s"
-        cursor.execute(query, (email,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True
+        return purge_users([email])
     except Exception as e:
-        return False
+        print("Error:", str(e))
+        return None
@@ -1,9 +1,41 @@
 # Code to ensure agents name provided by user does not break naming standards of agent.
 # https://www.geeksforgeeks.org/python-removing-unwanted-characters-from-string/?utm_source    
 import re
+from config import LLM_CONFIG, LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE
 
 def refactor_agent_name(name):
 
     #Ensures agent names provided by users do not break naming standards 
     # Replace invalid characters with underscores
     return re.sub(r'[^a-zA-Z0-9_-]', '_', name)
+
+#Agent configuration using the temperature stored with the agent in agentdata - agents created through /create_agent
+#are stored with temperature 0.0, which makes their replies cacheable
+def agent_llm_config(temperature):
+    if temperature is None:
+        return LLM_CONFIG
+    return {**LLM_CONFIG, "temperature": float(temperature)}
+
+#Reads the keyset pagination parameters of a list request - cursor is the last id of the previous page
+#With paged_by_default=False a request with neither cursor nor limit gets a limit of None - the whole list, as
+#the list endpoints returned before they were paged. Raises ValueError if either is not a whole number
+def read_page_params(data, paged_by_default=True):
+    cursor = data.get("cursor")
+    cursor = int(cursor) if cursor not in (None, "") else None
+    if not paged_by_default and cursor is None and data.get("limit") in (None, ""):
+        return None, None
+    limit = int(data.get("limit") or LIST_PAGE_SIZE)
+    return cursor, max(1, min(limit, LIST_MAX_PAGE_SIZE))
+
+#Row limit of a page query - one row more than the page to know if there is another page, None (LIMIT NULL) for all
+def query_limit(limit):
+    return limit + 1 if limit is not None else None
+
+#Splits the rows of a query run with query_limit(limit) into the page and the cursor for the next one
+#id_index is the position of the id column in each row
+def split_page(rows, limit, id_index=-1):
+    if limit is None:
+        return rows, None
+    page = rows[:limit]
+    next_cursor = page[-1][id_index] if len(rows) > limit else None
+    return page, next_cursor
@@ -0,0 +1,25 @@
+from flask import Blueprint, request, jsonify, send_file
+from workspaces import workspace_manager
+from session_tokens import verify_token
+
+workspace_blueprint = Blueprint('workspace', __name__)
+
+#Downloads the files a websocket session's code has written as a .tar.gz - "sessionToken" is the token the
+#connection_status event gave the session, so only the client that owns the session can download them
+@workspace_blueprint.route('/workspace_snapshot', methods=['POST'])
+def workspace_snapshot():
+    try:
+        data = request.get_json(silent=True) or {}
+        token = data.get('sessionToken')
+        if not token:
+            return jsonify({"error": "sessionToken is required"}), 400
+        session_id = verify_token(token)
+        if session_id is None:
+            return jsonify({"error": "Invalid session token"}), 403
+        snapshot = workspace_manager.snapshot(session_id)
+        if snapshot is None:
+            return jsonify({"error": "Workspace not found"}), 404
+        return send_file(snapshot, mimetype="application/gzip", as_attachment=True, download_name=f"workspace-{session_id}.tar.gz")
+    except Exception as e:
+        print("Error:", str(e))
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,212 @@
+import contextvars
+import hashlib
+import io
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from config import WORKSPACE_ROOT, WORKSPACE_TTL, WORKSPACE_MAX_MB, WORKSPACE_MAX_FILES, WORKSPACE_REAPER_INTERVAL
+
+# Names of the directories directory() creates - anything else under the root is not a workspace and left alone
+_WORKSPACE_NAME = re.compile(r"[0-9a-f]{64}")
+
+# Key of the workspace code blocks run in - set by WorkspaceManager.scope() for a session or request
+_workspace = contextvars.ContextVar("workspace", default=None)
+
+
+#Key of the workspace the current conversation runs code in, None outside a scope
+def current_workspace():
+    return _workspace.get()
+
+
+#Directory workspaces are created under when WORKSPACE_ROOT is not set - tmpfs when the machine has one
+def default_root():
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return os.path.join("/dev/shm", "genaicolab-workspaces")
+    return os.path.join(tempfile.gettempdir(), "genaicolab-workspaces")
+
+
+#Bytes and number of files under path
+def directory_usage(path):
+    size, files = 0, 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+                files += 1
+            except OSError:
+                pass
+    return size, files
+
+
+''' Scratch directories code blocks run in - one per websocket session or REST request, so concurrent
+    conversations never overwrite each other's files. A workspace is created the first time code runs in it,
+    limited to max_bytes and max_files, and removed when its session ends or after ttl idle seconds.
+'''
+class WorkspaceManager:
+
+    def __init__(self, root=None, ttl=3600, max_bytes=None, max_files=None, reaper_interval=300):
+        self.root = root or default_root()
+        self.ttl = ttl
+        # None for no limit
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.reaper_interval = reaper_interval
+        # key -> last used time
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._stop_reaper = threading.Event()
+        self.created = 0
+        self.released = 0
+        self.expired = 0
+
+    #Runs the block with code executing in the workspace for key - with no key a new workspace is used and
+    #removed when the block ends
+    @contextmanager
+    def scope(self, key=None):
+        temporary = key is None
+        key = key or f"request-{uuid.uuid4().hex}"
+        token = _workspace.set(key)
+        try:
+            yield key
+        finally:
+            _workspace.reset(token)
+            if temporary:
+                self.release(key)
+
+    #Keys come from clients - the directory is named after their hash so no key can point outside the root
+    def directory(self, key):
+        return os.path.join(self.root, hashlib.sha256(str(key).encode("utf-8")).hexdigest())
+
+    #True if path is a workspace directory directly under the root - checked before it is archived or removed, so
+    #other files in a shared WORKSPACE_ROOT are never touched
+    def _contained(self, path):
+        real = os.path.realpath(path)
+        return os.path.isdir(real) and os.path.dirname(real) == os.path.realpath(self.root) \
+            and _WORKSPACE_NAME.fullmatch(os.path.basename(real)) is not None
+
+    #Directory of the workspace - created on first use
+    def path(self, key):
+        path = self.directory(key)
+        with self._lock:
+            if key not in self._last_used and not os.path.isdir(path):
+                os.makedirs(path, mode=0o700, exist_ok=True)
+                self.created += 1
+            self._last_used[key] = time.time()
+        self._start_reaper()
+        return path
+
+    def usage(self, key):
+        return directory_usage(self.directory(key))
+
+    #Message explaining why no more code can run in the workspace, None while it is within its limits
+    def check_quota(self, key):
+        size, files = self.usage(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return f"Workspace quota exceeded: {size} bytes used, the limit is {self.max_bytes}"
+        if self.max_files is not None and files > self.max_files:
+            return f"Workspace quota exceeded: {files} files, the limit is {self.max_files}"
+        return None
+
+    #Bytes the workspace can still grow by - used as the largest file code can write, None for no limit
+    def bytes_left(self, key):
+        if self.max_bytes is None:
+            return None
+        return max(self.max_bytes - self.usage(key)[0], 0)
+
+    def release(self, key):
+        with self._lock:
+            known = self._last_used.pop(key, None) is not None
+        path = self.directory(key)
+        if self._contained(path):
+            shutil.rmtree(path, ignore_errors=True)
+            if known:
+                self.released += 1
+
+    #gzipped tar of the workspace's files, None if there is no workspace for key
+    def snapshot(self, key):
+        path = self.directory(key)
+        if not self._contained(path):
+            return None
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+            tar.add(path, arcname="workspace")
+        buffer.seek(0)
+        return buffer
+
+    def reap(self):
+        # Remove workspaces idle for longer than ttl - including ones left on disk by an earlier run of the server
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        with self._lock:
+            last_used = {self.directory(key): used for key, used in self._last_used.items()}
+        expired = 0
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                used = max(last_used.get(path, 0), os.path.getmtime(path))
+            except OSError:
+                continue
+            if used < cutoff and self._contained(path):
+                shutil.rmtree(path, ignore_errors=True)
+                expired += 1
+        with self._lock:
+            for key in [key for key, used in self._last_used.items() if used < cutoff]:
+                del self._last_used[key]
+            self.expired += expired
+        if expired:
+            print(f"Removed {expired} idle workspaces")
+        return expired
+
+    def stats(self):
+        with self._lock:
+            active = len(self._last_used)
+        size, files = directory_usage(self.root)
+        return {
+            "root": self.root,
+            "workspaces": active,
+            "bytes": size,
+            "files": files,
+            "max_bytes_per_workspace": self.max_bytes,
+            "max_files_per_workspace": self.max_files,
+            "created": self.created,
+            "released": self.released,
+            "expired": self.expired,
+        }
+
+    def close(self):
+        self._stop_reaper.set()
+
+    def _start_reaper(self):
+        if self._reaper is not None or not self.reaper_interval:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_forever, name="workspace_reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_forever(self):
+        while not self._stop_reaper.wait(self.reaper_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Error removing idle workspaces: {str(e)}")
+
+
+workspace_manager = WorkspaceManager(
+    root=WORKSPACE_ROOT,
+    ttl=WORKSPACE_TTL,
+    max_bytes=WORKSPACE_MAX_MB * 1024 * 1024 if WORKSPACE_MAX_MB else None,
+    max_files=WORKSPACE_MAX_FILES or None,
+    reaper_interval=WORKSPACE_REAPER_INTERVAL,
+)